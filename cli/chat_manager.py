@@ -21,6 +21,7 @@ class ChatManager:
         s_pub_k (str): The server's RSA public key.
         public_key (str): The user's public key.
         private_key (str): The user's private key.
+        uid (str): The user ID, to tell the user's own messages among synced ones.
 
     Attributes:
         console (Console): The console object for printing messages.
@@ -32,6 +33,8 @@ class ChatManager:
         public_key (str): The user's public key.
         private_key (str): The user's private key.
         config (dict): Configuration settings for the chat manager.
+        uid (str): The user ID, None if it is unknown.
+        unread (dict): Number of unread messages per chat ID, as of the last sync.
         db_conn (sqlite3.Connection): Connection to the chats database.
         db_cursor (sqlite3.Cursor): Cursor for executing database queries.
 
@@ -45,7 +48,8 @@ class ChatManager:
             auth,
             s_pub_k,
             public_key,
-            private_key):
+            private_key,
+            uid=None):
         self.console = Console()
         self.chats = []
         self.username = username
@@ -55,6 +59,7 @@ class ChatManager:
         self.public_key = public_key
         self.private_key = private_key
         self.config = config
+        self.uid = uid
         self.db_conn = sqlite3.connect('chats.db', check_same_thread=False)
         self.db_cursor = self.db_conn.cursor()
         self.db_cursor.execute("""
@@ -66,6 +71,13 @@ class ChatManager:
                 cid TEXT
             )
         """)
+        self.db_cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sync_tokens (
+                username TEXT PRIMARY KEY,
+                token TEXT
+            )
+        """)
+        self.unread = {}
         self.load_existing_chats()
 
     def main_menu(self):
@@ -101,7 +113,7 @@ class ChatManager:
         # aes_key - bytes
         aes_key, cid = a
         new_chat = ChatUI(self.config, f"{self.username}",
-                          interlocutor, cid, self.auth, aes_key)
+                          interlocutor, cid, self.auth, aes_key, self.uid)
 
         aes_key_b64 = base64.b64encode(aes_key).decode("utf-8")
 
@@ -116,7 +128,11 @@ class ChatManager:
 
     def load_existing_chats(self):
         """
-        Loads existing chats from the database and server.
+        Loads existing chats from the database and the chats created since the previous sync from the server.
+
+        Only new chats have their keys decrypted, they are saved to the database. The new messages returned by
+        sync are saved to the database of their chats, so opening a chat only fetches what arrived after the sync.
+        Servers without sync return all chats.
         """
         # Fetch chats from the local database
         self.db_cursor.execute("""
@@ -135,28 +151,79 @@ class ChatManager:
                 row[1],
                 row[2],
                 self.auth,
-                k_aes)  # aes here also patched
+                k_aes,  # aes here also patched
+                self.uid)
             self.chats.append(chat)
 
-        # Fetch chats from the server
+        # Fetch the chats created since the previous session from the server
+        local_cids = {chat.cid for chat in self.chats}
         chat_protocol = ChatProtocol(self.config, self.auth, self.s_pub_k)
-        server_chats = chat_protocol.list_chats()
-        if server_chats:
-            for chat in server_chats:
-                if chat not in self.chats:
-                    interlocutor = chat["init_login"] if chat[
-                        "init_login"] != f"{self.username}@{self.hostname}" else chat["dst_login"]
-                    username = f"{self.username}@{self.hostname}"
-                    new_chat = ChatUI(
-                        self.config,
-                        username,
-                        interlocutor,
-                        chat["cid"],
-                        self.auth,
-                        rsa_decrypt(
-                            chat["aes"],
-                            self.private_key))
-                    self.chats.append(new_chat)
+        data = chat_protocol.sync(self.load_sync_token())
+        if data:
+            server_chats = data["chats"]
+            self.unread = {u["cid"]: u["unread"] for u in data["updates"]}
+        else:
+            server_chats = chat_protocol.list_chats() or []
+
+        username = f"{self.username}@{self.hostname}"
+        for chat in server_chats:
+            # A sync with an expired token returns all chats again
+            if chat["cid"] in local_cids:
+                continue
+
+            interlocutor = chat["init_login"] if chat[
+                "init_login"] != username else chat["dst_login"]
+            aes_key = rsa_decrypt(chat["aes"], self.private_key)
+            new_chat = ChatUI(
+                self.config,
+                username,
+                interlocutor,
+                chat["cid"],
+                self.auth,
+                aes_key,
+                self.uid)
+            self.chats.append(new_chat)
+            local_cids.add(chat["cid"])
+
+            # Saved locally, the next sync returns only newer chats
+            self.db_cursor.execute("""
+                INSERT INTO chats (username, interlocutor, aes_key, cid)
+                VALUES (?, ?, ?, ?)
+            """, (username, interlocutor, base64.b64encode(aes_key).decode("utf-8"), chat["cid"]))
+        self.db_conn.commit()
+
+        if data:
+            chats = {chat.cid: chat for chat in self.chats}
+            for update in data["updates"]:
+                if update["cid"] in chats:
+                    chats[update["cid"]].save_synced(update)
+            self.save_sync_token(data["token"])
+
+    def load_sync_token(self):
+        """
+        Loads the token of the previous sync of the user.
+
+        Returns:
+            str: The sync token, None if the user has never synced.
+        """
+        self.db_cursor.execute("""
+            SELECT token FROM sync_tokens WHERE username = ?
+        """, (f"{self.username}@{self.hostname}",))
+        row = self.db_cursor.fetchone()
+        return row[0] if row else None
+
+    def save_sync_token(self, token):
+        """
+        Saves the token of the last sync of the user.
+
+        Args:
+            token (str): The sync token returned by the server.
+        """
+        self.db_cursor.execute("""
+            INSERT OR REPLACE INTO sync_tokens (username, token)
+            VALUES (?, ?)
+        """, (f"{self.username}@{self.hostname}", token))
+        self.db_conn.commit()
 
     def enter_existing_chat(self):
         """
@@ -167,8 +234,10 @@ class ChatManager:
             return
 
         for index, chat in enumerate(self.chats):
+            unread = self.unread.get(chat.cid)
+            suffix = f" ({unread} unread)" if unread else ""
             self.console.print(
-                f"[{index}] {chat.username} - {chat.interlocutor}")
+                f"[{index}] {chat.username} - {chat.interlocutor}{suffix}")
         chat_index = int(Prompt.ask("Select a chat"))
         if 0 <= chat_index < len(self.chats):
             self.chats[chat_index].start()
@@ -6,11 +6,18 @@ import queue
 import threading
 import time
 import sqlite3
-import websocket
+from websockets.sync.client import connect
+from websockets.exceptions import ConnectionClosed, WebSocketException
 import json
+import msgpack
 from encryption_utils import aes_decrypt, aes_encrypt
+from message_utils import ChatProtocol
+from datetime import datetime, timezone
 import base64
 
+# Subprotocol of the binary framing: msgpack frames with raw ciphertexts
+MSGPACK_SUBPROTOCOL = "pych.msgpack"
+
 
 class ChatUI:
     """
@@ -23,9 +30,12 @@ class ChatUI:
         cid (int): The chat ID.
         auth (str): The authentication token.
         aes_key (str): The AES encryption key.
+        uid (str): The user ID, to tell the user's own messages among synced ones.
 
     Attributes:
+        config (dict): The configuration settings.
         ws_url (str): The WebSocket URL.
+        compression (str): "deflate" to offer permessage-deflate, None to turn compression off.
         console (Console): The console object for printing messages.
         messages (Queue): The queue to store incoming messages.
         running (bool): Flag indicating if the chat UI is running.
@@ -34,9 +44,13 @@ class ChatUI:
         cid (int): The chat ID.
         auth (str): The authentication token.
         aes_key (bytes): The AES encryption key.
+        uid (str): The user ID, None if it is unknown.
         db_conn (sqlite3.Connection): The SQLite database connection.
         db_cursor (sqlite3.Cursor): The database cursor.
         ws (WebSocket): The WebSocket connection.
+        last_seq (int): The number of the last message received in the chat, None before the first one.
+            It is kept in the database, so the client resumes after it on the next start.
+        binary (bool): Whether the server accepted the msgpack framing.
 
     """
 
@@ -47,8 +61,11 @@ class ChatUI:
             interlocutor,
             cid,
             auth,
-            aes_key: bytes):
+            aes_key: bytes,
+            uid=None):
+        self.config = config
         self.ws_url = f"ws://{config['server_host']}:{config['ws_port']}/ws"
+        self.compression = "deflate" if config.get('ws_compression', True) else None
         self.console = Console()
         self.messages = queue.Queue()
         self.running = True
@@ -57,18 +74,41 @@ class ChatUI:
         self.cid = cid  # chat id
         self.auth = auth
         self.aes_key = aes_key
+        self.uid = uid
         self.db_conn = sqlite3.connect('chats.db', check_same_thread=False)
         self.db_cursor = self.db_conn.cursor()
         self.ws = None
+        self.binary = False
         self.db_cursor.execute("""
             CREATE TABLE IF NOT EXISTS messages (
                 id INTEGER PRIMARY KEY,
                 cid INTEGER,
                 sender TEXT,
                 message TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                seq INTEGER
             )
         """)
+        # Databases created before messages were numbered
+        columns = [row[1] for row in self.db_cursor.execute("PRAGMA table_info(messages)")]
+        if "seq" not in columns:
+            self.db_cursor.execute("ALTER TABLE messages ADD COLUMN seq INTEGER")
+        # A message received both by sync and by the WebSocket is stored once, sent messages have no number
+        self.db_cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS messages_cid_seq ON messages (cid, seq)
+        """)
+        self.db_cursor.execute("""
+            CREATE TABLE IF NOT EXISTS history_gaps (
+                cid TEXT PRIMARY KEY,
+                cursor TEXT,
+                after_seq INTEGER
+            )
+        """)
+        self.db_conn.commit()
+        self.db_cursor.execute("""
+            SELECT MAX(seq) FROM messages WHERE cid = ?
+        """, (self.cid,))
+        self.last_seq = self.db_cursor.fetchone()[0]
 
     def display_messages(self):
         """
@@ -107,13 +147,13 @@ class ChatUI:
 
             # допустим, что ключ - bytes
             enc_message = aes_encrypt(message.encode(), self.aes_key)
-            b64_message = base64.b64encode(enc_message).decode()
-            self.send_ws(b64_message)
+            self.send_ws(enc_message)
 
     def start(self):
         """
         Starts the chat UI.
         """
+        self.fill_history_gap()
         self.load_chat_history()
         self.connect_ws()
         threading.Thread(target=self.display_messages, daemon=True).start()
@@ -128,7 +168,7 @@ class ChatUI:
             SELECT sender, message, timestamp
             FROM messages
             WHERE cid = ?
-            ORDER BY timestamp ASC
+            ORDER BY timestamp ASC, id ASC
         """, (self.cid,))
         rows = self.db_cursor.fetchall()
         for row in rows:
@@ -143,19 +183,111 @@ class ChatUI:
         if self.ws:
             self.ws.close()
 
-    def receive_message(self, message: str):
+    def receive_message(self, message: str, seq=None):
         """
-        Receives a message from the interlocutor.
+        Receives a message from the interlocutor, a message already stored by sync isn't shown again.
 
         Args:
             message (str): The received message.
+            seq (int): The number of the message in the chat, None for servers that don't number messages.
+        """
+
+        self.db_cursor.execute("""
+            INSERT OR IGNORE INTO messages (cid, sender, message, seq)
+            VALUES (?, ?, ?, ?)
+        """, (self.cid, self.interlocutor, message, seq))
+        self.db_conn.commit()
+        if self.db_cursor.rowcount:
+            self.messages.put((self.interlocutor, message))
+
+    def save_messages(self, items):
+        """
+        Saves messages of the interlocutor fetched from the server (sync or history) to the database.
+
+        The user's own messages are skipped, as the WebSocket doesn't deliver them either. Messages keep their
+        timestamps, so older messages fetched later are shown in their place.
+
+        Args:
+            items (list): The messages as returned by the server.
+
+        Returns:
+            int: The number of the newest saved message, None if there is none.
+        """
+        last = None
+        for item in items:
+            if self.uid is not None and item.get("author_id") == self.uid:
+                continue
+
+            try:
+                message = aes_decrypt(base64.b64decode(item["msg"]), self.aes_key)
+            except ValueError:
+                continue  # Not written by a chat client
+            if not message:
+                continue
+
+            timestamp = datetime.fromtimestamp(item["timestamp"], timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+            self.db_cursor.execute("""
+                INSERT OR IGNORE INTO messages (cid, sender, message, timestamp, seq)
+                VALUES (?, ?, ?, ?, ?)
+            """, (self.cid, self.interlocutor, message.decode(), timestamp, item.get("seq")))
+            if item.get("seq") is not None:
+                last = max(last or 0, item["seq"])
+        self.db_conn.commit()
+        return last
+
+    def save_synced(self, update):
+        """
+        Saves the new messages of the chat returned by sync.
+
+        Sync returns only the newest new messages. If older ones are left out, the cursor of the update is kept
+        with the number of the last message the client had, and the gap is filled from the chat history when
+        the chat is opened. The next connection resumes after the saved messages.
+
+        Args:
+            update (dict): The update of the chat returned by sync.
+        """
+        after_seq = self.last_seq
+        last = self.save_messages(update["messages"])
+        if last is not None:
+            self.last_seq = max(self.last_seq or 0, last)
+
+        # Without earlier messages the client never had the older history, there is no gap to fill
+        if update.get("cursor") and after_seq is not None:
+            self.db_cursor.execute("""
+                INSERT INTO history_gaps (cid, cursor, after_seq)
+                VALUES (?, ?, ?)
+                ON CONFLICT (cid) DO UPDATE SET cursor = excluded.cursor
+            """, (self.cid, update["cursor"], after_seq))
+            self.db_conn.commit()
+
+    def fill_history_gap(self):
+        """
+        Fetches the messages sync left out from the chat history, newest first, down to the last message
+        the client had before the sync.
         """
+        self.db_cursor.execute("""
+            SELECT cursor, after_seq FROM history_gaps WHERE cid = ?
+        """, (self.cid,))
+        row = self.db_cursor.fetchone()
+        if row is None:
+            return
+
+        cursor, after_seq = row
+        chat_protocol = ChatProtocol(self.config, self.auth, None)
+        while cursor:
+            page = chat_protocol.history(self.cid, cursor)
+            if not page:
+                return  # Server is unavailable, retry on the next start
+            messages, cursor = page
+
+            gap = [m for m in messages if m.get("seq") is not None and m["seq"] > after_seq]
+            self.save_messages(gap)
+            if len(gap) < len(messages):
+                break
 
-        self.messages.put((self.interlocutor, message))
         self.db_cursor.execute("""
-            INSERT INTO messages (cid, sender, message)
-            VALUES (?, ?, ?)
-        """, (self.cid, self.interlocutor, message))
+            DELETE FROM history_gaps WHERE cid = ?
+        """, (self.cid,))
         self.db_conn.commit()
 
     def receive_messages(self):
@@ -165,40 +297,127 @@ class ChatUI:
         while self.running:
             if self.ws:
                 raw_msg = self.receive_ws()
-                b64_message = json.loads(raw_msg)["msg"]
-                b64_decoded = base64.b64decode(b64_message)
-
-                message = aes_decrypt(
-                    b64_decoded,
-                    self.aes_key
-                )
-                if message:
-                    self.receive_message(message.decode())
+                if not raw_msg:
+                    # The connection dropped, resume after the last received message
+                    if self.running:
+                        self.reconnect_ws()
+                    continue
+
+                frame = self.load_frame(raw_msg)
+                for seq, enc_message in self.unpack_messages(frame):
+                    if seq is not None:
+                        self.last_seq = seq
+
+                    message = aes_decrypt(
+                        enc_message,
+                        self.aes_key
+                    )
+                    if message:
+                        self.receive_message(message.decode(), seq)
             time.sleep(0.1)  # Reduce CPU usage
 
     def connect_ws(self):
         """
         Connects to the WebSocket server.
+
+        After a message was received, the server is asked to resume after it, so the messages sent while
+        the client was disconnected are received exactly once. The msgpack framing is offered,
+        servers that don't support it are talked to in JSON. permessage-deflate is offered unless
+        compression is turned off.
         """
-        self.ws = websocket.WebSocket()
-        self.ws.connect(self.ws_url)
-        self.ws.send(json.dumps({
+        self.ws = connect(
+            self.ws_url,
+            subprotocols=[MSGPACK_SUBPROTOCOL],
+            compression=self.compression,
+            # Both servers answer pings, so a half-open connection is detected by the keepalive even when idle
+            ping_interval=20,
+            ping_timeout=20,
+            # The connection outlives this method, so it isn't opened as a context manager
+            legacy=True,
+        )
+        self.binary = self.ws.subprotocol == MSGPACK_SUBPROTOCOL
+
+        auth_frame = {
             "token": self.auth,
             "dest_login": self.interlocutor,
-        }))
+            "batch": True,
+        }
+        if self.last_seq is not None:
+            auth_frame["resume_from"] = self.last_seq
+        self.send_frame(auth_frame)
         self.ws.recv()
 
+    def reconnect_ws(self):
+        """
+        Reconnects to the WebSocket server after the connection dropped.
+        """
+        try:
+            self.connect_ws()
+        except (OSError, WebSocketException):
+            time.sleep(1)  # Server is unavailable, retry on the next receive
+
+    def send_frame(self, frame):
+        """
+        Sends a frame in the negotiated framing.
+
+        Args:
+            frame (dict): The frame to be sent.
+        """
+        if self.binary:
+            self.ws.send(msgpack.packb(frame, use_bin_type=True))
+        else:
+            self.ws.send(json.dumps(frame))
+
+    def load_frame(self, raw_msg):
+        """
+        Parses a frame received in the negotiated framing.
+
+        Args:
+            raw_msg (str | bytes): The received frame.
+
+        Returns:
+            dict: The parsed frame.
+        """
+        if self.binary:
+            return msgpack.unpackb(raw_msg, raw=False)
+        return json.loads(raw_msg)
+
+    @staticmethod
+    def unpack_messages(frame):
+        """
+        Extracts the messages of a received frame, batch frames carry several.
+
+        Args:
+            frame (dict): The parsed frame.
+
+        Returns:
+            list: The (seq, ciphertext) pairs of the messages, oldest first. seq is None for servers that don't
+            number messages, the ciphertext is bytes in both framings.
+        """
+        messages = []
+        for item in frame.get("messages", [frame]):
+            enc_message = item["msg"]
+            if not isinstance(enc_message, bytes):
+                enc_message = base64.b64decode(enc_message)
+            messages.append((item.get("seq"), enc_message))
+        return messages
+
     def send_ws(self, message):
         """
         Sends a message through the WebSocket connection.
 
+        The ciphertext is sent as raw bytes in the msgpack framing and base64-encoded in JSON.
+
         Args:
-            message (str): The message to be sent.
+            message (bytes): The encrypted message to be sent.
         """
-        self.ws.send(json.dumps({
+        if not self.binary:
+            message = base64.b64encode(message).decode()
+
+        self.send_frame({
             "msg": message,
             "timestamp": time.time(),
-        }))
+        })
 
     def receive_ws(self):
         """
@@ -210,5 +429,5 @@ class ChatUI:
         try:
             message = self.ws.recv()
             return message
-        except websocket.WebSocketConnectionClosedException:
+        except ConnectionClosed:
             return None
@@ -117,7 +117,8 @@ class Menu:
                 auth=login[0],
                 s_pub_k=login[1],
                 private_key=self.private_key,
-                public_key=self.public_key)
+                public_key=self.public_key,
+                uid=self.auth_system.logged_in_uid)
         else:
             self.console.print(
                 "Invalid username or password", style="bold red")
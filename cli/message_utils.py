@@ -81,3 +81,53 @@ class ChatProtocol:
         if response.status_code == 200 and data['status'] == 'ok':
             return data['chats']
         return False
+
+    def sync(self, token=None):
+        """
+        Retrieves the chats and messages created since the previous sync.
+
+        Args:
+            token (str): The token returned by the previous sync, None for the first sync.
+
+        Returns:
+            dict: The new chats, the chat updates and the next token if the retrieval is successful, False otherwise.
+        """
+        url = f"http://{self.config['server_host']}:{self.config['server_port']}/api/sync"
+
+        headers = {
+            'Auth': self.auth,
+        }
+        params = {'since': token} if token else {}
+
+        response = requests.request("GET", url, headers=headers, params=params)
+
+        data = response.json()
+        if response.status_code == 200 and data['status'] == 'ok':
+            return data
+        return False
+
+    def history(self, cid, before=None):
+        """
+        Retrieves a page of the message history of a chat, newest first.
+
+        Args:
+            cid (str): The chat ID.
+            before (str): The cursor returned with the previous page, None for the newest messages.
+
+        Returns:
+            tuple: The messages and the cursor of the next (older) page, None on the last page,
+            if the retrieval is successful, False otherwise.
+        """
+        url = f"http://{self.config['server_host']}:{self.config['server_port']}/api/chat/{cid}/messages"
+
+        headers = {
+            'Auth': self.auth,
+        }
+        params = {'before': before} if before else {}
+
+        response = requests.request("GET", url, headers=headers, params=params)
+
+        data = response.json()
+        if response.status_code == 200 and data['status'] == 'ok':
+            return data['messages'], data['cursor']
+        return False
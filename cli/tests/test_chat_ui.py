@@ -0,0 +1,113 @@
+import os
+import json
+import base64
+import msgpack
+import tempfile
+import unittest
+from unittest.mock import patch
+from cli.chat_ui import ChatUI
+from cli.encryption_utils import aes_encrypt, generate_aes_key
+
+
+class TestChatUI(unittest.TestCase):
+
+    def setUp(self):
+        # ChatUI keeps its messages in chats.db of the working directory
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+        self.config = {
+            'server_host': 'localhost',
+            'server_port': 8080,
+            'ws_port': 8081,
+        }
+        self.aes_key = generate_aes_key().encode()
+        self.chat = self.open_chat()
+
+    def tearDown(self):
+        self.chat.db_conn.close()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def open_chat(self):
+        return ChatUI(self.config, 'alice@h', 'bob@h', 'c1', 'my_auth_token', self.aes_key, uid='alice')
+
+    def message(self, seq, text, author='bob'):
+        return {
+            'mid': f'm{seq}',
+            'msg': base64.b64encode(aes_encrypt(text.encode(), self.aes_key)).decode(),
+            'author_id': author,
+            'timestamp': 1700000000 + seq,
+            'seq': seq,
+        }
+
+    def saved(self, chat):
+        chat.db_cursor.execute("""
+            SELECT message, seq FROM messages WHERE cid = ? ORDER BY timestamp ASC, id ASC
+        """, (chat.cid,))
+        return chat.db_cursor.fetchall()
+
+    def test_synced_messages_are_saved_once(self):
+        self.chat.save_synced({
+            'messages': [self.message(1, 'hi'), self.message(2, 'mine', author='alice')],
+            'cursor': 'older',
+        })
+
+        # The WebSocket delivers the message again, it isn't shown twice
+        self.chat.receive_message('hi', 1)
+        self.assertTrue(self.chat.messages.empty())
+        self.assertEqual(self.saved(self.chat), [('hi', 1)])
+
+        # The next start resumes after the synced messages, the client had nothing older: no gap
+        reopened = self.open_chat()
+        self.assertEqual(reopened.last_seq, 1)
+        with patch('cli.chat_ui.ChatProtocol') as mock_protocol:
+            reopened.fill_history_gap()
+            mock_protocol.return_value.history.assert_not_called()
+        reopened.db_conn.close()
+
+    def test_history_gap_is_filled(self):
+        self.chat.receive_message('one', 1)
+        self.chat.db_conn.close()
+        self.chat = self.open_chat()
+        self.chat.save_synced({'messages': [self.message(5, 'five'), self.message(6, 'six')], 'cursor': 'c5'})
+
+        pages = [
+            ([self.message(4, 'four'), self.message(3, 'three')], 'c3'),
+            ([self.message(2, 'two'), self.message(1, 'one')], 'c1'),
+        ]
+        with patch('cli.chat_ui.ChatProtocol') as mock_protocol:
+            mock_protocol.return_value.history.side_effect = pages
+            self.chat.fill_history_gap()
+            self.assertEqual(
+                [call.args for call in mock_protocol.return_value.history.call_args_list],
+                [('c1', 'c5'), ('c1', 'c3')]
+            )
+
+            # The gap is filled once
+            self.chat.fill_history_gap()
+            self.assertEqual(mock_protocol.return_value.history.call_count, 2)
+
+        self.assertEqual(sorted(seq for _, seq in self.saved(self.chat)), [1, 2, 3, 4, 5, 6])
+
+
+    def test_batch_frame_is_unpacked(self):
+        ciphertexts = [os.urandom(16 + seq) for seq in range(1, 4)]
+        items = [{'mid': f'm{seq}', 'msg': msg, 'seq': seq} for seq, msg in enumerate(ciphertexts, 1)]
+
+        # The msgpack framing sends raw ciphertexts, the JSON framing base64 ones
+        self.chat.binary = True
+        frame = self.chat.load_frame(msgpack.packb({'messages': items}, use_bin_type=True))
+        self.assertEqual(ChatUI.unpack_messages(frame), list(enumerate(ciphertexts, 1)))
+
+        self.chat.binary = False
+        frame = self.chat.load_frame(json.dumps({'messages': [
+            {**item, 'msg': base64.b64encode(item['msg']).decode()} for item in items
+        ]}))
+        self.assertEqual(ChatUI.unpack_messages(frame), list(enumerate(ciphertexts, 1)))
+
+    def test_single_message_frame_is_unpacked(self):
+        frame = {'msg': base64.b64encode(b'ciphertext').decode(), 'seq': None}
+
+        self.assertEqual(ChatUI.unpack_messages(frame), [(None, b'ciphertext')])
@@ -93,6 +93,61 @@ class TestChatProtocol(unittest.TestCase):
 
             self.assertFalse(result)
 
+    def test_sync_sends_token(self):
+        expected_response = {
+            'status': 'ok',
+            'token': 'next_token',
+            'chats': [],
+            'updates': []
+        }
+
+        with patch('requests.request') as mock_request:
+            mock_request.return_value.status_code = 200
+            mock_request.return_value.json.return_value = expected_response
+
+            result = self.protocol.sync('prev_token')
+
+            mock_request.assert_called_once_with(
+                "GET",
+                f"http://{self.config['server_host']}:{self.config['server_port']}/api/sync",
+                headers={
+                    'Auth': self.auth},
+                params={'since': 'prev_token'})
+
+            self.assertEqual(result, expected_response)
+
+    def test_first_sync_has_no_token(self):
+        with patch('requests.request') as mock_request:
+            mock_request.return_value.status_code = 401
+            mock_request.return_value.json.return_value = {'title': 'Not authorized'}
+
+            result = self.protocol.sync()
+
+            self.assertEqual(mock_request.call_args.kwargs['params'], {})
+            self.assertFalse(result)
+
+    def test_history_page(self):
+        expected_response = {
+            'status': 'ok',
+            'messages': [{'mid': 'm2', 'seq': 2}],
+            'cursor': 'older'
+        }
+
+        with patch('requests.request') as mock_request:
+            mock_request.return_value.status_code = 200
+            mock_request.return_value.json.return_value = expected_response
+
+            result = self.protocol.history('c1', 'newer')
+
+            mock_request.assert_called_once_with(
+                "GET",
+                f"http://{self.config['server_host']}:{self.config['server_port']}/api/chat/c1/messages",
+                headers={
+                    'Auth': self.auth},
+                params={'before': 'newer'})
+
+            self.assertEqual(result, (expected_response['messages'], 'older'))
+
 
 if __name__ == '__main__':
     unittest.main()
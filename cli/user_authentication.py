@@ -14,6 +14,7 @@ class UserAuthentication:
 
     Attributes:
         logged_in_user (str): Currently logged in user.
+        logged_in_uid (str): The user ID of the logged in user, None if the server didn't return it.
         config (dict): Configuration settings.
 
     Methods:
@@ -28,6 +29,7 @@ class UserAuthentication:
 
     def __init__(self, config):
         self.logged_in_user = None
+        self.logged_in_uid = None
         self.config = config
         self.create_users_table()
 
@@ -167,5 +169,6 @@ class UserAuthentication:
         data = response.json()
         if response.status_code == 200 and data.get("status") == "ok":
             self.logged_in_user = f"{username}@{hostname}"
+            self.logged_in_uid = data.get("uid")
             return response.headers["Auth"], data.get("s_pub_k")
         return False
@@ -0,0 +1,114 @@
+import threading
+
+# Route class of resources that don't set one, and its limit when a class has no limit of its own
+DEFAULT_CLASS = "default"
+
+# Route class of WebSocket connections
+WS_CLASS = "ws"
+
+# WebSocket close code of shed connections (RFC 6455, section 7.4.1: Try Again Later)
+TRY_AGAIN_LATER = 1013
+
+
+class AdmissionControl:
+    """
+    Admission control: counts the work in flight by route class and refuses work past the limit of its class.
+
+    Every route class has its own limit, so a saturated class (e.g. chat lists) sheds its own requests while the
+    others (status, login) are still served. Limits are per process.
+
+    Attributes:
+        limits: The maximum work in flight by route class, 0 for no limit. A class without a limit of its
+                own uses the limit of DEFAULT_CLASS.
+        active: The work in flight by route class.
+        shed: The number of refused requests by route class.
+    """
+
+    def __init__(self, limits):
+        """
+        Initialize the AdmissionControl.
+
+        Args:
+            limits: The maximum work in flight by route class.
+        """
+
+        self.limits = dict(limits)
+        self.lock = threading.Lock()
+        self.active = {}
+        self.shed = {}
+
+    def limit(self, route_class):
+        """
+        Get the limit of a route class.
+
+        Args:
+            route_class: The route class.
+
+        Returns:
+            The maximum work in flight, 0 for no limit.
+        """
+
+        return self.limits.get(route_class, self.limits.get(DEFAULT_CLASS, 0))
+
+    def try_acquire(self, route_class):
+        """
+        Admit work of a route class if the class is under its limit, admitted work must be released.
+
+        Args:
+            route_class: The route class.
+
+        Returns:
+            True if the work is admitted, False if it must be shed.
+        """
+
+        limit = self.limit(route_class)
+        with self.lock:
+            active = self.active.get(route_class, 0)
+            if limit and active >= limit:
+                self.shed[route_class] = self.shed.get(route_class, 0) + 1
+                return False
+
+            self.active[route_class] = active + 1
+            return True
+
+    def release(self, route_class):
+        """
+        Release admitted work of a route class.
+
+        Args:
+            route_class: The route class.
+        """
+
+        with self.lock:
+            self.active[route_class] -= 1
+
+    def stats(self):
+        """
+        Get the counters of the route classes that have seen work.
+
+        Returns:
+            A dictionary with the work in flight and the number of refused requests of every route class.
+        """
+
+        with self.lock:
+            stats = {}
+            for route_class in sorted(self.active.keys() | self.shed.keys()):
+                stats[f"{route_class}_active"] = self.active.get(route_class, 0)
+                stats[f"{route_class}_shed"] = self.shed.get(route_class, 0)
+            return stats
+
+
+def get_ws_admission(admission):
+    """
+    Get the admission control of the connections of a WebSocket server.
+
+    Args:
+        admission: The admission configuration (cfg.admission).
+
+    Returns:
+        The AdmissionControl limiting WS_CLASS to ws_connections, None if admission control is disabled.
+    """
+
+    if not admission['enabled']:
+        return None
+    return AdmissionControl({WS_CLASS: admission['ws_connections']})
@@ -0,0 +1,106 @@
+import threading
+from collections import defaultdict
+
+
+class ChatBroker:
+    """
+    In-process publish/subscribe broker keyed by chat id.
+
+    Connections subscribe a callback for the chat they are bound to, and every message stored for that chat
+    is pushed to the callbacks right after it is written, so nobody has to poll the database for new messages.
+
+    Attributes:
+        lock: Lock guarding the subscribers table.
+        subscribers: Mapping of chat id to the set of subscribed callbacks.
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty ChatBroker.
+        """
+
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(set)
+
+    def subscribe(self, chat_id, callback):
+        """
+        Subscribe a callback to the messages of a chat.
+
+        Args:
+            chat_id: The identifier of the chat.
+            callback: A callable that accepts the published message.
+        """
+
+        with self.lock:
+            self.subscribers[str(chat_id)].add(callback)
+
+    def unsubscribe(self, chat_id, callback):
+        """
+        Remove a previously subscribed callback.
+
+        Args:
+            chat_id: The identifier of the chat.
+            callback: The callback passed to subscribe.
+        """
+
+        chat_id = str(chat_id)
+        with self.lock:
+            callbacks = self.subscribers.get(chat_id)
+            if callbacks is None:
+                return
+
+            callbacks.discard(callback)
+            if not callbacks:
+                del self.subscribers[chat_id]
+
+    def publish(self, chat_id, message):
+        """
+        Deliver a message to every subscriber of a chat.
+
+        Callbacks are invoked outside the lock, so a subscriber may unsubscribe from its own callback.
+        A failing callback doesn't prevent delivery to the others.
+
+        Args:
+            chat_id: The identifier of the chat.
+            message: The message to deliver.
+
+        Returns:
+            The number of subscribers the message was delivered to.
+        """
+
+        with self.lock:
+            callbacks = list(self.subscribers.get(str(chat_id), ()))
+
+        delivered = 0
+        for callback in callbacks:
+            try:
+                callback(message)
+                delivered += 1
+            except Exception as e:
+                print(e)
+        return delivered
+
+    def subscriber_count(self, chat_id):
+        """
+        Get the number of subscribers of a chat.
+
+        Args:
+            chat_id: The identifier of the chat.
+
+        Returns:
+            The number of callbacks subscribed to the chat.
+        """
+
+        with self.lock:
+            return len(self.subscribers.get(str(chat_id), ()))
+
+    def stats(self):
+        """
+        Get the counters of the broker.
+
+        Returns:
+            A dictionary with the number of chats with subscribers.
+        """
+
+        with self.lock:
+            return {"subscribed_chats": len(self.subscribers)}
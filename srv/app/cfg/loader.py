@@ -14,9 +14,56 @@ class Config:
         env: Environment setting, defaults to 'dev'.
         secret: Secret key for encryption, generated using Fernet.
         rsa_secret: RSA secret key.
-        rest: Configuration for REST API including host and port.
+        rest: Configuration for REST API including host, port and the
+            server: simple (wsgiref, for development) or gunicorn with
+            workers pre-forked processes, threads per worker, keepalive
+            and timeout in seconds.
+        ws: Configuration for the WebSocket server including host, port,
+            server mode (threaded or asyncio), the size of the executor
+            for blocking storage calls in asyncio mode, the number of
+            messages replayed per storage request on resume, the
+            maximum number of messages and bytes of a batch frame, the
+            limit of the send queue of a connection and what happens when
+            a slow client overflows it (drop_oldest - the oldest messages
+            are dropped and resent from storage, disconnect - the client
+            is evicted), the interval in seconds of the connection stats
+            in the log (0 disables them), the heartbeats (a client silent
+            for ping_interval seconds is pinged and reaped if it stays
+            silent for ping_timeout seconds more, 0 disables them) and
+            the seconds a client may take to authenticate.
+        deflate: permessage-deflate of WebSocket connections: the zlib
+            level, window bits and memory level (smaller windows and
+            levels take less memory per connection), whether the
+            compression context is kept between messages and the size
+            below which messages are sent uncompressed.
+        admission: Admission control: the limits of requests in flight
+            per route class and REST worker process (status, auth,
+            search, chat, sync, and default for the others, 0 - no
+            limit), the Retry-After seconds of shed requests and the limit
+            of open connections per WebSocket server process. Requests
+            and connections past the limits are shed with 503 or close
+            code 1013.
         mongo: MongoDB connection settings including connection
             link and database name.
+        cache: Sizes and time to live (in seconds) of in-process caches.
+        keypool: The number of pre-generated RSA key pairs for registration
+            and of the worker processes generating them (size 0 disables
+            the pool). The pool is shared by all REST workers, so both are
+            totals per server, not per gunicorn worker.
+        write_buffer: The write-behind buffer of new WebSocket messages,
+            written with insert_many in batches of up to batch_size
+            messages, or after flush_interval_ms milliseconds, with at
+            most max_in_flight messages waiting to be written.
+        fanout: Cluster fanout of WebSocket messages: every node tails the
+            change stream of the messages collection (MongoDB must run as
+            a replica set) and delivers the messages of all nodes to its
+            connections, the seconds before a failed stream is reopened.
+        history: The number of messages in a page of chat history when the
+            client doesn't ask for a limit and the largest allowed limit.
+        sync: The number of the newest new messages returned per chat by
+            sync and the largest returned number of unread messages.
+        search: The number of users returned by user search when the
+            client doesn't ask for a limit and the largest allowed limit.
     """
 
     def __init__(self, path: str):
@@ -37,7 +84,53 @@ class Config:
 
         self.rest = {
             'host': 'localhost',
-            'port': 8080
+            'port': 8080,
+            'server': 'simple',
+            'workers': 4,
+            'threads': 8,
+            'worker_class': 'gthread',
+            'keepalive': 5,
+            'timeout': 30,
+        }
+
+        self.ws = {
+            'host': '0.0.0.0',
+            'port': 8080,
+            'mode': 'threaded',
+            'executor_workers': 32,
+            'max_size': 2 ** 16,
+            'replay_batch': 100,
+            'batch_max_messages': 100,
+            'batch_max_bytes': 2 ** 15,
+            'send_queue_limit': 1000,
+            'send_queue_policy': 'drop_oldest',
+            'stats_interval': 60,
+            'ping_interval': 20,
+            'ping_timeout': 20,
+            'auth_timeout': 10,
+        }
+
+        self.deflate = {
+            'enabled': False,
+            'level': 6,
+            'window_bits': 15,
+            'mem_level': 8,
+            'context_takeover': True,
+            'min_size': 256,
+        }
+
+        self.admission = {
+            'enabled': True,
+            'retry_after': 1,
+            'rest_limits': {
+                'status': 0,
+                'auth': 4,
+                'search': 4,
+                'chat': 6,
+                'sync': 6,
+                'default': 6,
+            },
+            'ws_connections': 10000,
         }
 
         self.mongo = {
@@ -45,6 +138,43 @@ class Config:
             'db': 'pychapp'
         }
 
+        self.cache = {
+            'users_size': 10000,
+            'users_ttl': 60,
+        }
+
+        self.keypool = {
+            'size': 16,
+            'workers': 2,
+        }
+
+        self.write_buffer = {
+            'enabled': False,
+            'batch_size': 128,
+            'flush_interval_ms': 5,
+            'max_in_flight': 4096,
+        }
+
+        self.fanout = {
+            'enabled': False,
+            'retry_delay': 1,
+        }
+
+        self.history = {
+            'default_limit': 50,
+            'max_limit': 200,
+        }
+
+        self.sync = {
+            'max_messages': 50,
+            'max_unread': 999,
+        }
+
+        self.search = {
+            'default_limit': 20,
+            'max_limit': 100,
+        }
+
         self.__load_configuration(path)
 
     def __load_configuration(self, path: str):
@@ -61,7 +191,14 @@ class Config:
                 raise Exception("Incorrect configuration file provided")
 
             for k, v in cfg['pychapp'].items():
-                if hasattr(self, k):
+                if not hasattr(self, k):
+                    continue
+
+                # Sections are merged, so omitted keys keep their defaults
+                current = getattr(self, k)
+                if isinstance(current, dict) and isinstance(v, dict):
+                    current.update(v)
+                else:
                     setattr(self, k, v)
 
 
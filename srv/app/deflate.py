@@ -0,0 +1,395 @@
+import zlib
+import threading
+from wsocket import WebSocket, WSocketApp, OPCODE_TEXT, OPCODE_BINARY
+from websockets.frames import Opcode
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+
+# Sync flush tail removed from every compressed message (RFC 7692, section 7.2.1)
+FLUSH_TAIL = 4
+
+
+class CompressionStats:
+    """
+    Byte counters of a compressed connection.
+
+    Attributes:
+        sent: The size of the sent data frames before compression.
+        sent_wire: The size of the sent data frames on the wire.
+        received: The size of the received compressed data frames after decompression.
+        received_wire: The size of the received compressed data frames on the wire.
+    """
+
+    def __init__(self):
+        """
+        Initialize zero counters.
+        """
+
+        self.sent = 0
+        self.sent_wire = 0
+        self.received = 0
+        self.received_wire = 0
+
+    def report(self):
+        """
+        Get the counters with the compression ratios (wire size / data size, lower is better).
+
+        Returns:
+            A dictionary of counters and ratios, a ratio is None if nothing was counted.
+        """
+
+        return {
+            "sent": self.sent,
+            "sent_wire": self.sent_wire,
+            "sent_ratio": round(self.sent_wire / self.sent, 3) if self.sent else None,
+            "received": self.received,
+            "received_wire": self.received_wire,
+            "received_ratio": round(self.received_wire / self.received, 3) if self.received else None,
+        }
+
+
+class CountingCompressor:
+    """
+    Wrapper of a zlib compressor counting the size of one compressed message.
+    """
+
+    def __init__(self, compressor):
+        """
+        Wrap a compressor.
+
+        Args:
+            compressor: The zlib compressor.
+        """
+
+        self.compressor = compressor
+        self.size = 0
+
+    def compress(self, data):
+        """
+        Compress data, see zlib.Compress.compress.
+        """
+
+        out = self.compressor.compress(data)
+        self.size += len(out)
+        return out
+
+    def flush(self, mode=zlib.Z_FINISH):
+        """
+        Flush the compressor, see zlib.Compress.flush.
+        """
+
+        out = self.compressor.flush(mode)
+        self.size += len(out)
+        return out
+
+
+class CountingDecompressor:
+    """
+    Wrapper of a zlib decompressor counting the received bytes of a wsocket connection.
+
+    wsocket decompresses a message with decompress(payload), decompress(FLUSH_TAIL bytes) and flush().
+    """
+
+    def __init__(self, decompressor, stats):
+        """
+        Wrap a decompressor.
+
+        Args:
+            decompressor: The zlib decompressor.
+            stats: The CompressionStats to count the bytes in.
+        """
+
+        self.decompressor = decompressor
+        self.stats = stats
+
+    def decompress(self, data):
+        """
+        Decompress data, see zlib.Decompress.decompress.
+        """
+
+        out = self.decompressor.decompress(data)
+        if len(data) != FLUSH_TAIL:
+            self.stats.received_wire += len(data)
+        self.stats.received += len(out)
+        return out
+
+    def flush(self):
+        """
+        Flush the decompressor, see zlib.Decompress.flush.
+        """
+
+        out = self.decompressor.flush()
+        self.stats.received += len(out)
+        return out
+
+
+class DeflateWebSocket(WebSocket):
+    """
+    wsocket connection with configurable permessage-deflate.
+
+    wsocket accepts a plain permessage-deflate offer, so the server always may use a 15-bit window and keep its
+    context between messages. The settings below only restrict the server: a smaller window, a fresh context per
+    message or leaving small messages uncompressed are the sender's choice and need no negotiation.
+
+    Attributes:
+        level: The zlib compression level.
+        window_bits: The base-2 logarithm of the compression window.
+        mem_level: The zlib memory level of the compressor.
+        context_takeover: Whether the compression context is kept between messages.
+        min_size: The minimum size of a message to compress.
+        stats: The CompressionStats of the connection, None if compression wasn't negotiated.
+        write_lock: The lock serializing frame writes, as the compressor is swapped while a frame is sent.
+    """
+
+    level = 6
+    window_bits = 15
+    mem_level = 8
+    context_takeover = True
+    min_size = 0
+
+    def __init__(self, environ, read, write, handler, do_compress):
+        """
+        Initialize the connection, see wsocket.WebSocket.
+        """
+
+        super().__init__(environ, read, write, handler, do_compress)
+        # Shared with HeartbeatWebSocket when both are mixed in, so all frame writes take one lock
+        if getattr(self, "write_lock", None) is None:
+            self.write_lock = threading.RLock()
+        self.stats = None
+        if do_compress:
+            self.stats = CompressionStats()
+            self.compressor = self.new_compressor()
+            self.decompressor = CountingDecompressor(self.decompressor, self.stats)
+
+    def new_compressor(self):
+        """
+        Create the compressor of outgoing messages.
+
+        Returns:
+            A zlib compressor producing raw deflate data.
+        """
+
+        return zlib.compressobj(self.level, zlib.DEFLATED, -self.window_bits, self.mem_level)
+
+    def send_frame(self, message, opcode, do_compress=False):
+        """
+        Send a frame, compressing it if compression was negotiated and the frame is at least min_size long.
+
+        Args:
+            message: The payload of the frame.
+            opcode: The opcode of the frame.
+            do_compress: Whether the frame may be compressed (optional).
+        """
+
+        if self.stats is None or not message or opcode not in (OPCODE_TEXT, OPCODE_BINARY):
+            return super().send_frame(message, opcode, do_compress)
+
+        # Frames are JSON (ASCII) or binary, so the length is their size in bytes
+        size = len(message)
+        do_compress = do_compress and size >= self.min_size
+
+        # Frames may be sent by several threads, the compressor is only swapped by the holder of the lock
+        with self.write_lock:
+            if not do_compress:
+                super().send_frame(message, opcode, False)
+                self.stats.sent += size
+                self.stats.sent_wire += size
+                return
+
+            compressor = self.compressor
+            counted = CountingCompressor(compressor)
+            self.compressor = counted
+            try:
+                super().send_frame(message, opcode, True)
+            finally:
+                self.compressor = compressor if self.context_takeover else self.new_compressor()
+
+            self.stats.sent += size
+            self.stats.sent_wire += counted.size - FLUSH_TAIL
+
+
+class DeflateWSocketApp(WSocketApp):
+    """
+    WSocketApp creating DeflateWebSocket connections, compression is refused when it is disabled.
+    """
+
+    def __init__(self, deflate, app=None, protocol=None, websocket_class=DeflateWebSocket):
+        """
+        Initialize the DeflateWSocketApp.
+
+        Args:
+            deflate: The deflate configuration (cfg.deflate).
+            app: The WSGI application (optional).
+            protocol: The WebSocket subprotocol accepted by the application (optional).
+            websocket_class: The DeflateWebSocket subclass of the connections (optional).
+        """
+
+        super().__init__(app, protocol)
+        self.deflate = deflate
+        self.websocket_class = type("ConfiguredDeflateWebSocket", (websocket_class,), {
+            "level": deflate['level'],
+            "window_bits": deflate['window_bits'],
+            "mem_level": deflate['mem_level'],
+            "context_takeover": deflate['context_takeover'],
+            "min_size": deflate['min_size'],
+        })
+
+    def __call__(self, environ, start_response):
+        """
+        Handle a request, the extension offers of the client are dropped if compression is disabled.
+        """
+
+        if not self.deflate['enabled']:
+            environ.pop("HTTP_SEC_WEBSOCKET_EXTENSIONS", None)
+        return super().__call__(environ, start_response)
+
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+    """
+    permessage-deflate extension of the websockets server leaving small messages uncompressed and counting bytes.
+
+    Attributes:
+        min_size: The minimum size of a message to compress.
+        stats: The CompressionStats of the connection.
+    """
+
+    def __init__(self, min_size, *args, **kwargs):
+        """
+        Initialize the extension, see PerMessageDeflate.
+
+        Args:
+            min_size: The minimum size of a message to compress.
+        """
+
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+        self.stats = CompressionStats()
+
+    def encode(self, frame):
+        """
+        Encode an outgoing frame, a whole message shorter than min_size is sent uncompressed.
+        """
+
+        if frame.opcode not in (Opcode.TEXT, Opcode.BINARY):
+            return super().encode(frame)
+
+        size = len(frame.data)
+        if frame.fin and size < self.min_size:
+            encoded = frame
+        else:
+            encoded = super().encode(frame)
+
+        self.stats.sent += size
+        self.stats.sent_wire += len(encoded.data)
+        return encoded
+
+    def decode(self, frame, *, max_size=None):
+        """
+        Decode an incoming frame.
+        """
+
+        if frame.opcode not in (Opcode.TEXT, Opcode.BINARY) or not frame.rsv1:
+            return super().decode(frame, max_size=max_size)
+
+        decoded = super().decode(frame, max_size=max_size)
+        self.stats.received += len(decoded.data)
+        self.stats.received_wire += len(frame.data)
+        return decoded
+
+
+class ThresholdDeflateFactory(ServerPerMessageDeflateFactory):
+    """
+    permessage-deflate factory of the websockets server creating ThresholdPerMessageDeflate extensions.
+    """
+
+    def __init__(self, min_size, **kwargs):
+        """
+        Initialize the factory, see ServerPerMessageDeflateFactory.
+
+        Args:
+            min_size: The minimum size of a message to compress.
+        """
+
+        super().__init__(**kwargs)
+        self.min_size = min_size
+
+    def process_request_params(self, params, accepted_extensions):
+        """
+        Negotiate the extension, see ServerPerMessageDeflateFactory.
+        """
+
+        response, extension = super().process_request_params(params, accepted_extensions)
+        return response, ThresholdPerMessageDeflate(
+            self.min_size,
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            self.compress_settings,
+        )
+
+
+def get_deflate_extensions(deflate):
+    """
+    Get the extensions of the websockets server for the deflate configuration.
+
+    Args:
+        deflate: The deflate configuration (cfg.deflate).
+
+    Returns:
+        The list of extension factories, empty if compression is disabled.
+    """
+
+    if not deflate['enabled']:
+        return []
+
+    no_context_takeover = not deflate['context_takeover']
+    return [ThresholdDeflateFactory(
+        deflate['min_size'],
+        server_no_context_takeover=no_context_takeover,
+        client_no_context_takeover=no_context_takeover,
+        server_max_window_bits=deflate['window_bits'],
+        client_max_window_bits=deflate['window_bits'],
+        compress_settings={"level": deflate['level'], "memLevel": deflate['mem_level']},
+    )]
+
+
+def get_compression_stats(ws):
+    """
+    Get the compression counters of a connection of either server.
+
+    Args:
+        ws: The wsocket or websockets connection.
+
+    Returns:
+        The report of CompressionStats, None if compression wasn't negotiated.
+    """
+
+    stats = getattr(ws, "stats", None)
+    if stats is None and hasattr(ws, "protocol"):
+        extensions = getattr(ws.protocol, "extensions", ())
+        stats = next((ext.stats for ext in extensions if isinstance(ext, ThresholdPerMessageDeflate)), None)
+
+    return stats.report() if stats is not None else None
+
+
+def log_compression(logger, ws, protocol):
+    """
+    Log the compression counters of a closed connection, if compression was negotiated.
+
+    Args:
+        logger: The application logger.
+        ws: The wsocket or websockets connection.
+        protocol: The ChatProtocol of the connection.
+    """
+
+    stats = get_compression_stats(ws)
+    if stats is None:
+        return
+
+    author = getattr(protocol, "author", None)
+    logger.info(
+        'WebSocket connection compression',
+        login=author.get_login() if author is not None else None,
+        **stats
+    )
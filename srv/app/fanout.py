@@ -0,0 +1,214 @@
+import threading
+import time
+from bson.objectid import ObjectId
+from pymongo.errors import PyMongoError, OperationFailure
+from .broker import ChatBroker
+from .storage.model import Chat, Message
+
+# Only new messages are fanned out
+PIPELINE = [{"$match": {"operationType": "insert"}}]
+
+
+class ChangeStreamBroker(ChatBroker):
+    """
+    ChatBroker of a WebSocket node of a cluster: messages are published from the change stream of the messages
+    collection, so a message stored by any node reaches the subscribers of its chat on every node.
+
+    A node tails one change stream (not one per connection) in a daemon thread and routes new messages to its
+    local subscribers by chat id, messages of chats nobody on the node is subscribed to are skipped. Messages
+    stored by the node itself come back through the stream too, so publish is a no-op and every message is
+    delivered once.
+
+    A failed stream is reopened after the last event seen. If it can't be resumed (its events already left the
+    oplog), a new stream is opened and the subscribers of every chat get a resync command, so the connections
+    send the messages they missed from the storage.
+
+    Change streams need MongoDB running as a replica set, a single-node one will do.
+
+    Attributes:
+        collection: The messages collection.
+        retry_delay: The seconds to wait before reopening a failed stream.
+        stream: The open change stream, None if it failed.
+        resume_token: The resume token of the last event seen.
+        history_lost: Whether the stream couldn't be resumed and the chats are yet to be resynced.
+        events: The number of new messages received from the stream.
+        routed: The number of messages published to local subscribers.
+        skipped: The number of events that couldn't be routed (e.g. without a valid chat_id).
+        restarts: The number of times the stream was reopened.
+        resyncs: The number of times the stream couldn't be resumed.
+    """
+
+    def __init__(self, collection, retry_delay=1.0):
+        """
+        Initialize the ChangeStreamBroker, start must be called to receive messages.
+
+        Args:
+            collection: The messages collection (pymongo).
+            retry_delay: The seconds to wait before reopening a failed stream (optional).
+        """
+
+        super().__init__()
+        self.collection = collection
+        self.retry_delay = retry_delay
+        self.stream = None
+        self.resume_token = None
+        self.history_lost = False
+        self.events = 0
+        self.routed = 0
+        self.skipped = 0
+        self.restarts = 0
+        self.resyncs = 0
+
+    def publish(self, chat_id, message):
+        """
+        Skip a message stored by this node, it is published when it comes back through the change stream.
+
+        Args:
+            chat_id: The identifier of the chat.
+            message: The message.
+
+        Returns:
+            0, the message isn't delivered here.
+        """
+
+        return 0
+
+    def open(self):
+        """
+        Open the change stream after the last event seen, or from now if no event was seen.
+        """
+
+        self.stream = self.collection.watch(PIPELINE, resume_after=self.resume_token)
+        # An opened stream has a token even before its first event, so a reopened one doesn't miss any
+        self.resume_token = self.stream.resume_token
+
+    def reopen(self):
+        """
+        Reopen a failed change stream, or open a new one and resync the subscribed chats if it can't be resumed.
+        """
+
+        self.restarts += 1
+        try:
+            self.open()
+        except OperationFailure as e:
+            # The stream can't be resumed, its events already left the oplog
+            print(e)
+            self.resume_token = None
+            self.history_lost = True
+            self.open()
+
+        if self.history_lost:
+            self.history_lost = False
+            self.resync()
+
+    def route(self, change):
+        """
+        Publish a new message from the change stream to the local subscribers of its chat.
+
+        Args:
+            change: The insert event of the message.
+
+        Raises:
+            KeyError: If the event has no document.
+            bson.errors.InvalidId: If the chat_id of the message isn't a valid chat id.
+        """
+
+        self.events += 1
+        doc = change["fullDocument"]
+        cid = str(doc.get("chat_id"))
+        if not self.subscriber_count(cid):
+            return
+
+        # Subscribers only use the id of the chat of a message
+        chat = Chat(None, None, None, None, cid=ObjectId(cid), plain=True)
+        self.routed += super().publish(cid, Message.from_mongo(chat, doc))
+
+    def resync(self):
+        """
+        Make the local subscribers of every chat send the messages of the chat again from the storage.
+        """
+
+        self.resyncs += 1
+        with self.lock:
+            chat_ids = list(self.subscribers)
+
+        for cid in chat_ids:
+            super().publish(cid, ("resync", cid))
+
+    def tail(self):
+        """
+        Route the events of the change stream until the process exits, reopening the stream when it fails.
+        """
+
+        while True:
+            try:
+                if self.stream is None:
+                    self.reopen()
+                for change in self.stream:
+                    try:
+                        self.route(change)
+                    except Exception as e:
+                        # A malformed message is skipped, it mustn't stop the fanout of the others
+                        self.skipped += 1
+                        print(e)
+                    self.resume_token = self.stream.resume_token
+            except Exception as e:
+                print(e)
+
+            if self.stream is not None:
+                try:
+                    self.stream.close()
+                except Exception:
+                    pass
+                self.stream = None
+            time.sleep(self.retry_delay)
+
+    def start(self):
+        """
+        Open the change stream and tail it in a daemon thread.
+
+        Raises:
+            pymongo.errors.OperationFailure: If MongoDB doesn't support change streams (it isn't a replica set).
+        """
+
+        self.open()
+        threading.Thread(target=self.tail, name="pych-fanout", daemon=True).start()
+
+    def stats(self):
+        """
+        Get the counters of the change stream.
+
+        Returns:
+            A dictionary with the number of subscribed chats, received, routed and skipped messages, restarts
+            of the stream and resyncs.
+        """
+
+        stats = super().stats()
+        stats.update({
+            "fanout_events": self.events,
+            "fanout_routed": self.routed,
+            "fanout_skipped": self.skipped,
+            "fanout_restarts": self.restarts,
+            "fanout_resyncs": self.resyncs,
+        })
+        return stats
+
+
+def get_broker(cfg, storage):
+    """
+    Create the broker of the WebSocket server: in-process, or tailing the change stream in cluster fanout mode.
+
+    Args:
+        cfg: The configuration object containing application settings.
+        storage: The PychStorage instance for data storage.
+
+    Returns:
+        A ChatBroker, or a started ChangeStreamBroker if fanout is enabled in the configuration.
+    """
+
+    if not cfg.fanout['enabled']:
+        return ChatBroker()
+
+    broker = ChangeStreamBroker(storage.db["messages"], cfg.fanout['retry_delay'])
+    broker.start()
+    return broker
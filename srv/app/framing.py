@@ -0,0 +1,220 @@
+import json
+import base64
+import binascii
+import msgpack
+
+
+class JSONFraming:
+    """
+    The default text framing: every frame is a JSON object and ciphertexts are base64 strings.
+
+    Attributes:
+        name: The name of the framing used in error frames.
+        subprotocol: The WebSocket subprotocol selecting the framing, None for the default one.
+        binary: Whether frames are sent as binary WebSocket frames.
+    """
+
+    name = "json"
+    subprotocol = None
+    binary = False
+
+    @staticmethod
+    def loads(data):
+        """
+        Parse a received frame.
+
+        Args:
+            data: The received frame.
+
+        Returns:
+            The frame as a dictionary.
+
+        Raises:
+            ValueError: If the frame is malformed.
+        """
+
+        frame = json.loads(data)
+        if not isinstance(frame, dict):
+            raise ValueError("frame is not an object")
+        return frame
+
+    @staticmethod
+    def dumps(frame):
+        """
+        Serialize a frame.
+
+        Args:
+            frame: The frame as a dictionary.
+
+        Returns:
+            The serialized frame.
+        """
+
+        return json.dumps(frame)
+
+    @staticmethod
+    def message(fields):
+        """
+        Convert the fields of a stored message into the form sent to the client.
+
+        Args:
+            fields: The serialized message, with its ciphertext as a base64 string.
+
+        Returns:
+            The fields to send.
+        """
+
+        return fields
+
+    @staticmethod
+    def dumps_batch(head, items):
+        """
+        Serialize a batch frame from already serialized messages.
+
+        The messages are spliced into the frame as is, so every message is encoded once.
+
+        Args:
+            head: The fields of the frame besides the messages.
+            items: The serialized messages.
+
+        Returns:
+            The serialized frame, with the messages in its "messages" list.
+        """
+
+        fields = "".join(f", {json.dumps(k)}: {json.dumps(v)}" for k, v in head.items())
+        return f'{{"messages": [{", ".join(items)}]{fields}}}'
+
+
+class MsgpackFraming:
+    """
+    Binary framing negotiated with the pych.msgpack subprotocol: every frame is a msgpack map and ciphertexts
+    are raw bytes, so they aren't inflated by base64 and nothing is parsed as text.
+
+    Messages are stored with base64 ciphertexts whatever the framing of their author, so clients of both
+    framings can share a chat and the REST API keeps returning JSON.
+    """
+
+    name = "msgpack"
+    subprotocol = "pych.msgpack"
+    binary = True
+
+    @staticmethod
+    def loads(data):
+        """
+        Parse a received frame, the raw ciphertext of a message is converted to base64 for storage.
+
+        Args:
+            data: The received frame.
+
+        Returns:
+            The frame as a dictionary.
+
+        Raises:
+            ValueError: If the frame is malformed.
+        """
+
+        try:
+            frame = msgpack.unpackb(data, raw=False)
+        except Exception:
+            raise ValueError("malformed msgpack")
+
+        if not isinstance(frame, dict):
+            raise ValueError("frame is not a map")
+
+        if isinstance(frame.get("msg"), bytes):
+            frame["msg"] = base64.b64encode(frame["msg"]).decode()
+        return frame
+
+    @staticmethod
+    def dumps(frame):
+        """
+        Serialize a frame.
+
+        Args:
+            frame: The frame as a dictionary.
+
+        Returns:
+            The serialized frame.
+        """
+
+        return msgpack.packb(frame, use_bin_type=True)
+
+    @staticmethod
+    def message(fields):
+        """
+        Convert the fields of a stored message into the form sent to the client, the ciphertext is sent raw.
+
+        Args:
+            fields: The serialized message, with its ciphertext as a base64 string.
+
+        Returns:
+            The fields to send.
+        """
+
+        try:
+            return {**fields, "msg": base64.b64decode(fields["msg"], validate=True)}
+        except (binascii.Error, TypeError):
+            # Not written by a chat client, sent as is
+            return fields
+
+    @staticmethod
+    def dumps_batch(head, items):
+        """
+        Serialize a batch frame from already serialized messages.
+
+        The messages are spliced into the frame as is, so every message is encoded once.
+
+        Args:
+            head: The fields of the frame besides the messages.
+            items: The serialized messages.
+
+        Returns:
+            The serialized frame, with the messages in its "messages" list.
+        """
+
+        packer = msgpack.Packer(use_bin_type=True)
+        parts = [
+            packer.pack_map_header(len(head) + 1),
+            packer.pack("messages"),
+            packer.pack_array_header(len(items)),
+            *items,
+        ]
+        for key, value in head.items():
+            parts.append(packer.pack(key))
+            parts.append(packer.pack(value))
+        return b"".join(parts)
+
+
+# Framings selected by WebSocket subprotocols, in order of preference
+SUBPROTOCOLS = {MsgpackFraming.subprotocol: MsgpackFraming}
+
+
+def get_framing(subprotocol):
+    """
+    Get the framing of a connection by its negotiated subprotocol.
+
+    Args:
+        subprotocol: The negotiated subprotocol, None if there is none.
+
+    Returns:
+        The framing class.
+    """
+
+    return SUBPROTOCOLS.get(subprotocol, JSONFraming)
+
+
+def select_subprotocol(offered):
+    """
+    Select the subprotocol of a connection among the ones offered by the client.
+
+    Args:
+        offered: The subprotocols offered by the client.
+
+    Returns:
+        The selected subprotocol, None to use the default JSON framing.
+    """
+
+    for subprotocol in SUBPROTOCOLS:
+        if subprotocol in offered:
+            return subprotocol
+    return None
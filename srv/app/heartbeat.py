@@ -0,0 +1,244 @@
+import time
+import socket
+import threading
+from wsocket import WebSocket, WebSocketError, OPCODE_PING, OPCODE_PONG
+from websockets.frames import CloseCode
+
+# Reasons a connection is reaped for
+AUTH_TIMEOUT = "auth_timeout"
+HEARTBEAT_TIMEOUT = "heartbeat_timeout"
+
+# Seconds between checks of the connections
+REAPER_TICK = 1.0
+
+
+class HeartbeatWebSocket(WebSocket):
+    """
+    wsocket connection with heartbeats: it answers and sends pings and records when the client was last heard from.
+
+    wsocket can't answer pings (its handle_ping refers to a missing attribute) and writes frames from any thread
+    without locking, while the reader thread answers pings and the writer thread sends the other frames,
+    so frame writes are serialized here.
+
+    Attributes:
+        last_seen: The time.monotonic() time the last bytes were received.
+        sock: The socket of the connection, None if it isn't known.
+        write_lock: The lock serializing frame writes.
+    """
+
+    def __init__(self, environ, read, write, handler, do_compress):
+        """
+        Initialize the connection, see wsocket.WebSocket.
+        """
+
+        super().__init__(environ, read, write, handler, do_compress)
+        self.last_seen = time.monotonic()
+        self.write_lock = threading.RLock()
+
+        # wsocket doesn't expose the socket, the input stream of the request wraps it
+        self.sock = getattr(getattr(environ.get("wsgi.input"), "raw", None), "_sock", None)
+
+        def read_seen(size):
+            data = read(size)
+            self.last_seen = time.monotonic()
+            return data
+
+        self.read = read_seen
+
+    def send_frame(self, message, opcode, do_compress=False):
+        """
+        Send a frame, see wsocket.WebSocket.send_frame.
+        """
+
+        with self.write_lock:
+            return super().send_frame(message, opcode, do_compress)
+
+    def handle_ping(self, payload):
+        """
+        Answer a ping of the client with a pong carrying the same payload.
+
+        Args:
+            payload: The payload of the ping.
+        """
+
+        # send_frame skips empty payloads, a pong must be sent even for an empty ping
+        header = self.encode_header(True, OPCODE_PONG, b"", len(payload), 0)
+        with self.write_lock:
+            try:
+                self.write(bytes(header + payload))
+            except (socket.error, TypeError):
+                raise WebSocketError("Socket is dead")
+
+    def ping(self):
+        """
+        Send a ping to the client, its pong updates last_seen.
+        """
+
+        self.send_frame("pych", OPCODE_PING)
+
+    def abort(self):
+        """
+        Shut the socket down, so blocked reads and writes of the connection fail at once.
+        """
+
+        if self.sock is None:
+            return
+
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class ConnectionReaper:
+    """
+    Reaper of the WebSocket connections of a server, counts the reaped connections.
+
+    A connection that isn't authenticated within auth_timeout seconds is reaped. An authenticated connection
+    the client wasn't heard from for ping_interval seconds is pinged, and it is reaped if it stays silent for
+    ping_timeout seconds more: a half-open connection (a NAT timeout, a killed laptop) is closed in
+    ping_interval + ping_timeout seconds instead of when the kernel gives up on it.
+
+    The threaded server checks its connections with check, the asyncio server relies on the keepalive of
+    websockets and its own timeout of authentication, and only counts the reaped connections here.
+
+    Attributes:
+        ping_interval: The seconds of silence after which a connection is pinged, 0 disables heartbeats.
+        ping_timeout: The seconds of silence after a ping after which a connection is reaped.
+        auth_timeout: The seconds a connection may take to authenticate, 0 disables the limit.
+        connections: The registered ChatProtocol objects with the time.monotonic() time they connected.
+        pinged: The last_seen time of the connections when they were last pinged, so a silence is pinged once.
+        reaped: The number of reaped connections by reason.
+    """
+
+    def __init__(self, ping_interval, ping_timeout, auth_timeout):
+        """
+        Initialize the ConnectionReaper.
+
+        Args:
+            ping_interval: The seconds of silence after which a connection is pinged.
+            ping_timeout: The seconds of silence after a ping after which a connection is reaped.
+            auth_timeout: The seconds a connection may take to authenticate.
+        """
+
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.auth_timeout = auth_timeout
+        self.lock = threading.Lock()
+        self.connections = {}
+        self.pinged = {}
+        self.reaped = {AUTH_TIMEOUT: 0, HEARTBEAT_TIMEOUT: 0}
+
+    def register(self, protocol):
+        """
+        Add the ChatProtocol of a new connection.
+
+        Args:
+            protocol: The ChatProtocol.
+        """
+
+        with self.lock:
+            self.connections[protocol] = time.monotonic()
+
+    def unregister(self, protocol):
+        """
+        Remove the ChatProtocol of a closed connection, it is counted if it was reaped.
+
+        Args:
+            protocol: The ChatProtocol.
+        """
+
+        with self.lock:
+            self.pinged.pop(protocol, None)
+            if self.connections.pop(protocol, None) is not None and protocol.reaped is not None:
+                self.reaped[protocol.reaped] += 1
+
+    def check(self, now=None):
+        """
+        Ping the silent connections and reap the connections over their limits.
+
+        Args:
+            now: The time.monotonic() time of the check (optional).
+        """
+
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            connections = list(self.connections.items())
+
+        for protocol, connected in connections:
+            if protocol.reaped is not None:
+                continue
+
+            if getattr(protocol, "author", None) is None:
+                if self.auth_timeout and now - connected > self.auth_timeout:
+                    protocol.reap(AUTH_TIMEOUT)
+                continue
+
+            if not self.ping_interval:
+                continue
+
+            last_seen = protocol.ws.last_seen
+            if now - last_seen > self.ping_interval + self.ping_timeout:
+                protocol.reap(HEARTBEAT_TIMEOUT)
+            elif now - last_seen > self.ping_interval and self.pinged.get(protocol) != last_seen:
+                with self.lock:
+                    self.pinged[protocol] = last_seen
+                protocol.subscriber(("ping",))
+
+    def start(self):
+        """
+        Check the connections every REAPER_TICK seconds in a daemon thread.
+        """
+
+        def run():
+            while True:
+                time.sleep(REAPER_TICK)
+                self.check()
+
+        threading.Thread(target=run, name="pych-reaper", daemon=True).start()
+
+    def stats(self):
+        """
+        Get the counters of reaped connections.
+
+        Returns:
+            A dictionary with the number of reaped connections by reason.
+        """
+
+        with self.lock:
+            return {f"reaped_{reason}": count for reason, count in self.reaped.items()}
+
+
+def keepalive_timed_out(ws):
+    """
+    Check whether the websockets keepalive closed a connection because the client didn't answer a ping.
+
+    Args:
+        ws: The closed websockets connection.
+
+    Returns:
+        True if the keepalive ping timed out.
+    """
+
+    sent = ws.protocol.close_sent
+    return sent is not None and sent.code == CloseCode.INTERNAL_ERROR and sent.reason == "keepalive ping timeout"
+
+
+def log_reaping(logger, protocol):
+    """
+    Log the reaping of a connection, if it was reaped.
+
+    Args:
+        logger: The application logger.
+        protocol: The ChatProtocol of the connection.
+    """
+
+    if protocol.reaped is None:
+        return
+
+    author = getattr(protocol, "author", None)
+    logger.info(
+        'Reaped WebSocket connection',
+        login=author.get_login() if author is not None else None,
+        reason=protocol.reaped
+    )
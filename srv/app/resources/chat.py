@@ -1,7 +1,7 @@
 import falcon
-from app.storage.model import Chat
+from app.storage.model import Chat, UserView
 from app.storage.provider import RSAAdapter
-from app.storage.mongo import EntityNotFoundException
+from app.storage.mongo import EntityNotFoundException, DuplicateEntryException
 from app.resources.middleware import UserByTokenMiddleware
 
 
@@ -14,8 +14,11 @@ class NewResource:
         storage: The storage backend used to retrieve and store user and
             chat information.
         secret: A secret key used for chat-related operations.
+        route_class: The route class of the resource for AdmissionMiddleware.
     """
 
+    route_class = "chat"
+
     def __init__(self, storage, secret):
         """
         Initializes the Falcon Resource using storage and secret
@@ -57,7 +60,8 @@ class NewResource:
             raise falcon.HTTPBadRequest(title="not all fields specified")
 
         dest_user = self.storage.get_users_by_filter(
-            name=dest_username, hostname=dest_hostname, strict=True
+            name=dest_username, hostname=dest_hostname, strict=True,
+            view=UserView.LOGIN
         )
         if len(dest_user) != 1:
             raise falcon.HTTPNotFound(title="user not found")
@@ -82,7 +86,13 @@ class NewResource:
             except ValueError:
                 raise falcon.HTTPUnauthorized(title="bad aes")
 
-            self.storage.add_chat(new_chat)
+            try:
+                self.storage.add_chat(new_chat)
+            except DuplicateEntryException:
+                # Chat was created by a concurrent request
+                raise falcon.HTTPBadRequest(
+                    title="can't create second chat with user"
+                )
 
             resp.status = falcon.HTTP_200
             resp.media = {
@@ -98,8 +108,11 @@ class ListResource:
     Attributes:
         storage: The storage backend used to retrieve and store user and
             chat information.
+        route_class: The route class of the resource for AdmissionMiddleware.
     """
 
+    route_class = "chat"
+
     def __init__(self, storage):
         """
         Initializes the Falcon Resource using storage
@@ -133,3 +146,67 @@ class ListResource:
             "status": "ok",
             "chats": [c.safe_serialize(sp) for c in chats],
         }
+
+
+class HistoryResource:
+    """
+    A class responsible for handling GET requests to page through the message history of a chat.
+
+    Attributes:
+        storage: The storage backend used to retrieve chats and messages.
+        limits: The history section of the configuration, with the default and the maximum limit.
+        route_class: The route class of the resource for AdmissionMiddleware.
+    """
+
+    route_class = "chat"
+
+    def __init__(self, storage, limits):
+        """
+        Initializes the Falcon Resource using storage
+
+        Attributes:
+            storage: mongodb storage
+            limits: the history section of the configuration
+        """
+
+        self.storage = storage
+        self.limits = limits
+
+    @falcon.before(UserByTokenMiddleware.check_user)
+    def on_get(self, req, resp, cid):
+        """
+        Handles GET requests for a page of the chat history.
+
+        Messages are returned newest first. The cursor of the response is passed as the before parameter
+        to get the next, older page; it is null on the last page.
+
+        Args:
+            req: The request object, with the optional before and limit parameters.
+            resp: The response object, used to return data back to the client.
+            cid: The identifier of the chat.
+
+        Raises:
+            falcon.HTTPNotFound: If the chat doesn't exist or the user doesn't participate in it.
+        """
+
+        user = req.context['auth']['user']
+        limit = req.get_param_as_int(
+            'limit', min_value=1, max_value=self.limits['max_limit'],
+            default=self.limits['default_limit']
+        )
+
+        try:
+            chat = self.storage.get_chat_by_cid(cid, user.get_login())
+        except EntityNotFoundException:
+            raise falcon.HTTPNotFound(title="chat not found")
+
+        messages, cursor = self.storage.get_history(
+            chat, cursor=req.get_param('before'), limit=limit
+        )
+
+        resp.status = falcon.HTTP_200
+        resp.media = {
+            "status": "ok",
+            "messages": [{"mid": str(m.mid), **m.serialize()} for m in messages],
+            "cursor": cursor,
+        }
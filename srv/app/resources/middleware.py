@@ -1,6 +1,7 @@
 import falcon
 import cryptography.fernet
-from app.storage.mongo import EntityNotFoundException
+from ..storage.mongo import EntityNotFoundException
+from ..admission import DEFAULT_CLASS
 
 
 class Middleware:
@@ -33,7 +34,8 @@ class TokenMiddleware(Middleware):
     Middleware for handling authentication tokens.
 
     This middleware checks for the presence of an authentication token in the request headers,
-    validates it, and adds authentication context to the request.
+    validates it, and adds authentication context to the request. Tokens are decrypted in process_resource,
+    after AdmissionMiddleware has admitted the request, so shed requests cost no decryption.
 
     Attributes:
         sp: An instance of a FernetAdapter(security provider) that offers token decryption/encryption.
@@ -50,7 +52,16 @@ class TokenMiddleware(Middleware):
 
     def process_request(self, req, resp):
         """
-        Process an incoming request for token authentication.
+        Tokens are decrypted in process_resource, once the request is admitted.
+
+        Args:
+            req: The request object.
+            resp: The response object.
+        """
+
+    def process_resource(self, req, resp, resource, params):
+        """
+        Process a routed request for token authentication.
 
         The method extracts the 'Auth' token from the request headers, validates it,
         and adds authentication context to the request. In case of missing or invalid tokens,
@@ -59,8 +70,13 @@ class TokenMiddleware(Middleware):
         Args:
             req: The request object.
             resp: The response object.
+            resource: The resource object the request is routed to.
+            params: The parameters for the request.
         """
 
+        if resource is None:
+            return
+
         token = req.get_header('Auth')
 
         if token is None:
@@ -100,7 +116,8 @@ class UserByTokenMiddleware(Middleware):
     Middleware for retrieving user instance based on the authentication token.
 
     This middleware is responsible for fetching user details using the user identifier
-    obtained from the authentication token.
+    obtained from the authentication token. Users are resolved through the users cache of the storage,
+    and not resolved at all for resources that set requires_user to False.
 
     Attributes:
         ps: An instance of a mongodb storage that offers user retrieval functionality.
@@ -118,7 +135,16 @@ class UserByTokenMiddleware(Middleware):
 
     def process_request(self, req, resp):
         """
-        Process an incoming request to add user information to the context.
+        Users are resolved in process_resource, once the routed resource is known.
+
+        Args:
+            req: The request object.
+            resp: The response object.
+        """
+
+    def process_resource(self, req, resp, resource, params):
+        """
+        Process a routed request to add user information to the context.
 
         This method uses the user identifier from the authentication context to retrieve user details
         and adds them to the request context. In case of errors, appropriate error information is added.
@@ -126,15 +152,22 @@ class UserByTokenMiddleware(Middleware):
         Args:
             req: The request object.
             resp: The response object.
+            resource: The resource object the request is routed to.
+            params: The parameters for the request.
         """
 
+        if resource is None or not getattr(resource, 'requires_user', True):
+            return
+
         auth_data = req.context['auth']
         if 'err' in auth_data:
             return
 
         try:
             req.context['auth'] = {
-                'user': self.ps.get_user_by_uid(auth_data['user_id'].decode())
+                'user': self.ps.get_user_by_uid(
+                    auth_data['user_id'].decode(), cached=True
+                )
             }
 
         except EntityNotFoundException as e:
@@ -202,3 +235,80 @@ class RequireJSON(Middleware):
                 raise falcon.HTTPUnsupportedMediaType(
                     title='Only json requests supported',
                 )
+
+
+class AdmissionMiddleware(Middleware):
+    """
+    Middleware shedding load past the in-flight limits of route classes.
+
+    A resource belongs to the route class named by its route_class attribute (DEFAULT_CLASS if it has none).
+    A request of a class at its limit is refused at once with 503 and Retry-After, instead of waiting for a thread
+    of the worker together with every other request.
+
+    Attributes:
+        admission: The AdmissionControl of the worker.
+        retry_after: The seconds clients are asked to wait before retrying a shed request.
+    """
+
+    def __init__(self, admission, retry_after):
+        """
+        Initialize AdmissionMiddleware.
+
+        Args:
+            admission: The AdmissionControl of the worker.
+            retry_after: The seconds clients are asked to wait before retrying a shed request.
+        """
+
+        self.admission = admission
+        self.retry_after = retry_after
+
+    def process_request(self, req, resp):
+        """
+        Requests are admitted in process_resource, once the routed resource is known.
+
+        Args:
+            req: The request object.
+            resp: The response object.
+        """
+
+    def process_resource(self, req, resp, resource, params):
+        """
+        Admit a routed request if its route class is under its limit.
+
+        Args:
+            req: The request object.
+            resp: The response object.
+            resource: The resource object the request is routed to.
+            params: The parameters for the request.
+
+        Raises:
+            falcon.HTTPServiceUnavailable: If the route class of the resource is at its limit.
+        """
+
+        if resource is None:
+            return
+
+        route_class = getattr(resource, 'route_class', DEFAULT_CLASS)
+        if not self.admission.try_acquire(route_class):
+            raise falcon.HTTPServiceUnavailable(
+                title='Overloaded',
+                description=f'Too many {route_class} requests, retry later',
+                retry_after=self.retry_after,
+            )
+
+        req.context['admitted'] = route_class
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        """
+        Release the admitted request.
+
+        Args:
+            req: The request object.
+            resp: The response object.
+            resource: The resource object the request was routed to.
+            req_succeeded: Whether the request was processed without an error.
+        """
+
+        route_class = req.context.pop('admitted', None)
+        if route_class is not None:
+            self.admission.release(route_class)
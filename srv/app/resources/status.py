@@ -9,14 +9,21 @@ class StatusResource:
 
     This class provides an endpoint to get the current state of the application, including its uptime and
     the environment it's running in. Optionally, if a user is authenticated, their login information is included.
+    It also reports the hit/miss counters of the users cache, the state of the key pool, if there is one,
+    and the admission control counters of the worker.
 
     Attributes:
         started: The timestamp when the instance was created, used to calculate uptime.
         cfg: A configuration object containing environment and other settings.
+        storage: The storage whose cache counters are reported.
+        admission: The AdmissionControl whose counters are reported, None if admission control is disabled.
+        route_class: The route class of the resource for AdmissionMiddleware.
 
     """
 
-    def __init__(self, cfg):
+    route_class = "status"
+
+    def __init__(self, cfg, storage, admission=None):
         """
         Initialize a StatusResource instance.
 
@@ -24,10 +31,14 @@ class StatusResource:
 
         Args:
             cfg: A configuration object containing environment and other settings.
+            storage: The storage whose cache counters are reported.
+            admission: The AdmissionControl whose counters are reported (optional).
         """
 
         self.started = time.time()
         self.cfg = cfg
+        self.storage = storage
+        self.admission = admission
 
     def on_get(self, req, resp):
         """
@@ -45,9 +56,16 @@ class StatusResource:
         status_response = {
             "app": f"pychapp_{self.cfg.env}",
             "status": "ok",
-            "uptime": time.time() - self.started
+            "uptime": time.time() - self.started,
+            "users_cache": self.storage.users_cache.stats(),
         }
 
+        if hasattr(self.storage.rp, 'stats'):
+            status_response['key_pool'] = self.storage.rp.stats()
+
+        if self.admission is not None:
+            status_response['admission'] = self.admission.stats()
+
         if 'auth' in req.context and 'user' in req.context['auth']:
             user = req.context['auth']['user']
             if user:
@@ -0,0 +1,73 @@
+import falcon
+from app.storage.provider import RSAAdapter
+from app.resources.middleware import UserByTokenMiddleware
+
+
+class SyncResource:
+    """
+    A class responsible for handling GET requests for the changes since the previous session of a client.
+
+    Attributes:
+        storage: The storage backend used to retrieve chats and messages.
+        limits: The sync section of the configuration.
+        route_class: The route class of the resource for AdmissionMiddleware.
+    """
+
+    route_class = "sync"
+
+    def __init__(self, storage, limits):
+        """
+        Initializes the Falcon Resource using storage
+
+        Attributes:
+            storage: mongodb storage
+            limits: the sync section of the configuration
+        """
+
+        self.storage = storage
+        self.limits = limits
+
+    @falcon.before(UserByTokenMiddleware.check_user)
+    def on_get(self, req, resp):
+        """
+        Handles GET requests for the changes since a sync token.
+
+        Without the since parameter, all chats of the user are returned with their newest messages. Chats are
+        serialized as in the chat list (the aes key is encrypted with the user's public key), only new chats
+        are returned, so the client decrypts only the keys it doesn't have. Each update holds at most
+        max_messages newest messages of a chat, the rest can be fetched from the chat history with the cursor
+        of the update. A sync returns the messages after a number that is still being written again, the client
+        skips messages it already has. A token whose sync state expired returns everything, as the first sync does.
+
+        Args:
+            req: The request object, with the optional since parameter (the token of the previous sync).
+            resp: The response object, used to return data back to the client.
+        """
+
+        user = req.context['auth']['user']
+        sp = RSAAdapter(pub_pem=user.u_pub_k.encode())
+
+        changes = self.storage.get_changes(
+            user, token=req.get_param('since'),
+            limit=self.limits['max_messages'],
+            max_unread=self.limits['max_unread']
+        )
+
+        resp.status = falcon.HTTP_200
+        resp.media = {
+            "status": "ok",
+            "token": changes["token"],
+            "chats": [c.safe_serialize(sp) for c in changes["chats"]],
+            "updates": [
+                {
+                    "cid": str(update["chat"].cid),
+                    "messages": [
+                        {"mid": str(m.mid), **m.serialize()}
+                        for m in update["messages"]
+                    ],
+                    "cursor": update["cursor"],
+                    "unread": update["unread"],
+                }
+                for update in changes["updates"]
+            ],
+        }
@@ -1,5 +1,5 @@
 import falcon
-from app.storage.model import User
+from app.storage.model import User, UserView
 from app.resources.middleware import *
 
 
@@ -12,8 +12,13 @@ class RegisterResource:
 
     Attributes:
         storage: An object to store user data.
+        requires_user: The user isn't resolved by UserByTokenMiddleware.
+        route_class: The route class of the resource for AdmissionMiddleware.
     """
 
+    requires_user = False
+    route_class = "auth"
+
     def __init__(self, storage):
         """
         Initialize a RegisterResource instance.
@@ -62,29 +67,39 @@ class SearchResource:
     """
     Resource for searching users in the chat.
 
-    This class provides an endpoint to search for users based on username and/or hostname.
+    This class provides an endpoint to search for users by username and/or hostname prefixes, or substrings
+    with match=substring. Results are returned page by page: a page holds at most limit users, and the cursor
+    of the response requests the next page.
 
     Attributes:
         storage: An object to store and retrieve user data.
+        limits: The search section of the configuration, with the default and the maximum limit.
+        requires_user: The user isn't resolved by UserByTokenMiddleware.
+        route_class: The route class of the resource for AdmissionMiddleware.
     """
 
-    def __init__(self, storage):
+    requires_user = False
+    route_class = "search"
+
+    def __init__(self, storage, limits):
         """
         Initialize a SearchResource instance.
 
         Args:
             storage: An object that provides methods to store and retrieve user data.
+            limits: The search section of the configuration.
         """
 
         self.storage = storage
+        self.limits = limits
 
     def on_get(self, req, resp):
         """
         Handle GET requests for searching users.
 
-        This method extracts search parameters from the request, retrieves matching users from the storage,
-        and sets the response with the list of found users. If no valid search parameters are provided,
-        it raises an HTTPBadRequest error.
+        This method extracts search parameters from the request, retrieves a page of matching users from
+        the storage, and sets the response with the found users and the cursor of the next page (null on the
+        last page). If no valid search parameters are provided, it raises an HTTPBadRequest error.
 
         Args:
             req: The request object, containing search parameters.
@@ -96,17 +111,28 @@ class SearchResource:
 
         if len(username) == 0 and len(hostname) == 0:
             raise falcon.HTTPBadRequest(
-                "username or hostname should be specified"
+                title="username or hostname should be specified"
             )
 
-        users = self.storage.get_users_by_filter(
-            name=username, hostname=hostname
+        match = req.get_param('match', default='prefix')
+        if match not in ('prefix', 'substring'):
+            raise falcon.HTTPBadRequest(title="match should be prefix or substring")
+
+        limit = req.get_param_as_int(
+            'limit', min_value=1, max_value=self.limits['max_limit'],
+            default=self.limits['default_limit']
+        )
+
+        users, cursor = self.storage.search_users(
+            name=username, hostname=hostname, limit=limit,
+            cursor=req.get_param('cursor'), substring=match == 'substring'
         )
 
         resp.status = falcon.HTTP_200
         resp.media = {
             "status": "ok",
-            "users": [str(u) for u in users]
+            "users": [str(u) for u in users],
+            "cursor": cursor
         }
 
 
@@ -120,8 +146,13 @@ class LoginResource:
     Attributes:
         storage: An object to store and retrieve user data.
         sp: Security provider used for generating auth tokens.
+        requires_user: The user isn't resolved by UserByTokenMiddleware.
+        route_class: The route class of the resource for AdmissionMiddleware.
     """
 
+    requires_user = False
+    route_class = "auth"
+
     def __init__(self, storage, sp):
         """
         Initialize a LoginResource instance.
@@ -157,7 +188,7 @@ class LoginResource:
 
         # Check if client specified correct auth data
         u = self.storage.get_users_by_filter(
-            name=username, hostname=hostname, strict=True
+            name=username, hostname=hostname, strict=True, view=UserView.AUTH
         )
         if len(u) != 1:
             raise falcon.HTTPNotFound(title="user not found")
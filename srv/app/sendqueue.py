@@ -0,0 +1,265 @@
+import time
+import threading
+from collections import deque
+
+# Overflow policies of a SendQueue
+DROP_OLDEST = "drop_oldest"
+DISCONNECT = "disconnect"
+
+
+class SendQueueOverflow(Exception):
+    """
+    Raised when a SendQueue is over its limit and its connection must be disconnected.
+    """
+
+
+class SendQueue:
+    """
+    Bounded outbound queue of a WebSocket connection.
+
+    It holds the items the writer of the connection hasn't sent yet: published messages, frames, subscription
+    commands and None, which stops the writer. When the queue grows past its limit because the client doesn't
+    read fast enough, the oldest messages are dropped and their chats are marked for resync (drop_oldest), or
+    the connection is disconnected (disconnect). Other items are never dropped, a queue full of them overflows
+    whatever the policy.
+
+    Attributes:
+        limit: The maximum number of queued items (high-water mark).
+        policy: The overflow policy, DROP_OLDEST or DISCONNECT.
+        items: The queued items with the chat identifiers of the droppable ones, oldest first.
+        gaps: The identifiers of the chats whose messages were dropped since the writer last checked.
+        max_depth: The largest number of queued items seen.
+        dropped: The number of dropped messages.
+        closed: Whether the queue is closed, items put after that are ignored.
+    """
+
+    def __init__(self, limit, policy=DROP_OLDEST):
+        """
+        Initialize an empty SendQueue.
+
+        Args:
+            limit: The maximum number of queued items.
+            policy: The overflow policy (optional).
+        """
+
+        self.limit = limit
+        self.policy = policy
+        self.cond = threading.Condition()
+        self.items = deque()
+        self.gaps = set()
+        self.max_depth = 0
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item, chat=None):
+        """
+        Queue an item for the writer.
+
+        Args:
+            item: A Message, a frame or a command.
+            chat: The identifier of the chat of a published message, which may be dropped (optional).
+
+        Raises:
+            SendQueueOverflow: If the queue is over its limit and nothing can be dropped.
+        """
+
+        with self.cond:
+            if self.closed:
+                return
+
+            self.items.append((item, chat))
+            if len(self.items) > self.limit:
+                self.shed()
+            self.max_depth = max(self.max_depth, len(self.items))
+            self.cond.notify()
+
+    def shed(self):
+        """
+        Drop the oldest messages until the queue is within its limit, the caller holds the lock.
+
+        Raises:
+            SendQueueOverflow: If the policy is disconnect or there are not enough messages to drop.
+        """
+
+        if self.policy != DROP_OLDEST:
+            raise SendQueueOverflow(f"{len(self.items)} items queued")
+
+        excess = len(self.items) - self.limit
+        kept = deque()
+        while self.items and excess > 0:
+            item, chat = self.items.popleft()
+            if chat is not None:
+                self.gaps.add(chat)
+                self.dropped += 1
+                excess -= 1
+            else:
+                kept.append((item, chat))
+
+        kept.extend(self.items)
+        self.items = kept
+        if excess > 0:
+            raise SendQueueOverflow(f"{len(self.items)} items queued")
+
+    def get(self, count, block=True):
+        """
+        Take queued items, oldest first.
+
+        Args:
+            count: The maximum number of items to take.
+            block: Whether to wait for an item if the queue is empty (optional).
+
+        Returns:
+            The list of taken items, empty only if block is False.
+        """
+
+        with self.cond:
+            while block and not self.items:
+                self.cond.wait()
+
+            count = min(count, len(self.items))
+            return [self.items.popleft()[0] for _ in range(count)]
+
+    def take_gaps(self):
+        """
+        Take the chats whose messages were dropped.
+
+        Returns:
+            The set of chat identifiers.
+        """
+
+        with self.cond:
+            gaps, self.gaps = self.gaps, set()
+            return gaps
+
+    def close(self):
+        """
+        Drop the queued items and stop the writer, nothing can be queued after that.
+        """
+
+        with self.cond:
+            self.closed = True
+            self.items.clear()
+            self.items.append((None, None))
+            self.cond.notify()
+
+    def __len__(self):
+        """
+        Get the number of queued items.
+        """
+
+        with self.cond:
+            return len(self.items)
+
+
+class SendQueueMonitor:
+    """
+    Registry of the send queues of a WebSocket server, reports their depth.
+
+    Attributes:
+        queues: The queues of the open connections.
+        dropped: The number of messages dropped by the queues of closed connections.
+        evicted: The number of connections disconnected because their queue overflowed.
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty SendQueueMonitor.
+        """
+
+        self.lock = threading.Lock()
+        self.queues = set()
+        self.dropped = 0
+        self.evicted = 0
+
+    def register(self, queue):
+        """
+        Add the queue of a new connection.
+
+        Args:
+            queue: The SendQueue.
+        """
+
+        with self.lock:
+            self.queues.add(queue)
+
+    def unregister(self, queue, evicted=False):
+        """
+        Remove the queue of a closed connection, its counters are kept.
+
+        Args:
+            queue: The SendQueue.
+            evicted: Whether the connection was disconnected because the queue overflowed (optional).
+        """
+
+        with self.lock:
+            if queue in self.queues:
+                self.queues.discard(queue)
+                self.dropped += queue.dropped
+                self.evicted += int(evicted)
+
+    def stats(self):
+        """
+        Get the counters of the queues.
+
+        Returns:
+            A dictionary with the number of connections, queued items, the depth of the deepest queue,
+            dropped messages and evicted connections.
+        """
+
+        with self.lock:
+            queues = list(self.queues)
+            dropped, evicted = self.dropped, self.evicted
+
+        depths = [len(queue) for queue in queues]
+        return {
+            "connections": len(queues),
+            "queued": sum(depths),
+            "max_depth": max(depths, default=0),
+            "dropped": dropped + sum(queue.dropped for queue in queues),
+            "evicted": evicted,
+        }
+
+    def start_reporting(self, logger, interval, *sources):
+        """
+        Log the counters every interval seconds in a daemon thread.
+
+        Args:
+            logger: The application logger.
+            interval: The time between reports in seconds, 0 disables the reports.
+            *sources: Other counters of the server to log with the ones of the queues, objects with a stats method.
+        """
+
+        if interval <= 0:
+            return
+
+        def report():
+            while True:
+                time.sleep(interval)
+                stats = self.stats()
+                for source in sources:
+                    stats.update(source.stats())
+                logger.info('WebSocket connections', **stats)
+
+        threading.Thread(target=report, name="pych-send-queues", daemon=True).start()
+
+
+def log_eviction(logger, protocol):
+    """
+    Log the eviction of a slow client, if its connection was evicted.
+
+    Args:
+        logger: The application logger.
+        protocol: The ChatProtocol of the connection.
+    """
+
+    if not protocol.evicted:
+        return
+
+    author = getattr(protocol, "author", None)
+    logger.warning(
+        'Evicted slow WebSocket consumer',
+        login=author.get_login() if author is not None else None,
+        limit=protocol.inbox.limit,
+        max_depth=protocol.inbox.max_depth,
+        dropped=protocol.inbox.dropped
+    )
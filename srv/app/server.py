@@ -0,0 +1,55 @@
+from gunicorn.app.base import BaseApplication
+
+
+class PychApplication(BaseApplication):
+    """
+    Gunicorn application serving the pychapp REST api.
+
+    The master pre-forks rest.workers processes, each of them serves requests with a pool of rest.threads threads
+    (gthread worker) and keeps idle connections alive for rest.keepalive seconds. The Falcon app is built by the
+    factory inside every worker, so each worker opens its own database connections after the fork.
+
+    Attributes:
+        rest: The rest section of the configuration.
+        factory: A callable without arguments that returns the WSGI application.
+    """
+
+    def __init__(self, rest, factory):
+        """
+        Initialize the PychApplication.
+
+        Args:
+            rest: The rest section of the configuration.
+            factory: A callable without arguments that returns the WSGI application.
+        """
+
+        self.rest = rest
+        self.factory = factory
+        super().__init__()
+
+    def load_config(self):
+        """
+        Apply the rest section of the configuration to the gunicorn settings.
+        """
+
+        options = {
+            'bind': f"{self.rest['host']}:{self.rest['port']}",
+            'workers': self.rest['workers'],
+            'threads': self.rest['threads'],
+            'worker_class': self.rest['worker_class'],
+            'keepalive': self.rest['keepalive'],
+            'timeout': self.rest['timeout'],
+        }
+
+        for k, v in options.items():
+            self.cfg.set(k, v)
+
+    def load(self):
+        """
+        Build the WSGI application, called in every worker.
+
+        Returns:
+            The WSGI application.
+        """
+
+        return self.factory()
@@ -1,13 +1,15 @@
 import falcon
 
 from app.storage.mongo import *
+from app.admission import AdmissionControl
 from app.resources.middleware import *
 from app.resources.status import StatusResource
-from app.resources.chat import NewResource, ListResource
+from app.resources.sync import SyncResource
+from app.resources.chat import NewResource, ListResource, HistoryResource
 from app.resources.user import RegisterResource, SearchResource, LoginResource
 
 
-def register_handlers(app, cfg, storage, sp):
+def register_handlers(app, cfg, storage, sp, admission=None):
     """
     Register API routes and resources with the Falcon application.
 
@@ -16,14 +18,17 @@ def register_handlers(app, cfg, storage, sp):
         cfg: The configuration object containing application settings.
         storage: The PychStorage instance for data storage.
         sp: The security provider for token validation and encryption.
+        admission: The AdmissionControl of the worker, reported by /status (optional).
     """
 
-    app.add_route("/status", StatusResource(cfg))
+    app.add_route("/status", StatusResource(cfg, storage, admission))
     app.add_route("/api/user/register", RegisterResource(storage))
-    app.add_route("/api/user/search", SearchResource(storage))
+    app.add_route("/api/user/search", SearchResource(storage, cfg.search))
     app.add_route("/api/user/login", LoginResource(storage, sp))
     app.add_route("/api/chat/new", NewResource(storage, cfg.secret))
     app.add_route("/api/chat/list", ListResource(storage))
+    app.add_route("/api/chat/{cid}/messages", HistoryResource(storage, cfg.history))
+    app.add_route("/api/sync", SyncResource(storage, cfg.sync))
 
 
 def get_service(cfg, logger, security_provider, storage) -> falcon.App:
@@ -43,13 +48,19 @@ def get_service(cfg, logger, security_provider, storage) -> falcon.App:
         The configured Falcon application instance.
     """
 
-    app = falcon.App(
-        middleware=[
-            TokenMiddleware(security_provider),
-            UserByTokenMiddleware(storage),
-            RequireJSON(),
-        ]
-    )
+    middleware = [
+        TokenMiddleware(security_provider),
+        UserByTokenMiddleware(storage),
+        RequireJSON(),
+    ]
+
+    # Admission goes first, so shed requests neither decrypt their token nor look up their user
+    admission = None
+    if cfg.admission['enabled']:
+        admission = AdmissionControl(cfg.admission['rest_limits'])
+        middleware.insert(0, AdmissionMiddleware(admission, cfg.admission['retry_after']))
+
+    app = falcon.App(middleware=middleware)
 
     app.add_error_handler(
         ValidationFailedException, ValidationFailedException.handle)
@@ -57,8 +68,10 @@ def get_service(cfg, logger, security_provider, storage) -> falcon.App:
         EntityNotFoundException, EntityNotFoundException.handle)
     app.add_error_handler(
         DuplicateEntryException, DuplicateEntryException.handle)
+    app.add_error_handler(
+        InvalidCursorException, InvalidCursorException.handle)
 
     logger.info('Registering the resources')
-    register_handlers(app, cfg, storage, security_provider)
+    register_handlers(app, cfg, storage, security_provider, admission)
 
     return app
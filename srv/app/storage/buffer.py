@@ -0,0 +1,200 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+from pymongo.errors import BulkWriteError
+
+
+class MessageWriteBuffer:
+    """
+    Write-behind buffer coalescing new messages of all connections into insert_many batches.
+
+    A batch is written when it reaches batch_size messages or flush_interval seconds after its first message was
+    submitted, whichever comes first. Batches are written by a single flusher thread in submission order, so
+    messages keep their order within a chat. Every submitted message gets a future, resolved with the Message
+    (with its mid) once the batch is written.
+
+    Attributes:
+        storage: The PychStorage the messages are written to.
+        batch_size: The maximum number of messages in a batch.
+        flush_interval: The maximum time in seconds a message waits for its batch to fill up.
+        pending: The submitted messages with their futures, not taken by the flusher yet.
+        batches: The number of written batches.
+        written: The number of written messages.
+        failed: The number of messages that weren't written.
+    """
+
+    def __init__(self, storage, batch_size, flush_interval, max_in_flight):
+        """
+        Initialize a MessageWriteBuffer and start its flusher thread.
+
+        Args:
+            storage: The PychStorage the messages are written to.
+            batch_size: The maximum number of messages in a batch.
+            flush_interval: The maximum time in seconds a message waits for its batch to fill up.
+            max_in_flight: The maximum number of submitted messages that aren't written yet, submit blocks
+                           when it is reached.
+        """
+
+        self.storage = storage
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.cond = threading.Condition()
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.pending = deque()
+        self.closed = False
+
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+
+        self.thread = threading.Thread(
+            target=self.run, name="pych-write-buffer", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, message):
+        """
+        Put a message into the buffer.
+
+        Blocks while max_in_flight messages aren't written yet.
+
+        Args:
+            message: The Message object to write.
+
+        Returns:
+            A Future resolved with the Message once it is written.
+
+        Raises:
+            RuntimeError: If the buffer is closed.
+        """
+
+        self.slots.acquire()
+        future = Future()
+        with self.cond:
+            if self.closed:
+                self.slots.release()
+                raise RuntimeError("write buffer is closed")
+
+            self.pending.append((message, future, time.monotonic()))
+            if len(self.pending) == 1 or len(self.pending) >= self.batch_size:
+                self.cond.notify()
+        return future
+
+    def take_batch(self):
+        """
+        Wait until a batch is full or its first message waited for flush_interval, and take it.
+
+        Returns:
+            A list of (message, future) pairs, empty if the buffer is closed and drained.
+        """
+
+        with self.cond:
+            while not self.pending and not self.closed:
+                self.cond.wait()
+
+            while self.pending and len(self.pending) < self.batch_size and not self.closed:
+                left = self.pending[0][2] + self.flush_interval - time.monotonic()
+                if left <= 0:
+                    break
+                self.cond.wait(left)
+
+            count = min(len(self.pending), self.batch_size)
+            return [self.pending.popleft()[:2] for _ in range(count)]
+
+    def write_batch(self, batch):
+        """
+        Write a batch with a single insert_many and resolve the futures of its messages.
+
+        Writes are ordered: if one of the messages fails, the messages before it are written and
+        the rest are failed.
+
+        Args:
+            batch: A list of (message, future) pairs.
+        """
+
+        messages = [message for message, _ in batch]
+        try:
+            self.storage.add_messages(messages)
+            inserted, error = len(batch), None
+        except BulkWriteError as e:
+            inserted, error = e.details.get("nInserted", 0), e
+        except Exception as e:
+            inserted, error = 0, e
+
+        self.batches += 1
+        self.written += inserted
+        self.failed += len(batch) - inserted
+
+        for i, (message, future) in enumerate(batch):
+            self.slots.release()
+            if i < inserted:
+                future.set_result(message)
+            else:
+                future.set_exception(error)
+
+    def run(self):
+        """
+        The flusher thread, writes batches until the buffer is closed and drained.
+        """
+
+        while True:
+            batch = self.take_batch()
+            if not batch:
+                return
+            self.write_batch(batch)
+
+    def stats(self):
+        """
+        Get the counters of the buffer.
+
+        Returns:
+            A dictionary with the number of pending messages, written batches, written and failed messages.
+        """
+
+        with self.cond:
+            pending = len(self.pending)
+
+        return {
+            "pending": pending,
+            "batches": self.batches,
+            "written": self.written,
+            "failed": self.failed,
+        }
+
+    def close(self, timeout=None):
+        """
+        Write the pending messages and stop the flusher thread.
+
+        Args:
+            timeout: The maximum time in seconds to wait for the pending messages (optional).
+        """
+
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join(timeout)
+
+
+def get_write_buffer(cfg, storage):
+    """
+    Create the write buffer of the WebSocket server if it is enabled in the configuration.
+
+    Args:
+        cfg: The configuration object containing application settings.
+        storage: The PychStorage instance for data storage.
+
+    Returns:
+        A MessageWriteBuffer, or None if messages are written one by one.
+    """
+
+    if not cfg.write_buffer['enabled']:
+        return None
+
+    return MessageWriteBuffer(
+        storage,
+        cfg.write_buffer['batch_size'],
+        cfg.write_buffer['flush_interval_ms'] / 1000,
+        cfg.write_buffer['max_in_flight']
+    )
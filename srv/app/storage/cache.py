@@ -0,0 +1,116 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe bounded LRU cache with an optional time to live of the entries.
+
+    Attributes:
+        maxsize: The maximum number of entries, the least recently used entry is evicted first.
+        ttl: The time to live of an entry in seconds, None for entries that never expire.
+        hits: The number of lookups that found a live entry.
+        misses: The number of lookups that found nothing or an expired entry.
+    """
+
+    def __init__(self, maxsize, ttl=None, clock=time.monotonic):
+        """
+        Initialize an LRUCache.
+
+        Args:
+            maxsize: The maximum number of entries.
+            ttl: The time to live of an entry in seconds (optional).
+            clock: The function returning the current time in seconds (optional).
+        """
+
+        if maxsize <= 0:
+            raise ValueError("maxsize should be positive")
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        """
+        Get a cached value.
+
+        Args:
+            key: The key of the entry.
+            default: The value to return if there is no live entry.
+
+        Returns:
+            The cached value or default.
+        """
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > self.clock():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """
+        Put a value into the cache, evicting the least recently used entry if the cache is full.
+
+        Args:
+            key: The key of the entry.
+            value: The value to cache.
+        """
+
+        expires = None if self.ttl is None else self.clock() + self.ttl
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """
+        Remove an entry from the cache.
+
+        Args:
+            key: The key of the entry.
+        """
+
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        """
+        Remove all entries from the cache.
+        """
+
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        Get the counters of the cache.
+
+        Returns:
+            A dictionary with hits, misses, the current size and maxsize.
+        """
+
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+            }
@@ -0,0 +1,158 @@
+import os
+import time
+import queue
+import multiprocessing
+from .provider import gen_key_pair
+
+# Indexes of the shared counters
+PENDING, GENERATED, INLINE, FAILED = range(4)
+
+
+def fill(secret, pairs, counters, completions):
+    """
+    Generate key pairs into the pool forever, the body of a generator process.
+
+    A generated pair waits until there is room in the pool, so the pool never holds more than its size. It
+    isn't pending while it waits, pending counts only the pairs being generated.
+
+    Args:
+        secret: The secret encrypting the private keys.
+        pairs: The queue of ready key pairs.
+        counters: The shared counters of the pool.
+        completions: The shared ring of the time.time() times of the last generations.
+    """
+
+    while True:
+        with counters.get_lock():
+            counters[PENDING] += 1
+        try:
+            pair = gen_key_pair(secret)
+        except Exception:
+            with counters.get_lock():
+                counters[PENDING] -= 1
+                counters[FAILED] += 1
+            time.sleep(1)
+            continue
+
+        with counters.get_lock():
+            counters[PENDING] -= 1
+        pairs.put(pair)
+        with counters.get_lock():
+            completions[counters[GENERATED] % len(completions)] = time.time()
+            counters[GENERATED] += 1
+
+
+class KeyPool:
+    """
+    Pool of pre-generated RSA key pairs for user registration.
+
+    The pool keeps up to size ready key pairs, generated in the background by worker processes, so registration
+    takes a ready pair instead of generating one on the request thread. When the pool is empty, the pair is
+    generated inline. KeyPool has the gen_key_pair method of RSAAdapter, so it is passed to PychStorage in place
+    of the adapter.
+
+    The ready pairs and the counters live in shared memory: a pool created before gunicorn forks its workers is
+    shared by all of them, so the server runs one set of worker processes and keeps size pairs ready in total,
+    whatever the number of REST workers.
+
+    Attributes:
+        rp: The RSAAdapter whose secret encrypts the private keys.
+        size: The number of key pairs to keep ready.
+        pairs: The queue of ready key pairs, None if the pool is disabled (size 0).
+        counters: The shared pending, generated, inline and failed counters.
+        completions: The shared ring of the times of the last generations, for the refill rate.
+        processes: The worker processes.
+        owner: The pid of the process that started the workers.
+    """
+
+    def __init__(self, rp, size, workers):
+        """
+        Initialize a KeyPool and start filling it.
+
+        Args:
+            rp: The RSAAdapter whose secret encrypts the private keys.
+            size: The number of key pairs to keep ready.
+            workers: The number of worker processes.
+        """
+
+        self.rp = rp
+        self.size = size
+
+        # spawn: workers don't inherit threads and sockets of the server process
+        ctx = multiprocessing.get_context("spawn")
+        self.counters = ctx.Array("q", 4)
+        self.completions = ctx.Array("d", max(size, 2))
+        self.pairs = ctx.Queue(size) if size > 0 else None
+        self.processes = []
+        self.owner = os.getpid()
+        if self.pairs is None:
+            return
+
+        for i in range(workers):
+            process = ctx.Process(
+                target=fill, args=(rp.secret, self.pairs, self.counters, self.completions),
+                name=f"pych-keypool-{i}", daemon=True
+            )
+            process.start()
+            self.processes.append(process)
+
+    def gen_key_pair(self):
+        """
+        Take a ready key pair from the pool, or generate one inline if the pool is empty.
+
+        Returns:
+            pub_pem, p_pem: public key (as bytes) and private key (as bytes).
+        """
+
+        try:
+            if self.pairs is not None:
+                return self.pairs.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.counters.get_lock():
+            self.counters[INLINE] += 1
+        return self.rp.gen_key_pair()
+
+    def stats(self):
+        """
+        Get the counters of the pool.
+
+        Returns:
+            A dictionary with the pool depth, the pairs being generated (pending), counters and the refill rate
+            (key pairs per second over the last completions).
+        """
+
+        with self.counters.get_lock():
+            counters = list(self.counters)
+            completions = sorted(t for t in self.completions if t)
+
+        stats = {
+            "depth": self.pairs.qsize() if self.pairs is not None else 0,
+            "size": self.size,
+            "pending": counters[PENDING],
+            "generated": counters[GENERATED],
+            "inline": counters[INLINE],
+            "failed": counters[FAILED],
+        }
+
+        rate = 0.0
+        if len(completions) > 1 and completions[-1] > completions[0]:
+            rate = (len(completions) - 1) / (completions[-1] - completions[0])
+        stats["refill_rate"] = rate
+        return stats
+
+    def close(self):
+        """
+        Stop the worker processes, the pairs being generated are dropped.
+
+        Only the process that started the pool stops them, so a forked gunicorn worker exiting doesn't stop the
+        pool of its siblings.
+        """
+
+        if os.getpid() != self.owner:
+            return
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
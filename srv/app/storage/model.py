@@ -1,5 +1,6 @@
 import hashlib
-from app.storage.provider import RSAAdapter
+from .provider import RSAAdapter
+from .search import get_user_ngrams
 
 
 class User:
@@ -76,6 +77,7 @@ class User:
             "u_pub_pem": self.u_pub_k,
             "s_p_pem": self.s_p_k,
             "s_pub_pem": self.s_pub_k,
+            "ngrams": get_user_ngrams(self.name, self.hostname),
         }
 
     def uid_as_bytes(self):
@@ -142,6 +144,81 @@ class User:
         return login.split("@")
 
 
+class UserView:
+    """
+    A set of user fields fetched from the database.
+
+    Views map to Mongo projections, so a query only transfers the fields its caller uses. Fields outside
+    the view are None in the loaded User.
+
+    Attributes:
+        name: The name of the view.
+        fields: The stored fields of the view, None for all fields.
+    """
+
+    def __init__(self, name, fields=None):
+        """
+        Initialize a UserView instance.
+
+        Args:
+            name: The name of the view.
+            fields: The stored fields of the view, None for all fields (optional).
+        """
+
+        self.name = name
+        self.fields = fields
+
+    def __repr__(self):
+        """
+        Return a string representation of the view.
+
+        Returns:
+            The name of the view.
+        """
+
+        return f"UserView({self.name})"
+
+    def projection(self):
+        """
+        Get the Mongo projection of the view.
+
+        Returns:
+            A projection dictionary, or None to fetch the whole document.
+        """
+
+        if self.fields is None:
+            return None
+        return {field: 1 for field in self.fields}
+
+    def load(self, doc):
+        """
+        Create a User from a document fetched with the projection of the view.
+
+        Args:
+            doc: The user document.
+
+        Returns:
+            The User object.
+        """
+
+        user = User(
+            doc.get("name"), doc.get("hostname"), doc.get("password"),
+            doc.get("u_pub_pem"), uid=doc.get("_id")
+        )
+        user.set_srv_certificates(doc.get("s_pub_pem"), doc.get("s_p_pem"))
+        return user
+
+
+# login: search results and chat participants, auth: password check and login response,
+# crypto: chat keys, full: the whole document (cached users)
+UserView.LOGIN = UserView("login", ("name", "hostname"))
+UserView.AUTH = UserView("auth", ("name", "hostname", "password", "s_pub_pem"))
+UserView.CRYPTO = UserView(
+    "crypto", ("name", "hostname", "u_pub_pem", "s_pub_pem", "s_p_pem")
+)
+UserView.FULL = UserView("full")
+
+
 class Chat:
     """
     A class representing a chat session between users.
@@ -203,8 +280,44 @@ class Chat:
             "aes": self.aes,
             "init_login": self.init_user_login,
             "dst_login": self.dst_user_login,
+            "key": self.get_key(self.init_user_login, self.dst_user_login),
+            "participants": self.get_participants(
+                self.init_user_login, self.dst_user_login
+            ),
         }
 
+    @staticmethod
+    def get_participants(first_login, second_login):
+        """
+        Get the participants of a chat in canonical order.
+
+        Args:
+            first_login: The login of one participant.
+            second_login: The login of the other participant.
+
+        Returns:
+            The sorted list of both logins.
+        """
+
+        return sorted([first_login, second_login])
+
+    @staticmethod
+    def get_key(first_login, second_login):
+        """
+        Get the canonical key of a chat between two users.
+
+        The key doesn't depend on who started the chat, so a chat is found with a single equality lookup.
+
+        Args:
+            first_login: The login of one participant.
+            second_login: The login of the other participant.
+
+        Returns:
+            The key of the chat.
+        """
+
+        return "|".join(Chat.get_participants(first_login, second_login))
+
     def safe_serialize(self, sp):
         """
         Safely serializes the chat object for secure storage and transmission.
@@ -220,6 +333,7 @@ class Chat:
         """
 
         model = self.to_mongo()
+        del model["key"], model["participants"]
         if isinstance(model["aes"], (bytes, bytearray)):
             model["aes"] = model["aes"].decode('utf-8')
 
@@ -232,19 +346,21 @@ class Message:
     """
     A class representing a message within a chat.
 
-    This class encapsulates the details of a message, including its content, author, timestamp, and read status.
+    This class encapsulates the details of a message, including its content, author and timestamp. Read status is
+    tracked per user with read cursors in the storage.
     It provides methods to prepare the message for storage and to serialize it for transmission.
 
     Attributes:
         mid: Message identifier, optional.
+        seq: The number of the message in its chat, assigned by the storage on insert. Numbers of a chat are
+             consecutive, starting from 1, optional.
         msg: The content of the message.
         chat: The chat object to which the message belongs.
         author_id: The identifier of the message author.
         timestamp: The timestamp of the message.
-        read: A flag indicating whether the message has been read.
     """
 
-    def __init__(self, chat, author_id, msg, timestamp, mid=None):
+    def __init__(self, chat, author_id, msg, timestamp, mid=None, seq=None):
         """
         Initialize a Message instance.
 
@@ -254,14 +370,15 @@ class Message:
             msg: The content of the message.
             timestamp: The timestamp of the message.
             mid: An identifier for the message. Defaults to None.
+            seq: The number of the message in its chat. Defaults to None.
         """
 
         self.mid = mid
+        self.seq = seq
         self.msg = msg
         self.chat = chat
         self.author_id = author_id
         self.timestamp = timestamp
-        self.read = False
 
     def to_mongo(self):
         """
@@ -275,10 +392,29 @@ class Message:
             "msg": self.msg,
             "chat_id": str(self.chat.cid),
             "author_id": self.author_id,
-            "read": self.read,
             "timestamp": self.timestamp,
+            "seq": self.seq,
         }
 
+    @staticmethod
+    def from_mongo(chat, doc):
+        """
+        Creates a message from its MongoDB document.
+
+        Args:
+            chat: The chat object to which the message belongs.
+            doc: The message document.
+
+        Returns:
+            The Message object.
+        """
+
+        return Message(
+            chat, doc.get("author_id"), doc.get("msg"),
+            doc.get("timestamp"),
+            mid=doc.get("_id"), seq=doc.get("seq"),
+        )
+
     def serialize(self):
         """
         Serializes the message for transmission.
@@ -291,4 +427,5 @@ class Message:
             "msg": self.msg,
             "author_id": self.author_id,
             "timestamp": self.timestamp,
+            "seq": self.seq,
         }
@@ -1,7 +1,56 @@
+import time
 import falcon
 import pymongo
-from .model import User, Chat, Message
+from datetime import datetime, timedelta, timezone
+from .cache import LRUCache
+from .provider import forget_public_key
+from ..timing import StartupTimer
+from .model import User, UserView, Chat, Message
+from . import search
 from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from pymongo import IndexModel, ReturnDocument, ASCENDING, DESCENDING
+
+# Seconds a sync state is kept, a client syncing with an older token gets everything again
+SYNC_STATE_TTL = 30 * 24 * 3600
+
+# Indexes maintained by PychStorage, per collection. Default index names are used,
+# so indexes created before the registry are matched by name.
+INDEXES = {
+    "users": [
+        IndexModel([("name", ASCENDING), ("hostname", ASCENDING)], unique=True),
+        IndexModel([("hostname", ASCENDING), ("name", ASCENDING)]),
+        IndexModel([("ngrams", ASCENDING)]),
+    ],
+    "chats": [
+        IndexModel([("key", ASCENDING)], unique=True),
+        IndexModel([("participants", ASCENDING)]),
+    ],
+    "messages": [
+        IndexModel([("chat_id", ASCENDING), ("_id", ASCENDING)]),
+        # Unread messages and history pages in number order. Not partial, so legacy messages without a number
+        # (a null seq) are ranges of _id in it
+        IndexModel([("chat_id", ASCENDING), ("seq", ASCENDING), ("_id", ASCENDING)]),
+        # Partial: messages written without a number (by older servers) don't collide
+        IndexModel(
+            [("chat_id", ASCENDING), ("seq", ASCENDING)], unique=True,
+            partialFilterExpression={"seq": {"$exists": True}}
+        ),
+    ],
+    "read_cursors": [
+        IndexModel([("chat_id", ASCENDING), ("user_id", ASCENDING)], unique=True),
+    ],
+    "sync_states": [
+        IndexModel([("created", ASCENDING)], expireAfterSeconds=SYNC_STATE_TTL),
+    ],
+}
+
+# Migrations in the order they are applied. The schema document of the meta collection has the number of applied
+# migrations, so a process starting on a migrated database only reads that document. New migrations go last.
+MIGRATIONS = ["chat_keys", "user_ngrams", "message_seqs"]
+
+# Seconds the process applying migrations holds the lock, after which another process may take it over
+MIGRATION_LEASE = 300
 
 
 class ValidationFailedException(Exception):
@@ -21,7 +70,7 @@ class ValidationFailedException(Exception):
             params: Additional parameters (unused).
         """
 
-        raise falcon.HTTPBadRequest("validation failed")
+        raise falcon.HTTPBadRequest(title="validation failed")
 
 
 class EntityNotFoundException(Exception):
@@ -62,6 +111,26 @@ class DuplicateEntryException(Exception):
         raise falcon.HTTPBadRequest(title="user already registered")
 
 
+class InvalidCursorException(Exception):
+    """
+    Exception raised for a malformed pagination cursor.
+    """
+
+    @staticmethod
+    def handle(ex, req, resp, params):
+        """
+        Handle the InvalidCursorException by raising a Falcon HTTPBadRequest.
+
+        Args:
+            ex: The InvalidCursorException instance.
+            req: The Falcon request object.
+            resp: The Falcon response object.
+            params: Additional parameters (unused).
+        """
+
+        raise falcon.HTTPBadRequest(title="invalid cursor")
+
+
 class PychStorage:
     """
     A class representing the storage and database operations for the Pych application.
@@ -73,78 +142,702 @@ class PychStorage:
         rp: An RSAProvider for generating RSA key pairs and handling encryption.
         con: A MongoDB client connection.
         db: The MongoDB database instance.
+        users_cache: LRU cache of users resolved by uid.
     """
 
-    def __init__(self, cfg, rp):
+    def __init__(self, cfg, rp, timer=None):
         """
         Initialize a PychStorage instance.
 
         Args:
             cfg: Configuration object containing MongoDB connection details.
             rp: An RSAProvider for generating RSA key pairs and handling encryption.
+            timer: A StartupTimer measuring the connection, migrations and index creation (optional).
         """
 
+        timer = timer or StartupTimer()
         self.rp = rp
-        self.con = pymongo.MongoClient(cfg.mongo['con_link'])
-        self.db = self.con[cfg.mongo['db']]
+        self.users_cache = LRUCache(
+            cfg.cache['users_size'], ttl=cfg.cache['users_ttl']
+        )
+
+        with timer.phase("mongo_connect"):
+            self.con = pymongo.MongoClient(cfg.mongo['con_link'])
+            self.db = self.con[cfg.mongo['db']]
+            self.con.admin.command("ping")
+
+        # Migrations go first, unique indexes rely on backfilled fields
+        with timer.phase("migrations"):
+            self.migrations = self.migrate()
+
+        with timer.phase("index_creation"):
+            self.created_indexes = self.ensure_indexes()
+
+    def migrate(self, lease=MIGRATION_LEASE):
+        """
+        Applies the migrations the database hasn't had yet.
+
+        The number of applied migrations is kept in the schema document of the meta collection, so a start on
+        a migrated database is a single lookup. Migrations are applied by one process at a time: it holds a lock
+        in the schema document for lease seconds, the other processes wait until the migrations are applied.
+
+        Args:
+            lease: The seconds the lock is held for, a process that died while migrating releases it then (optional).
+
+        Returns:
+            The number of migrated documents by applied migration.
+        """
+
+        meta = self.db["meta"]
+        while True:
+            schema = meta.find_one({"_id": "schema"}) or {}
+            if schema.get("version", 0) >= len(MIGRATIONS):
+                return {}
+
+            now = datetime.now(timezone.utc)
+            try:
+                schema = meta.find_one_and_update(
+                    {"_id": "schema", "$or": [{"locked_until": None}, {"locked_until": {"$lt": now}}]},
+                    {"$set": {"locked_until": now + timedelta(seconds=lease)}},
+                    upsert=True, return_document=ReturnDocument.AFTER,
+                )
+                break
+            except pymongo.errors.DuplicateKeyError:
+                # The schema document is locked by a process applying the migrations
+                time.sleep(1)
+
+        migrated = {}
+        try:
+            for version in range(schema.get("version", 0), len(MIGRATIONS)):
+                name = MIGRATIONS[version]
+                migrated[name] = getattr(self, f"migrate_{name}")()
+                meta.update_one({"_id": "schema"}, {"$set": {"version": version + 1}})
+        finally:
+            meta.update_one({"_id": "schema"}, {"$unset": {"locked_until": ""}})
+        return migrated
+
+    def migrate_chat_keys(self):
+        """
+        Backfills the canonical key and the participants of chats created before they were stored.
+
+        If there are several chats for the same pair of users, the oldest one keeps the canonical key and the others
+        get a key suffixed with their id, so the unique index on key can be built.
+
+        Returns:
+            The number of migrated chats.
+        """
+
+        chats_collection = self.db["chats"]
+        query = {"key": {"$exists": False}}
+
+        updates, keys = [], set()
+        for doc in chats_collection.find(query).sort("_id", ASCENDING):
+            key = Chat.get_key(doc.get("init_login"), doc.get("dst_login"))
+            if key in keys or chats_collection.count_documents({"key": key}, limit=1):
+                key = f"{key}|{doc['_id']}"
+            keys.add(key)
+
+            updates.append(pymongo.UpdateOne({"_id": doc["_id"]}, {"$set": {
+                "key": key,
+                "participants": Chat.get_participants(
+                    doc.get("init_login"), doc.get("dst_login")
+                ),
+            }}))
+
+        if updates:
+            chats_collection.bulk_write(updates)
+        return len(updates)
+
+    def migrate_user_ngrams(self):
+        """
+        Backfills the search n-grams of users registered before they were stored.
+
+        Returns:
+            The number of migrated users.
+        """
+
+        users_collection = self.db["users"]
+        query = {"ngrams": {"$exists": False}}
+
+        docs = list(users_collection.find(query, {"name": 1, "hostname": 1}))
+        updates = [
+            pymongo.UpdateOne({"_id": doc["_id"]}, {"$set": {
+                "ngrams": search.get_user_ngrams(doc.get("name"), doc.get("hostname")),
+            }})
+            for doc in docs
+        ]
+
+        if updates:
+            users_collection.bulk_write(updates)
+            for doc in docs:
+                self.invalidate_user(doc["_id"])
+        return len(updates)
+
+    def migrate_message_seqs(self):
+        """
+        Backfills the numbers of messages stored without them, in the order of their ids.
+
+        Numbers continue after the counter of the chat, which is moved past the backfilled messages.
+
+        Returns:
+            The number of migrated messages.
+        """
+
+        messages_collection = self.db["messages"]
+        query = {"seq": {"$exists": False}}
+
+        migrated = 0
+        for chat_id in messages_collection.distinct("chat_id", query):
+            docs = list(
+                messages_collection.find({"chat_id": chat_id, **query}, {"_id": 1})
+                .sort("_id", ASCENDING)
+            )
+
+            try:
+                first = self.reserve_seqs(chat_id, len(docs))
+            except (EntityNotFoundException, InvalidId):
+                # Messages of a missing chat stay unnumbered
+                continue
+
+            messages_collection.bulk_write([
+                pymongo.UpdateOne({"_id": doc["_id"]}, {"$set": {"seq": first + i}})
+                for i, doc in enumerate(docs)
+            ])
+            migrated += len(docs)
+        return migrated
+
+    def ensure_indexes(self):
+        """
+        Creates the indexes from the INDEXES registry that are missing in the database.
+
+        Returns:
+            A list of "collection.index" names that were created.
+        """
+
+        created = []
+        for collection, indexes in INDEXES.items():
+            present = self.db[collection].index_information()
+            missing = [i for i in indexes if i.document["name"] not in present]
+            if not missing:
+                continue
+
+            names = self.db[collection].create_indexes(missing)
+            created.extend(f"{collection}.{name}" for name in names)
+        return created
+
+    def index_report(self):
+        """
+        Compares the indexes in the database with the INDEXES registry.
+
+        Returns:
+            A dictionary with a report per collection: missing - registered indexes absent in the database,
+            unmanaged - indexes in the database that aren't registered, unused - indexes that served
+            no operations since the server started (empty if index statistics aren't available).
+        """
+
+        report = {}
+        for collection, indexes in INDEXES.items():
+            present = self.db[collection].index_information()
+            managed = {i.document["name"] for i in indexes}
+
+            try:
+                stats = self.db[collection].aggregate([{"$indexStats": {}}])
+                unused = sorted(
+                    s["name"] for s in stats
+                    if s["accesses"]["ops"] == 0 and s["name"] != "_id_"
+                )
+            except pymongo.errors.OperationFailure:
+                unused = []
+
+            report[collection] = {
+                "missing": sorted(managed - present.keys()),
+                "unmanaged": sorted(present.keys() - managed - {"_id_"}),
+                "unused": unused,
+            }
+        return report
+
+    def drop_unmanaged_indexes(self):
+        """
+        Drops the indexes that aren't registered in INDEXES (except _id).
+
+        Returns:
+            A list of "collection.index" names that were dropped.
+        """
+
+        dropped = []
+        for collection, report in self.index_report().items():
+            for name in report["unmanaged"]:
+                self.db[collection].drop_index(name)
+                dropped.append(f"{collection}.{name}")
+        return dropped
+
+    def reserve_seqs(self, cid, count):
+        """
+        Reserves consecutive message numbers of a chat.
+
+        The counter of the chat is moved with an atomic $inc, so concurrent writers never get the same numbers.
+        If a reserved number isn't used (the insert failed), it stays a gap.
+
+        Args:
+            cid: The identifier of the chat.
+            count: The number of message numbers to reserve.
+
+        Returns:
+            The first reserved number.
+        """
+
+        chats_collection = self.db["chats"]
+        doc = chats_collection.find_one_and_update(
+            {"_id": ObjectId(cid)}, {"$inc": {"seq": count}},
+            projection={"seq": 1}, upsert=False,
+            return_document=ReturnDocument.AFTER
+        )
 
-        # Проверяем, что индекс уникален
-        self.db["users"].create_index({"name": 1}, unique=True)
+        if doc is None:
+            raise EntityNotFoundException()
+        return doc["seq"] - count + 1
 
     def add_message(self, message):
         """
-        Adds a message to the database.
+        Adds a message to the database, the message gets the next number of its chat.
 
         Args:
             message: The message object to be added to the database.
+
+        Raises:
+            EntityNotFoundException: If the chat of the message doesn't exist.
         """
 
+        message.seq = self.reserve_seqs(message.chat.cid, 1)
+
         messages_collection = self.db["messages"]
         inserted = messages_collection.insert_one(message.to_mongo())
         message.mid = inserted.inserted_id
 
-    def set_message_read(self, message):
+    def add_messages(self, messages):
         """
-        Sets message as being read by user.
+        Adds messages to the database with a single ordered insert.
+
+        Messages get the next numbers of their chats in list order, numbers are reserved with one counter
+        update per chat.
 
         Args:
-            message: The message object to be changed.
+            messages: The list of message objects to be added to the database.
+
+        Raises:
+            EntityNotFoundException: If the chat of one of the messages doesn't exist, no messages are inserted.
+            pymongo.errors.BulkWriteError: If some of the messages were not inserted, the messages before the
+                                           first failed one are inserted.
         """
 
+        chats = {}
+        for message in messages:
+            chats.setdefault(str(message.chat.cid), []).append(message)
+        for cid, chat_messages in chats.items():
+            first = self.reserve_seqs(cid, len(chat_messages))
+            for i, message in enumerate(chat_messages):
+                message.seq = first + i
+
         messages_collection = self.db["messages"]
-        message.read = True
+        docs = [message.to_mongo() for message in messages]
+        try:
+            messages_collection.insert_many(docs, ordered=True)
+        finally:
+            # insert_many sets the ids of the documents before sending them
+            for message, doc in zip(messages, docs):
+                message.mid = doc.get("_id")
+
+    def set_read_cursor(self, chat, user_id, message):
+        """
+        Moves the read cursor of the user in the chat forward.
+
+        The cursor is a high-water mark: all messages of the chat up to the number (seq) of the message are read by
+        the user. It never moves backwards, so a whole delivered batch is acknowledged with one upsert of its last
+        message. The id of the message is kept too, for legacy messages stored without a number.
 
-        messages_collection.update_one({
-            "_id": message.mid
+        Args:
+            chat: The chat object the messages belong to.
+            user_id: The identifier of the user who read the messages.
+            message: The last read Message.
+        """
+
+        marks = {"mid": message.mid}
+        if message.seq is not None:
+            marks["seq"] = message.seq
+
+        cursors_collection = self.db["read_cursors"]
+        cursors_collection.update_one({
+            "chat_id": str(chat.cid),
+            "user_id": str(user_id),
         }, {
-            "$set": {
-                "read": True
-            }
-        }, upsert=False)
+            "$max": marks
+        }, upsert=True)
 
-    def get_messages(self, chat):
+    def get_read_cursor(self, chat, user_id):
         """
-        Gets messages that belongs to specified chat. Returns only messages that user haven't read
+        Gets the read cursor of the user in the chat.
+
+        Args:
+            chat: The chat object.
+            user_id: The identifier of the user.
+
+        Returns:
+            The cursor document with the number (seq) and the id (mid) of the last message read by the user,
+            or None if the user haven't read anything yet. Cursors moved before messages were numbered have no seq.
+        """
+
+        cursors_collection = self.db["read_cursors"]
+        return cursors_collection.find_one({
+            "chat_id": str(chat.cid),
+            "user_id": str(user_id),
+        })
+
+    def unread_query(self, chat, reader_id):
+        """
+        Builds the query of the messages of the chat the user hasn't read.
 
         Args:
             chat: Chat object for filtering messages.
+            reader_id: The identifier of the user reading the chat, their own messages are skipped.
+
+        Returns:
+            A Mongo query.
+        """
+
+        return self.unread_after(chat.cid, reader_id, self.get_read_cursor(chat, reader_id))
+
+    @staticmethod
+    def unread_after(cid, reader_id, cursor):
+        """
+        Builds the query of the messages of a chat after a read cursor.
+
+        Messages are unread if they are numbered after the read cursor. Legacy messages stored without a number
+        are compared by id, as are all messages if the cursor was moved before messages were numbered.
+
+        Args:
+            cid: The identifier of the chat.
+            reader_id: The identifier of the user reading the chat, their own messages are skipped.
+            cursor: The read cursor document of the user, None if they haven't read anything yet.
+
+        Returns:
+            A Mongo query.
         """
 
-        messages_collection = self.db["messages"]
         query = {
-            "chat_id": str(chat.cid),
-            "read": False,
+            "chat_id": str(cid),
+            "author_id": {"$ne": str(reader_id)},
+        }
+
+        if cursor is None:
+            # Chats without a cursor still rely on the legacy shared read flag
+            query["read"] = {"$ne": True}
+        elif cursor.get("seq") is None:
+            query["_id"] = {"$gt": cursor["mid"]}
+        else:
+            query["$or"] = [
+                {"seq": {"$gt": cursor["seq"]}},
+                {"seq": {"$exists": False}, "_id": {"$gt": cursor["mid"]}},
+            ]
+        return query
+
+    def count_unread(self, chat, reader_id, limit=0):
+        """
+        Counts the messages of the chat the user hasn't read.
+
+        Args:
+            chat: Chat object for filtering messages.
+            reader_id: The identifier of the user reading the chat.
+            limit: Stop counting at limit messages, 0 for no limit (optional).
+
+        Returns:
+            The number of unread messages.
+        """
+
+        # $limit must be positive, 0 means no limit
+        options = {"limit": limit} if limit > 0 else {}
+        messages_collection = self.db["messages"]
+        return messages_collection.count_documents(
+            self.unread_query(chat, reader_id), **options
+        )
+
+    def count_unread_by_chat(self, chat_ids, reader_id):
+        """
+        Counts the messages the user hasn't read in several chats with one aggregation.
+
+        Args:
+            chat_ids: The identifiers of the chats.
+            reader_id: The identifier of the user reading the chats.
+
+        Returns:
+            The number of unread messages by chat id, chats without unread messages are left out.
+        """
+
+        if not chat_ids:
+            return {}
+
+        cursors_collection = self.db["read_cursors"]
+        cursors = {
+            doc["chat_id"]: doc
+            for doc in cursors_collection.find({"chat_id": {"$in": chat_ids}, "user_id": str(reader_id)})
         }
 
-        messages = []
-        for doc in messages_collection.find(query):
-            m = Message(
-                chat, doc.get("author_id"), doc.get("msg"),
-                doc.get("timestamp"),
-                mid=doc.get("_id"),
+        messages_collection = self.db["messages"]
+        docs = messages_collection.aggregate([
+            {"$match": {"$or": [self.unread_after(cid, reader_id, cursors.get(cid)) for cid in chat_ids]}},
+            {"$group": {"_id": "$chat_id", "unread": {"$sum": 1}}},
+        ])
+        return {doc["_id"]: doc["unread"] for doc in docs}
+
+    def get_changes(self, user, token=None, limit=50, max_unread=999):
+        """
+        Gets the chats and the messages of the user created since a sync token.
+
+        The token refers to a sync state: the number (seq) of the last message handed over by the sync, per chat
+        of the user. Chat counters only grow, so the chats with new messages are the ones whose counter moved past
+        their number in the state, and their new messages are the ones numbered after it. The changed chats are
+        found with one query, their new messages are fetched with one query and counted with one aggregation,
+        whatever the number of chats. States don't change, so a client that lost a token may sync with the
+        previous one again. A token whose state expired returns everything, as the first sync does.
+
+        A number is reserved before its message is inserted, so a sync may see a message while the one before it
+        is still being written. The state then stops before the missing number and the next sync returns the
+        messages after it again. If the number is still missing then, its insert failed and it is skipped.
+
+        Args:
+            user: The user who syncs.
+            token: The token returned by the previous sync, None for the first sync (optional).
+            limit: The maximum number of new messages returned per chat, the newest are returned (optional).
+            max_unread: The largest returned number of unread messages of a chat (optional).
+
+        Returns:
+            A dictionary with the new chats, the updates of the chats with new messages and the next token.
+            An update has the chat, its new messages (oldest first), the history cursor of older new messages
+            (None if all of them are returned) and the number of unread messages.
+
+        Raises:
+            InvalidCursorException: If the token is malformed.
+        """
+
+        state = self.get_sync_state(user, token)
+        seqs, held = state.get("seqs", {}), set(state.get("held", []))
+
+        chats_collection = self.db["chats"]
+        docs = chats_collection.find(
+            {"participants": user.get_login()},
+            {"aes": 1, "init_login": 1, "dst_login": 1, "seq": 1}
+        )
+
+        chats, changed, next_seqs = [], {}, {}
+        for doc in docs:
+            chat = Chat(
+                doc.get("aes"), b"", doc.get("init_login"),
+                doc.get("dst_login"), plain=True,
+                cid=doc.get("_id")
             )
-            messages.append(m)
-        return messages
+            cid = str(chat.cid)
+            if cid not in seqs:
+                chats.append(chat)
+
+            since = next_seqs[cid] = seqs.get(cid, 0)
+            last = doc.get("seq", 0)
+            if last > since:
+                # Only the newest limit numbers are fetched, the older ones are left to the history cursor
+                changed[cid] = (chat, since, max(since, last - limit), last)
+
+        new_messages = {}
+        messages_collection = self.db["messages"]
+        if changed:
+            docs = messages_collection.find({"$or": [
+                {"chat_id": cid, "seq": {"$gt": lower}}
+                for cid, (chat, since, lower, last) in changed.items()
+            ]}).sort([("chat_id", ASCENDING), ("seq", ASCENDING)])
+            for doc in docs:
+                chat = changed[doc["chat_id"]][0]
+                new_messages.setdefault(doc["chat_id"], []).append(Message.from_mongo(chat, doc))
+
+        next_held = []
+        for cid, messages in new_messages.items():
+            chat, since, lower, last = changed[cid]
+            seq = since
+            for message in messages:
+                expected = max(seq, lower) + 1
+                if message.seq != expected and not (expected == since + 1 and cid in held):
+                    break
+                seq = message.seq
+
+            next_seqs[cid] = seq
+            if seq < last:
+                next_held.append(cid)
+
+        # A chat whose new numbers are all still being written is waited for as well
+        next_held.extend(cid for cid in changed if cid not in new_messages)
+
+        unread = self.count_unread_by_chat(list(new_messages), user.uid)
+        updates = [
+            {
+                "chat": changed[cid][0],
+                "messages": messages,
+                "cursor": self.history_cursor(messages[0]) if changed[cid][2] > changed[cid][1] else None,
+                "unread": min(unread.get(cid, 0), max_unread),
+            }
+            for cid, messages in new_messages.items()
+        ]
+
+        sync_states_collection = self.db["sync_states"]
+        inserted = sync_states_collection.insert_one({
+            "user_id": str(user.uid),
+            "seqs": next_seqs,
+            "held": next_held,
+            "created": datetime.now(timezone.utc),
+        })
+
+        return {
+            "chats": chats,
+            "updates": updates,
+            "token": search.encode_cursor([str(inserted.inserted_id)]),
+        }
+
+    def get_sync_state(self, user, token):
+        """
+        Gets the sync state a sync token refers to.
+
+        Args:
+            user: The user who syncs.
+            token: The token returned by the previous sync, None for the first sync.
+
+        Returns:
+            The state document, an empty dictionary for the first sync or if the state expired.
+
+        Raises:
+            InvalidCursorException: If the token is malformed.
+        """
+
+        if token is None:
+            return {}
+
+        try:
+            sid = ObjectId(search.decode_cursor(token, 1)[0])
+        except Exception:
+            raise InvalidCursorException()
+
+        sync_states_collection = self.db["sync_states"]
+        return sync_states_collection.find_one({"_id": sid, "user_id": str(user.uid)}) or {}
+
+    def get_messages(self, chat, reader_id):
+        """
+        Gets messages that belongs to specified chat. Returns only messages that user haven't read, oldest first
+
+        Args:
+            chat: Chat object for filtering messages.
+            reader_id: The identifier of the user reading the chat, their own messages are skipped.
+        """
+
+        messages_collection = self.db["messages"]
+        query = self.unread_query(chat, reader_id)
+
+        # Legacy messages without a number go first, they are older than the numbered ones
+        docs = messages_collection.find(query).sort([("seq", ASCENDING), ("_id", ASCENDING)])
+        return [Message.from_mongo(chat, doc) for doc in docs]
+
+    def get_messages_after(self, chat, seq, limit):
+        """
+        Gets messages of the chat numbered after seq, in the order of their numbers.
+
+        Args:
+            chat: Chat object for filtering messages.
+            seq: The number of the last message the reader has.
+            limit: The maximum number of returned messages.
+
+        Returns:
+            A list of Message objects.
+        """
+
+        messages_collection = self.db["messages"]
+        docs = (
+            messages_collection.find({"chat_id": str(chat.cid), "seq": {"$gt": seq}})
+            .sort("seq", ASCENDING)
+            .limit(limit)
+        )
+        return [Message.from_mongo(chat, doc) for doc in docs]
+
+    def get_history(self, chat, cursor=None, limit=50):
+        """
+        Gets a page of messages of the chat, newest first.
+
+        Pages are ranges of the (chat_id, seq, _id) index, so a page costs the same regardless of the chat size.
+        Legacy messages stored without a number are older than the numbered ones, they come last by id.
+
+        Args:
+            chat: Chat object for filtering messages.
+            cursor: The cursor returned with the previous page, None for the newest messages (optional).
+            limit: The maximum number of returned messages (optional).
+
+        Returns:
+            A list of Message objects and the cursor of the next (older) page, None if it is the last page.
+
+        Raises:
+            InvalidCursorException: If the cursor is malformed.
+        """
+
+        query = {"chat_id": str(chat.cid)}
+        if cursor is not None:
+            query.update(self.history_query(cursor))
+
+        messages_collection = self.db["messages"]
+        docs = list(
+            messages_collection.find(query, {"chat_id": 0})
+            .sort([("seq", DESCENDING), ("_id", DESCENDING)])
+            .limit(limit + 1)
+        )
+
+        messages = [Message.from_mongo(chat, doc) for doc in docs[:limit]]
+
+        next_cursor = None
+        if len(docs) > limit:
+            next_cursor = self.history_cursor(messages[-1])
+        return messages, next_cursor
+
+    @staticmethod
+    def history_cursor(message):
+        """
+        Makes the cursor of the history page of the messages older than a message.
+
+        Args:
+            message: The oldest message of the previous page.
+
+        Returns:
+            The cursor, the number ("" for a legacy message without one) and the id of the message.
+        """
+
+        seq = "" if message.seq is None else str(message.seq)
+        return search.encode_cursor([seq, str(message.mid)])
+
+    @staticmethod
+    def history_query(cursor):
+        """
+        Builds the query of the messages older than the message of a history cursor.
+
+        Args:
+            cursor: The cursor returned with the previous page.
+
+        Returns:
+            A Mongo query.
+
+        Raises:
+            InvalidCursorException: If the cursor is malformed.
+        """
+
+        try:
+            seq, mid = search.decode_cursor(cursor, 2)
+            mid = ObjectId(mid)
+        except Exception:
+            raise InvalidCursorException()
+
+        if seq == "":
+            return {"seq": {"$exists": False}, "_id": {"$lt": mid}}
+        if not (seq.isascii() and seq.isdigit()):
+            raise InvalidCursorException()
+        return {"$or": [{"seq": {"$lt": int(seq)}}, {"seq": {"$exists": False}}]}
 
     def add_chat(self, chat):
         """
@@ -152,12 +845,18 @@ class PychStorage:
 
         Args:
             chat: The chat object to be added to the database.
+
+        Raises:
+            DuplicateEntryException: If the users already have a chat.
         """
 
         chats_collection = self.db["chats"]
 
-        inserted = chats_collection.insert_one(chat.to_mongo())
-        chat.cid = inserted.inserted_id
+        try:
+            inserted = chats_collection.insert_one(chat.to_mongo())
+            chat.cid = inserted.inserted_id
+        except pymongo.errors.DuplicateKeyError:
+            raise DuplicateEntryException()
 
     def get_chat(self, src_user, dst_user):
         """
@@ -172,21 +871,41 @@ class PychStorage:
         """
 
         chats_collection = self.db["chats"]
+        doc = chats_collection.find_one({
+            "key": Chat.get_key(src_user.get_login(), dst_user.get_login())
+        })
 
-        query = {
-            "init_login": src_user.get_login(),
-            "dst_login": dst_user.get_login(),
-        }
+        if doc is None:
+            raise EntityNotFoundException()
 
-        query_dest = {
-            "init_login": dst_user.get_login(),
-            "dst_login": src_user.get_login(),
-        }
+        return Chat(
+            doc.get("aes"), b"", doc.get("init_login"),
+            doc.get("dst_login"), plain=True,
+            cid=doc.get("_id")
+        )
 
-        doc = chats_collection.find_one({"$or": [
-            query, query_dest
-        ]})
+    def get_chat_by_cid(self, cid, login):
+        """
+        Retrieves a chat by its identifier, if the user is one of its participants.
+
+        Args:
+            cid: The identifier of the chat.
+            login: The login of the user requesting the chat.
 
+        Returns:
+            A chat object.
+
+        Raises:
+            EntityNotFoundException: If there is no such chat or the user doesn't participate in it.
+        """
+
+        try:
+            query = {"_id": ObjectId(cid), "participants": login}
+        except (InvalidId, TypeError):
+            raise EntityNotFoundException()
+
+        chats_collection = self.db["chats"]
+        doc = chats_collection.find_one(query)
         if doc is None:
             raise EntityNotFoundException()
 
@@ -211,20 +930,7 @@ class PychStorage:
         """
 
         chats_collection = self.db["chats"]
-        query = {
-            "init_login": src_user.get_login()
-        }
-
-        query_dest = {
-            "init_login": {
-                "$regex": ".*"
-            },
-            "dst_login": src_user.get_login()
-        }
-
-        docs = chats_collection.find({"$or": [
-            query, query_dest
-        ]})
+        docs = chats_collection.find({"participants": src_user.get_login()})
 
         chats = []
         for doc in docs:
@@ -262,12 +968,30 @@ class PychStorage:
         except pymongo.errors.DuplicateKeyError:
             raise DuplicateEntryException()
 
-    def get_user_by_uid(self, uid):
+    def invalidate_user(self, uid):
+        """
+        Drops the cached copy of a user and its parsed public keys, should be called whenever the user or their
+        keys are changed.
+
+        Args:
+            uid: The unique identifier of the user.
+        """
+
+        user = self.users_cache.get(str(uid))
+        self.users_cache.invalidate(str(uid))
+        if user is not None:
+            forget_public_key(user.u_pub_k)
+            forget_public_key(user.s_pub_k)
+
+    def get_user_by_uid(self, uid, cached=False, view=UserView.FULL):
         """
         Retrieves a user by their unique identifier.
 
         Args:
             uid: The unique identifier of the user.
+            cached: Return the user from users_cache if it is there (optional).
+            view: The UserView of the fields to fetch (optional). Only full users are put into users_cache,
+                  a cached user is returned for any view.
 
         Returns:
             The User object representing the user with the specified UID.
@@ -276,34 +1000,35 @@ class PychStorage:
             EntityNotFoundException: If no user with the specified UID is found.
         """
 
+        if cached:
+            user = self.users_cache.get(str(uid))
+            if user is not None:
+                return user
+
         query = {"_id": ObjectId(uid)}
         users_collection = self.db["users"]
 
-        doc = users_collection.find_one(query)
+        doc = users_collection.find_one(query, view.projection())
         if doc is None:
             raise EntityNotFoundException()
 
-        user = User(
-            doc.get("name"), doc.get("hostname"),
-            doc.get("password"), doc.get("u_pub_pem"),
-            uid=uid
-        )
-
-        user.set_srv_certificates(
-            doc.get("s_pub_pem"),
-            doc.get("s_p_pem")
-        )
+        user = view.load(doc)
+        user.uid = uid
 
+        if view is UserView.FULL:
+            self.users_cache.set(str(uid), user)
         return user
 
-    def get_users_by_filter(self, name='', hostname='', strict=False):
+    def get_users_by_filter(self, name='', hostname='', strict=False, view=UserView.FULL):
         """
         Retrieves users based on optional filtering criteria.
 
         Args:
             name: The name filter (optional).
             hostname: The hostname filter (optional).
-            strict: A flag indicating strict filtering, where both name and hostname must match exactly (optional).
+            strict: A flag indicating strict filtering, where both name and hostname must match exactly,
+                    otherwise they are prefixes (optional).
+            view: The UserView of the fields to fetch (optional).
 
         Returns:
             A list of User objects representing users that match the filtering criteria.
@@ -311,12 +1036,8 @@ class PychStorage:
 
         if not strict:
             query = {
-                "name": {
-                    "$regex": f"{name}"
-                },
-                "hostname": {
-                    "$regex": f"{hostname}"
-                },
+                "name": search.prefix_query(name),
+                "hostname": search.prefix_query(hostname),
             }
         else:
             query = {
@@ -325,17 +1046,75 @@ class PychStorage:
             }
 
         users_collection = self.db["users"]
-        users = []
-        for doc in users_collection.find(query):
-            usr = User(
-                doc.get("name"), doc.get("hostname"), doc.get("password"),
-                doc.get("u_pub_pem"), uid=doc.get("_id")
-            )
+        return [
+            view.load(doc)
+            for doc in users_collection.find(query, view.projection())
+        ]
 
-            usr.set_srv_certificates(
-                doc.get("s_pub_pem"),
-                doc.get("s_p_pem")
-            )
+    def search_users(self, name='', hostname='', limit=20, cursor=None, substring=False, view=UserView.LOGIN):
+        """
+        Searches users page by page.
+
+        By default name and hostname are prefixes, served by the (name, hostname) index, or by the
+        (hostname, name) index if only the hostname is given. With substring, users are looked up by the
+        n-grams of name and hostname, so at least one of them should be as long as an n-gram; the candidates
+        are then checked for the substrings.
+
+        Args:
+            name: The name prefix or substring (optional).
+            hostname: The hostname prefix or substring (optional).
+            limit: The maximum number of returned users (optional).
+            cursor: The cursor returned with the previous page (optional).
+            substring: Match substrings instead of prefixes (optional).
+            view: The UserView of the fields to fetch, it should include name and hostname (optional).
+
+        Returns:
+            A list of User objects and the cursor of the next page, None if it is the last page.
+
+        Raises:
+            ValidationFailedException: If substring search is requested with too short name and hostname.
+            InvalidCursorException: If the cursor is malformed.
+        """
+
+        query = {}
+        if substring:
+            grams = [f"n:{g}" for g in search.get_ngrams(name)]
+            grams += [f"h:{g}" for g in search.get_ngrams(hostname)]
+            if not grams:
+                raise ValidationFailedException()
+
+            query["ngrams"] = {"$all": sorted(grams)}
+            if name:
+                query["name"] = search.substring_query(name)
+            if hostname:
+                query["hostname"] = search.substring_query(hostname)
+            order = ("_id",)
+        else:
+            if name:
+                query["name"] = search.prefix_query(name)
+            if hostname:
+                query["hostname"] = search.prefix_query(hostname)
+            order = ("name", "hostname") if name else ("hostname", "name")
+
+        if cursor is not None:
+            try:
+                values = search.decode_cursor(cursor, len(order))
+                if substring:
+                    values = [ObjectId(values[0])]
+            except Exception:
+                raise InvalidCursorException()
+            query = {"$and": [query, search.after_query(order, values)]}
+
+        users_collection = self.db["users"]
+        docs = list(
+            users_collection.find(query, view.projection())
+            .sort([(field, ASCENDING) for field in order])
+            .limit(limit + 1)
+        )
+
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_cursor = search.encode_cursor([str(docs[-1][f]) for f in order])
 
-            users.append(usr)
-        return users
+        return [view.load(doc) for doc in docs], next_cursor
@@ -1,10 +1,149 @@
 import base64
+import hashlib
+import threading
+from .cache import LRUCache
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.primitives import hashes
 
+# Parsed keys shared by all RSAAdapters of the process, keyed by the fingerprint of the PEM.
+# Loading a PEM is expensive: an encrypted private key runs the PKCS8 KDF on every load.
+KEYS_CACHE = LRUCache(1024)
+
+OAEP_PADDING = padding.OAEP(
+    mgf=padding.MGF1(algorithm=hashes.SHA256()),
+    algorithm=hashes.SHA256(),
+    label=None
+)
+
+
+def as_bytes(value):
+    """
+    Convert a PEM or a secret to bytes.
+
+    Args:
+        value: The value as str or bytes.
+
+    Returns:
+        The value as bytes.
+    """
+
+    if isinstance(value, str):
+        return value.encode()
+    return bytes(value)
+
+
+def public_key_fingerprint(pub_pem):
+    """
+    Get the key of a public key in KEYS_CACHE.
+
+    Args:
+        pub_pem: The public key in PEM format.
+
+    Returns:
+        The fingerprint of the PEM.
+    """
+
+    return "pub:" + hashlib.sha256(as_bytes(pub_pem)).hexdigest()
+
+
+def load_public_key(pub_pem):
+    """
+    Load a public key from PEM, using the process-wide cache of parsed keys.
+
+    Args:
+        pub_pem: The public key in PEM format.
+
+    Returns:
+        The parsed public key.
+    """
+
+    pub_pem = as_bytes(pub_pem)
+    fingerprint = public_key_fingerprint(pub_pem)
+
+    pub_k = KEYS_CACHE.get(fingerprint)
+    if pub_k is None:
+        pub_k = serialization.load_pem_public_key(pub_pem)
+        KEYS_CACHE.set(fingerprint, pub_k)
+    return pub_k
+
+
+def forget_public_key(pub_pem):
+    """
+    Drop a parsed public key from KEYS_CACHE.
+
+    Private keys are cached by the PEM and the password, a replaced private key gets a new fingerprint and the
+    old entry is evicted as it ages.
+
+    Args:
+        pub_pem: The public key in PEM format, None is ignored.
+    """
+
+    if pub_pem is not None:
+        KEYS_CACHE.invalidate(public_key_fingerprint(pub_pem))
+
+
+def load_private_key(p_pem, secret):
+    """
+    Load a password protected private key from PEM, using the process-wide cache of parsed keys.
+
+    The password is a part of the fingerprint, so a key is never returned for a wrong password.
+
+    Args:
+        p_pem: The private key in PEM format.
+        secret: The password of the private key.
+
+    Returns:
+        The parsed private key.
+    """
+
+    p_pem, secret = as_bytes(p_pem), as_bytes(secret)
+    fingerprint = "p:" + hashlib.sha256(
+        hashlib.sha256(secret).digest() + p_pem
+    ).hexdigest()
+
+    p_k = KEYS_CACHE.get(fingerprint)
+    if p_k is None:
+        p_k = serialization.load_pem_private_key(p_pem, password=secret)
+        KEYS_CACHE.set(fingerprint, p_k)
+    return p_k
+
+
+def gen_key_pair(secret):
+    """
+    Generate an RSA key pair with the private key encrypted by the secret.
+
+    It is a module level function, so it can be run in worker processes.
+
+    Args:
+        secret: The password for encrypting the private key.
+
+    Returns:
+         pub_pem, p_pem: public key (as bytes) and private key (as bytes).
+    """
+
+    p_k = rsa.generate_private_key(
+        public_exponent=65537,
+        key_size=2048,
+    )
+
+    es = serialization.BestAvailableEncryption(secret.encode())
+    p_pem = p_k.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=es
+    )
+
+    pub_key = p_k.public_key()
+    pub_pem = pub_key.public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
+    return pub_pem, p_pem
+
 
 class FernetAdapter:
     """
@@ -54,20 +193,54 @@ class FernetAdapter:
 
         return self.provider.decrypt(message)
 
+    def encrypt_many(self, messages):
+        """
+        Encrypt several messages using Fernet encryption.
+
+        Args:
+            messages: The messages to be encrypted.
+
+        Returns:
+            The list of encrypted messages.
+        """
+
+        return [self.provider.encrypt(m) for m in messages]
+
+    def decrypt_many(self, messages):
+        """
+        Decrypt several encrypted messages using Fernet decryption.
+
+        Args:
+            messages: The encrypted messages to be decrypted.
+
+        Returns:
+            The list of decrypted messages.
+        """
+
+        return [self.provider.decrypt(m) for m in messages]
+
 
 class RSAAdapter:
     """
     RSAAdapter provides encryption and decryption methods using the RSA asymmetric encryption algorithm.
 
+    PEMs are parsed lazily on the first operation and the parsed keys are kept by the adapter and by the
+    process-wide KEYS_CACHE, so adapters created for the same keys don't parse them again. An adapter created
+    only with a secret generates its own key pair on first access to it, so an adapter used just as a key pair
+    factory (gen_key_pair) costs no RSA work.
+
     Attributes:
         secret: The password for encrypting the private key.
+        keys: The (pub_pem, p_pem) pair, None until the lazily generated pair is needed.
+        pub_k: The parsed public key, None until it is needed.
+        p_k: The parsed private key, None until it is needed.
     """
 
     def __init__(self, secret="", pub_pem=None, p_pem=None):
         """
         Initialize an RSAAdapter for encryption and decryption.
 
-        If neither pub_pem nor p_pem is provided, a new key pair is generated using the secret.
+        If neither pub_pem nor p_pem is provided, a new key pair is generated using the secret when it is first used.
         If pub_pem and p_pem are provided, they are used for encryption and decryption operations.
 
         Args:
@@ -77,13 +250,62 @@ class RSAAdapter:
         """
 
         self.secret = secret
+        self.lock = threading.Lock()
 
         if pub_pem is None and p_pem is None:
             if len(secret) == 0:
                 raise Exception("incorrect secret is provided")
-            self.pub_pem, self.p_pem = self.gen_key_pair()
+            self.keys = None
         else:
-            self.pub_pem, self.p_pem = pub_pem, p_pem
+            self.keys = pub_pem, p_pem
+
+        self.pub_k, self.p_k = None, None
+
+    @property
+    def pub_pem(self):
+        """
+        The public key in PEM format.
+        """
+
+        return self.get_pair()[0]
+
+    @property
+    def p_pem(self):
+        """
+        The private key in PEM format.
+        """
+
+        return self.get_pair()[1]
+
+    def get_public_key(self):
+        """
+        Get the parsed public key.
+
+        Returns:
+            The public key object.
+        """
+
+        if self.pub_pem is None:
+            raise Exception("No pub_k provided")
+
+        if self.pub_k is None:
+            self.pub_k = load_public_key(self.pub_pem)
+        return self.pub_k
+
+    def get_private_key(self):
+        """
+        Get the parsed private key.
+
+        Returns:
+            The private key object.
+        """
+
+        if self.p_pem is None or self.secret is None:
+            raise Exception("No pub_k provided")
+
+        if self.p_k is None:
+            self.p_k = load_private_key(self.p_pem, self.secret)
+        return self.p_k
 
     def encrypt(self, message):
         """
@@ -96,20 +318,26 @@ class RSAAdapter:
             The encrypted message in base64-encoded string format.
         """
 
-        if self.pub_pem is None:
-            raise Exception("No pub_k provided")
-
-        pub_k = serialization.load_pem_public_key(self.pub_pem)
-        encrypted = pub_k.encrypt(
-            message.encode(),
-            padding.OAEP(
-                mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                algorithm=hashes.SHA256(),
-                label=None
-            )
-        )
+        encrypted = self.get_public_key().encrypt(message.encode(), OAEP_PADDING)
         return base64.b64encode(encrypted).decode('utf-8')
 
+    def encrypt_many(self, messages):
+        """
+        Encrypt several messages with the same public key.
+
+        Args:
+            messages: The messages to be encrypted.
+
+        Returns:
+            The list of encrypted messages in base64-encoded string format.
+        """
+
+        pub_k = self.get_public_key()
+        return [
+            base64.b64encode(pub_k.encrypt(m.encode(), OAEP_PADDING)).decode('utf-8')
+            for m in messages
+        ]
+
     def decrypt(self, message):
         """
         Decrypt an encrypted message using RSA decryption.
@@ -121,26 +349,27 @@ class RSAAdapter:
             The decrypted message as a string.
         """
 
-        if self.p_pem is None or self.secret is None:
-            raise Exception("No pub_k provided")
+        private_key = self.get_private_key()
         message = base64.b64decode(message)
 
-        # Load the private key
-        private_key = serialization.load_pem_private_key(
-            self.p_pem,
-            password=self.secret.encode()
-        )
-
-        # Decrypt the message
-        d_message = private_key.decrypt(
-            message,
-            padding.OAEP(
-                mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                algorithm=hashes.SHA256(),
-                label=None
-            )
-        )
-        return d_message
+        return private_key.decrypt(message, OAEP_PADDING)
+
+    def decrypt_many(self, messages):
+        """
+        Decrypt several messages with the same private key.
+
+        Args:
+            messages: The base64-encoded encrypted messages.
+
+        Returns:
+            The list of decrypted messages.
+        """
+
+        private_key = self.get_private_key()
+        return [
+            private_key.decrypt(base64.b64decode(m), OAEP_PADDING)
+            for m in messages
+        ]
 
     def gen_key_pair(self):
         """
@@ -152,34 +381,21 @@ class RSAAdapter:
              pub_pem, p_pem: public key (as bytes) and private key (as bytes).
         """
 
-        p_k = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=2048,
-        )
-
-        es = serialization.BestAvailableEncryption(self.secret.encode())
-        p_pem = p_k.private_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PrivateFormat.PKCS8,
-            encryption_algorithm=es
-        )
-
-        pub_key = p_k.public_key()
-        pub_pem = pub_key.public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo
-        )
-
-        return pub_pem, p_pem
+        return gen_key_pair(self.secret)
 
     def get_pair(self):
         """
         Get the public-private key pair.
 
-        This method returns the current public and private key pair as bytes.
+        This method returns the current public and private key pair as bytes, generating it on the first call
+        if the adapter was created without keys.
 
         Returns:
             pub_pem, p_pem: public key (as bytes) and private key (as bytes).
         """
 
-        return self.pub_pem, self.p_pem
+        if self.keys is None:
+            with self.lock:
+                if self.keys is None:
+                    self.keys = self.gen_key_pair()
+        return self.keys
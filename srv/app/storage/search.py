@@ -0,0 +1,132 @@
+import re
+import json
+import base64
+
+# Length of the n-grams indexed for substring search of users
+NGRAM_SIZE = 3
+
+
+def get_ngrams(value, size=NGRAM_SIZE):
+    """
+    Split a string into its overlapping n-grams.
+
+    Args:
+        value: The string to split.
+        size: The length of the n-grams (optional).
+
+    Returns:
+        A set of n-grams, empty if the string is shorter than size.
+    """
+
+    return {value[i:i + size] for i in range(len(value) - size + 1)}
+
+
+def get_user_ngrams(name, hostname):
+    """
+    Get the n-grams stored with a user for substring search.
+
+    Name and hostname n-grams are prefixed with "n:" and "h:", so they are kept in a single indexed field.
+
+    Args:
+        name: The name of the user.
+        hostname: The hostname of the user.
+
+    Returns:
+        A sorted list of prefixed n-grams.
+    """
+
+    grams = {f"n:{g}" for g in get_ngrams(name)}
+    grams.update(f"h:{g}" for g in get_ngrams(hostname))
+    return sorted(grams)
+
+
+def prefix_query(value):
+    """
+    Get an anchored prefix query for a user input, the input is escaped so it can't inject a pattern.
+
+    An anchored case-sensitive prefix is served by an index range scan.
+
+    Args:
+        value: The prefix entered by the user.
+
+    Returns:
+        A Mongo $regex condition.
+    """
+
+    return {"$regex": f"^{re.escape(value)}"}
+
+
+def substring_query(value):
+    """
+    Get an unanchored query for a user input, the input is escaped so it can't inject a pattern.
+
+    Args:
+        value: The substring entered by the user.
+
+    Returns:
+        A Mongo $regex condition.
+    """
+
+    return {"$regex": re.escape(value)}
+
+
+def after_query(order, values):
+    """
+    Get a query for the documents following the given sort values (keyset pagination).
+
+    Args:
+        order: The sort fields, ascending.
+        values: The values of the sort fields of the last returned document.
+
+    Returns:
+        A Mongo query.
+    """
+
+    branches = []
+    for i, field in enumerate(order):
+        branch = dict(zip(order[:i], values[:i]))
+        branch[field] = {"$gt": values[i]}
+        branches.append(branch)
+
+    return branches[0] if len(branches) == 1 else {"$or": branches}
+
+
+def encode_cursor(values):
+    """
+    Encode the sort values of the last returned document into an opaque cursor.
+
+    Args:
+        values: The values of the sort fields (strings).
+
+    Returns:
+        The cursor string.
+    """
+
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor, size):
+    """
+    Decode a cursor produced by encode_cursor.
+
+    Args:
+        cursor: The cursor string.
+        size: The expected number of sort values.
+
+    Returns:
+        The list of sort values.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("malformed cursor")
+
+    valid = isinstance(values, list) and all(isinstance(v, str) for v in values)
+    if not valid or len(values) != size:
+        raise ValueError("malformed cursor")
+    return values
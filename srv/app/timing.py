@@ -0,0 +1,55 @@
+import time
+from contextlib import contextmanager
+
+
+class StartupTimer:
+    """
+    Collects the duration of the startup phases of a process.
+
+    Attributes:
+        started: The moment the timer was created.
+        phases: Mapping of phase name to its duration in milliseconds, in the order the phases ran.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        """
+        Initialize a StartupTimer.
+
+        Args:
+            clock: The function returning the current time in seconds (optional).
+        """
+
+        self.clock = clock
+        self.started = clock()
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Measure the duration of a phase.
+
+        Args:
+            name: The name of the phase.
+        """
+
+        started = self.clock()
+        try:
+            yield
+        finally:
+            self.phases[name] = round((self.clock() - started) * 1000, 3)
+
+    def report(self, logger, **kwargs):
+        """
+        Log the durations of the phases and the total time since the timer was created.
+
+        Args:
+            logger: The structlog logger.
+            **kwargs: Additional fields of the log entry.
+        """
+
+        logger.info(
+            'Startup timing',
+            total_ms=round((self.clock() - self.started) * 1000, 3),
+            **{f"{name}_ms": ms for name, ms in self.phases.items()},
+            **kwargs
+        )
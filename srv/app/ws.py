@@ -1,8 +1,14 @@
-import json
 import threading
-import time
-from app.storage.model import User, Chat, Message
-from wsocket import WSocketApp, WebSocketError, run
+from concurrent.futures import Future
+from .fanout import get_broker
+from .storage.model import User, UserView, Chat, Message
+from .storage.buffer import get_write_buffer
+from .framing import JSONFraming, MsgpackFraming, get_framing, select_subprotocol
+from .deflate import DeflateWebSocket, DeflateWSocketApp, log_compression
+from .sendqueue import SendQueue, SendQueueMonitor, SendQueueOverflow, log_eviction
+from .heartbeat import HeartbeatWebSocket, ConnectionReaper, log_reaping
+from .admission import WS_CLASS, TRY_AGAIN_LATER, get_ws_admission
+from wsocket import WebSocketError, run
 
 
 class ChatProtocol:
@@ -16,14 +22,32 @@ class ChatProtocol:
         sp: The security provider for encryption and decryption.
         ws: The WebSocket connection.
         storage: The storage provider for storing chat messages and data.
-        chat:   The chat where users communicate.
+        broker: The broker used to publish and receive new chat messages.
+        writer: The MessageWriteBuffer for new messages, None to store them one by one.
+        inbox: The SendQueue of messages published by the broker and frames to send to this connection.
+        acks: Whether the client asked for an acknowledgement of every stored message.
+        resume_from: The number of the last message the client has, None to send the unread messages.
+        replay_batch: The number of messages replayed per storage request on resume.
+        batch: Whether the client asked for batch frames instead of a frame per message.
+        batch_size: The maximum number of messages in a batch frame.
+        batch_bytes: The maximum size of the messages of a batch frame, a larger message is sent alone.
+        framing: The framing of the frames, JSONFraming or MsgpackFraming negotiated with a subprotocol.
+        version: The protocol version: 1 - the connection is bound to one chat, 2 - the connection is
+                 subscribed to any chats of the user, every frame carries its chat id.
+        chats: The chats the client is subscribed to (or subscribing to), by id.
+        backlogs: The identifiers of the messages sent as backlog, by id of the subscribed chat.
+        delivered: The number of the last message delivered, by id of the chat, to resync from.
+        evicted: Whether the connection was disconnected because its inbox overflowed.
+        reaped: The reason the connection was reaped for (see ConnectionReaper), None if it wasn't.
+        chat:   The chat where users communicate (version 1).
         author: The user who connected to the chat.
     """
 
     chat: Chat
     author: User
 
-    def __init__(self, sp, ws, storage):
+    def __init__(self, sp, ws, storage, broker, writer=None, replay_batch=100, batch_size=100, batch_bytes=2 ** 15,
+                 framing=JSONFraming, inbox=None):
         """
         Initialize the ChatProtocol.
 
@@ -31,36 +55,129 @@ class ChatProtocol:
             sp: The security provider for encryption and decryption.
             ws: The WebSocket connection.
             storage: The storage provider (mongodb).
+            broker: The ChatBroker shared by all connections of the process.
+            writer: The MessageWriteBuffer shared by all connections of the process (optional).
+            replay_batch: The number of messages replayed per storage request on resume (optional).
+            batch_size: The maximum number of messages in a batch frame (optional).
+            batch_bytes: The maximum size of the messages of a batch frame (optional).
+            framing: The framing of the frames (optional).
+            inbox: The SendQueue of the connection (optional).
         """
 
         self.ws = ws
         self.sp = sp
         self.storage = storage
+        self.broker = broker
+        self.writer = writer
+        self.inbox = inbox if inbox is not None else SendQueue(1000)
+        self.acks = False
+        self.resume_from = None
+        self.replay_batch = replay_batch
+        self.batch = False
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.framing = framing
+        self.version = 1
+        self.chats = {}
+        self.backlogs = {}
+        self.delivered = {}
+        self.evicted = False
+        self.reaped = None
+
+    def parse_message(self, msg):
+        """
+        Parse a received frame
 
-    @staticmethod
-    def parse_message(msg):
+        Args:
+            msg: The frame to parse.
+
+        Returns:
+            The parsed frame as a dictionary.
         """
-        Parse a JSON message
+
+        try:
+            return self.framing.loads(msg)
+        except ValueError:
+            return {"error": f"failed to parse {self.framing.name}"}
+
+    def dump_message(self, msg):
+        """
+        Serialize a frame
 
         Args:
-            msg: The JSON message to parse.
+            msg: The frame to serialize.
 
         Returns:
-            The parsed JSON message as a dictionary.
+            The serialized frame.
+        """
+
+        return self.framing.dumps(msg)
+
+    def subscriber(self, message):
         """
+        Broker callback, puts published messages into the inbox of the connection.
+
+        It is also used to queue frames (dictionaries) and subscription commands (tuples) for communicate,
+        so all writes to the connection are made by one thread. Published messages may be dropped if the client
+        doesn't read fast enough, and if the inbox still overflows the connection is evicted.
+
+        Args:
+            message: The published Message object, a frame or a command.
+        """
+
+        chat = None
+        if isinstance(message, Message):
+            # Messages of the connected user aren't delivered back, so they take no room in the inbox
+            if message.author_id == str(self.author.uid):
+                return
+            chat = str(message.chat.cid)
 
         try:
-            msg = json.loads(msg)
-        except json.JSONDecodeError:
-            return {"error": "failed to parse json"}
-        return msg
+            self.inbox.put(message, chat)
+        except SendQueueOverflow:
+            self.evict()
+
+    def evict(self):
+        """
+        Disconnect a slow client: its inbox is dropped and the connection is aborted.
+        """
+
+        self.evicted = True
+        self.inbox.close()
+        self.abort()
+
+    def reap(self, reason):
+        """
+        Disconnect a client the ConnectionReaper gave up on: its inbox is dropped and the connection is aborted.
+
+        Args:
+            reason: The reason the connection is reaped for.
+        """
+
+        self.reaped = reason
+        self.inbox.close()
+        self.abort()
+
+    def abort(self):
+        """
+        Shut the socket down, so blocked reads and sends of the connection fail at once.
+        """
+
+        self.ws.abort()
+
+    def ping(self):
+        """
+        Send a heartbeat ping, queued by the ConnectionReaper when the client is silent.
+        """
+
+        self.ws.ping()
 
     def get_msg(self):
         """
         Receive a message from the WebSocket connection.
 
         Returns:
-            The parsed JSON message received from the WebSocket.
+            The parsed frame received from the WebSocket.
         """
 
         msg = self.ws.receive()
@@ -71,13 +188,13 @@ class ChatProtocol:
 
     def send_msg(self, msg):
         """
-        Send a JSON message through the WebSocket connection.
+        Send a frame through the WebSocket connection.
 
         Args:
-            msg: The JSON message to send.
+            msg: The frame to send.
         """
 
-        self.ws.send(json.dumps(msg))
+        self.ws.send(self.dump_message(msg))
 
     def auth_by_frame(self):
         """
@@ -87,24 +204,57 @@ class ChatProtocol:
             The authentication result, including the status and user login.
         """
 
-        msg = self.get_msg()
+        return self.authenticate(self.get_msg())
+
+    def authenticate(self, msg):
+        """
+        Authenticate the user by a parsed authentication frame and bind the connection to the chat.
+
+        The frame may have resume_from, the number (seq) of the last message the client has. Then the messages
+        after it are sent instead of the unread ones, so a reconnecting client gets exactly what it missed.
+
+        With "version": 2 the connection isn't bound to a chat, dest_login and resume_from are omitted and
+        chats are subscribed to with subscribe frames (see handle_frame).
+
+        Args:
+            msg: The parsed authentication frame.
+
+        Returns:
+            The authentication result, including the status and user login.
+        """
+
         if "error" in msg:
             return msg
 
+        version = msg.get("version", 1)
+        if version not in (1, 2):
+            return {"error": "unsupported version"}
+
+        resume_from = msg.get("resume_from")
+        if not self.valid_offset(resume_from):
+            return {"error": "invalid resume_from"}
+
         try:
-            tok, login = msg["token"], msg["dest_login"]
-            uid = self.sp.decrypt(tok)
-            src_user = self.storage.get_user_by_uid(uid.decode())
+            uid = self.sp.decrypt(msg["token"])
+            src_user = self.storage.get_user_by_uid(uid.decode(), cached=True)
+            login = msg["dest_login"] if version == 1 else None
         except Exception:
             return {"error": "incorrect auth frame"}
 
+        self.acks = msg.get("acks") is True
+        self.batch = msg.get("batch") is True
+        if version == 2:
+            self.author = src_user
+            self.version = 2
+            return self.auth_result({"status": "ok", "login": src_user.get_login(), "version": 2})
+
         ld = User.parse_login(login)
         if len(ld) != 2:
             return {"error": "invalid destination login"}
         username, hostname = ld
 
         dst_user = self.storage.get_users_by_filter(
-            name=username, hostname=hostname, strict=True
+            name=username, hostname=hostname, strict=True, view=UserView.LOGIN
         )
         if len(dst_user) != 1:
             return {"error": "destination not found"}
@@ -116,33 +266,200 @@ class ChatProtocol:
             return {"error": "create chat before subscribing"}
 
         self.chat = chat
+        self.chats = {str(chat.cid): chat}
         self.author = src_user
+        self.resume_from = resume_from
+
+        return self.auth_result({"status": "ok", "login": src_user.get_login()})
 
-        return {"status": "ok", "login": src_user.get_login()}
+    def auth_result(self, result):
+        """
+        Add the negotiated options to a successful authentication result.
+
+        A client asking for batches learns from "batch" whether the server sends them, older servers omit it.
+
+        Args:
+            result: The authentication result.
+
+        Returns:
+            The authentication result.
+        """
+
+        if self.batch:
+            result["batch"] = {"max_messages": self.batch_size, "max_bytes": self.batch_bytes}
+        return result
+
+    @staticmethod
+    def valid_offset(seq):
+        """
+        Check a message number sent by the client to resume from.
+
+        Args:
+            seq: The number from the frame, None if it is omitted.
+
+        Returns:
+            True if the number is omitted or is a non-negative integer.
+        """
+
+        if seq is None:
+            return True
+        return isinstance(seq, int) and not isinstance(seq, bool) and seq >= 0
+
+    def frame(self, kind, chat, fields):
+        """
+        Make a frame for the protocol version of the connection.
+
+        Version 1 frames are sent as is, version 2 frames get their type and the id of their chat.
+
+        Args:
+            kind: The type of the frame: message, ack, error, subscribed, unsubscribed or resync.
+            chat: The chat of the frame.
+            fields: The fields of the frame.
+
+        Returns:
+            The frame.
+        """
+
+        if self.version == 1:
+            return fields
+        return {"type": kind, "chat": str(chat.cid), **fields}
+
+    def handle_frame(self, msg):
+        """
+        Handle a parsed frame received after authentication.
+
+        Version 1 frames are messages of the chat of the connection. Version 2 frames have a type:
+        {"type": "subscribe", "chat": cid, "resume_from": seq} (resume_from is optional),
+        {"type": "unsubscribe", "chat": cid} and {"type": "message", "chat": cid, "msg": ..., "timestamp": ...}.
+        Messages can only be sent to subscribed chats. Subscriptions are opened and closed by communicate,
+        which confirms them with subscribed and unsubscribed frames.
+
+        Args:
+            msg: The parsed frame.
+
+        Raises:
+            KeyError: If msg or timestamp is not specified in a message frame.
+        """
+
+        if self.version == 1:
+            self.store_message(msg, self.chat)
+            return
+
+        kind, cid = msg.get("type"), str(msg.get("chat"))
+        if kind == "subscribe":
+            if not self.valid_offset(msg.get("resume_from")):
+                self.subscriber({"type": "error", "chat": cid, "error": "invalid resume_from"})
+                return
+            try:
+                chat = self.storage.get_chat_by_cid(cid, self.author.get_login())
+            except Exception:
+                self.subscriber({"type": "error", "chat": cid, "error": "chat not found"})
+                return
+
+            self.chats[cid] = chat
+            self.subscriber(("subscribe", chat, msg.get("resume_from")))
+
+        elif kind == "unsubscribe":
+            if self.chats.pop(cid, None) is not None:
+                self.subscriber(("unsubscribe", cid))
+
+        elif kind == "message":
+            chat = self.chats.get(cid)
+            if chat is None:
+                self.subscriber({"type": "error", "chat": cid, "error": "not subscribed"})
+                return
+            self.store_message(msg, chat)
+
+        else:
+            self.subscriber({"type": "error", "chat": cid, "error": "unknown frame type"})
+
+    def store_message(self, msg, chat):
+        """
+        Store a parsed message frame and publish it to the subscribers of the chat once it is stored.
+
+        With a writer the message is only submitted to the write buffer, so the next frame can be read before
+        the message is written.
+
+        Args:
+            msg: The parsed message frame.
+            chat: The chat of the message.
+
+        Returns:
+            A Future resolved with the stored Message object.
+
+        Raises:
+            KeyError: If msg or timestamp is not specified in the frame.
+        """
+
+        message = Message(
+            chat,
+            str(self.author.uid),
+            msg["msg"],
+            msg["timestamp"]
+        )
+
+        if self.writer is not None:
+            future = self.writer.submit(message)
+        else:
+            future = Future()
+            try:
+                self.storage.add_message(message)
+                future.set_result(message)
+            except Exception as e:
+                future.set_exception(e)
+
+        future.add_done_callback(lambda f: self.on_stored(msg, chat, f))
+        return future
+
+    def on_stored(self, msg, chat, future):
+        """
+        Publish a stored message and acknowledge it, if the client asked for acks.
+
+        The ack frame is {"status": "ack", "id": ..., "timestamp": ..., "mid": ..., "seq": ...}, where id and
+        timestamp are copied from the message frame. If the message wasn't stored, an error frame with the same
+        id and timestamp is sent instead.
+
+        Args:
+            msg: The parsed message frame.
+            chat: The chat of the message.
+            future: The finished Future of store_message.
+        """
+
+        ref = {"id": msg.get("id"), "timestamp": msg["timestamp"]}
+        if future.exception() is not None:
+            print(future.exception())
+            if self.acks:
+                self.subscriber(self.frame("error", chat, {"error": "message not stored", **ref}))
+            return
+
+        message = future.result()
+        self.broker.publish(chat.cid, message)
+        if self.acks:
+            self.subscriber(self.frame("ack", chat, {
+                "status": "ack", **ref, "mid": str(message.mid), "seq": message.seq
+            }))
 
     def serve_new_messages(self):
         """
         Serve new messages received from the WebSocket connection.
 
-        This method continuously listens for new messages, adds them to the storage, and handles any errors.
+        This method continuously listens for new frames, handles them (new messages are stored and published to
+        the subscribers of their chat) and handles any errors. Error frames are queued for communicate like
+        any other frame, so the reader never writes to the connection. When the connection is closed,
+        it wakes up communicate.
         """
 
         while True:
             try:
                 msg = self.get_msg()
                 if "error" in msg:
-                    self.send_msg(msg)
+                    self.subscriber(msg)
                     continue
 
-                self.storage.add_message(Message(
-                    self.chat,
-                    str(self.author.uid),
-                    msg["msg"],
-                    msg["timestamp"]
-                ))
+                self.handle_frame(msg)
 
             except KeyError:
-                self.send_msg({"error": "msg or timestamp not specified"})
+                self.subscriber({"error": "msg or timestamp not specified"})
 
             except WebSocketError:
                 break
@@ -150,26 +467,238 @@ class ChatProtocol:
             except Exception as e:
                 print(e)
 
+        # Closing the inbox wakes up communicate, so it stops waiting for new messages
+        self.inbox.close()
+
+    def pack(self, messages):
+        """
+        Make the frames delivering chat messages to the connected user.
+
+        Messages written by the connected user are skipped. If the client asked for batches, the messages are
+        packed into batch frames of at most batch_size messages and batch_bytes bytes of messages,
+        {"messages": [...]} (version 2 frames also have "type": "batch" and the chat id), otherwise every
+        message gets its own frame.
+
+        Args:
+            messages: The list of Message objects of one chat, oldest first.
+
+        Returns:
+            The list of serialized frames and the last delivered Message (None if there is none).
+        """
+
+        own = str(self.author.uid)
+        messages = [msg for msg in messages if msg.author_id != own]
+        if not messages:
+            return [], None
+
+        if not self.batch:
+            frames = [
+                self.dump_message(self.frame("message", msg.chat, self.framing.message(
+                    {"mid": str(msg.mid), **msg.serialize()}
+                )))
+                for msg in messages
+            ]
+            return frames, messages[-1]
+
+        head = self.frame("batch", messages[0].chat, {})
+        frames, items, size = [], [], 0
+        for msg in messages:
+            item = self.dump_message(self.framing.message({"mid": str(msg.mid), **msg.serialize()}))
+            if items and (len(items) == self.batch_size or size + len(item) > self.batch_bytes):
+                frames.append(self.framing.dumps_batch(head, items))
+                items, size = [], 0
+            items.append(item)
+            size += len(item)
+
+        frames.append(self.framing.dumps_batch(head, items))
+        return frames, messages[-1]
+
+    def deliver(self, messages):
+        """
+        Send chat messages to the connected user and move their read cursor past them.
+
+        The messages are acknowledged with a single storage operation, however many frames they take.
+
+        Args:
+            messages: The list of Message objects of one chat to deliver, oldest first.
+        """
+
+        frames, last = self.pack(messages)
+        for frame in frames:
+            self.ws.send(frame)
+
+        if messages:
+            self.delivered[str(messages[-1].chat.cid)] = messages[-1].seq
+        if last is not None:
+            self.storage.set_read_cursor(last.chat, self.author.uid, last)
+
+    def send_backlog(self, chat, resume_from):
+        """
+        Send the messages of a chat the client missed, before live delivery starts.
+
+        With resume_from, the messages numbered after it are replayed in batches of replay_batch messages,
+        otherwise the unread messages are sent.
+
+        Args:
+            chat: The chat to send the messages of.
+            resume_from: The number of the last message the client has, None to send the unread messages.
+
+        Returns:
+            The set of identifiers of the sent messages.
+        """
+
+        if resume_from is None:
+            messages = self.storage.get_messages(chat, self.author.uid)
+            self.deliver(messages)
+            return {msg.mid for msg in messages}
+
+        sent, after = set(), resume_from
+        while True:
+            messages = self.storage.get_messages_after(
+                chat, after, self.replay_batch
+            )
+            self.deliver(messages)
+            sent.update(msg.mid for msg in messages)
+
+            if len(messages) < self.replay_batch:
+                return sent
+            after = messages[-1].seq
+
+    def subscribe(self, chat, resume_from):
+        """
+        Subscribe the connection to a chat and send the backlog of the chat.
+
+        Args:
+            chat: The chat to subscribe to.
+            resume_from: The number of the last message the client has, None to send the unread messages.
+        """
+
+        # Subscribe before reading the backlog, so messages stored in between aren't lost
+        cid = str(chat.cid)
+        self.broker.subscribe(cid, self.subscriber)
+        self.backlogs[cid] = set()
+        if self.version == 2:
+            self.send_msg(self.frame("subscribed", chat, {}))
+        self.backlogs[cid] = self.send_backlog(chat, resume_from)
+
+    def unsubscribe(self, cid):
+        """
+        Unsubscribe the connection from a chat.
+
+        Args:
+            cid: The identifier of the chat.
+        """
+
+        self.broker.unsubscribe(cid, self.subscriber)
+        self.backlogs.pop(cid, None)
+        self.send_msg({"type": "unsubscribed", "chat": cid})
+
+    def resync(self, cid):
+        """
+        Send the messages of a chat dropped from the inbox again, from the storage.
+
+        A version 2 client gets a resync frame first. Delivery goes on from the last message delivered,
+        or from the read cursor if none was. The sent messages are added to the backlog of the chat,
+        as messages sent by an earlier resync may still be in the inbox.
+
+        Args:
+            cid: The identifier of the chat.
+        """
+
+        chat = self.chats.get(cid)
+        if chat is None or cid not in self.backlogs:
+            return
+
+        if self.version == 2:
+            self.send_msg(self.frame("resync", chat, {}))
+        self.backlogs[cid] |= self.send_backlog(chat, self.delivered.get(cid))
+
+    def published(self, items):
+        """
+        Group the published messages among the items of the inbox by chat.
+
+        Messages of chats the client unsubscribed from and messages already sent with the backlog are skipped.
+        Runs of consecutive messages are grouped, so the order of messages and other items is kept.
+
+        Args:
+            items: The items taken from the inbox.
+
+        Yields:
+            The items that aren't messages and the lists of messages of a chat, oldest first.
+        """
+
+        chats = {}
+        for item in items:
+            if isinstance(item, Message):
+                cid = str(item.chat.cid)
+                backlog = self.backlogs.get(cid)
+                if backlog is not None and item.mid not in backlog:
+                    chats.setdefault(cid, []).append(item)
+                continue
+
+            yield from chats.values()
+            chats = {}
+            yield item
+
+        yield from chats.values()
+
+    def dispatch(self, item):
+        """
+        Handle an item of the inbox: send a frame, run a subscription command or deliver published messages.
+
+        Args:
+            item: A frame (dictionary), a command tuple or a list of Message objects of a chat.
+        """
+
+        if isinstance(item, dict):
+            self.send_msg(item)
+        elif isinstance(item, tuple):
+            command, *args = item
+            getattr(self, command)(*args)
+        else:
+            self.deliver(item)
+
     def communicate(self):
         """
         Continuously communicate with the WebSocket connection.
 
-        This method continuously sends and receives messages between the users in the chat.
+        All writes to the connection are made here. A version 1 connection is subscribed to its chat at once,
+        a version 2 connection when the client asks for it. The backlog of a chat is sent once, and then
+        messages published by the broker are forwarded as soon as they arrive, until the connection is closed.
         """
 
-        while True:
-            try:
-                messages = self.storage.get_messages(self.chat)
-                for msg in messages:
-                    if msg.author_id != str(self.author.uid):
-                        self.send_msg(msg.serialize())
+        try:
+            if self.version == 1:
+                self.subscribe(self.chat, self.resume_from)
 
-                        self.storage.set_message_read(msg)
-                time.sleep(1)
-            except WebSocketError:
-                break
-            except Exception as e:
-                print(e)
+            while True:
+                items = self.inbox.get(self.batch_size)
+                for cid in self.inbox.take_gaps():
+                    self.resync(cid)
+
+                for item in self.published(items):
+                    if item is None:
+                        return
+
+                    try:
+                        self.dispatch(item)
+                    except WebSocketError:
+                        return
+                    except Exception as e:
+                        print(e)
+
+        except WebSocketError:
+            pass
+
+        finally:
+            for cid in list(self.backlogs):
+                self.broker.unsubscribe(cid, self.subscriber)
+
+
+class ChatWebSocket(DeflateWebSocket, HeartbeatWebSocket):
+    """
+    wsocket connection of the chat: configurable permessage-deflate and heartbeats.
+    """
 
 
 def run_wsapp(cfg, logger, sp, storage):
@@ -177,7 +706,9 @@ def run_wsapp(cfg, logger, sp, storage):
     Run the WebSocket application for pychapp.
 
     This function runs the WebSocket application for pychapp. It handles WebSocket connections and authentication,
-    and starts a thread to serve new messages.
+    and starts a thread to serve new messages. New messages are fanned out to the connections through a ChatBroker,
+    optionally after being written in batches by a MessageWriteBuffer. In cluster fanout mode the broker tails
+    the change stream of the messages, so messages stored by the other nodes are delivered too.
 
     Args:
         cfg: The configuration object containing application settings.
@@ -186,7 +717,14 @@ def run_wsapp(cfg, logger, sp, storage):
         storage: The PychStorage instance for data storage.
     """
 
-    app = WSocketApp()
+    app = DeflateWSocketApp(cfg.deflate, protocol=MsgpackFraming.subprotocol, websocket_class=ChatWebSocket)
+    broker = get_broker(cfg, storage)
+    writer = get_write_buffer(cfg, storage)
+    monitor = SendQueueMonitor()
+    reaper = ConnectionReaper(cfg.ws['ping_interval'], cfg.ws['ping_timeout'], cfg.ws['auth_timeout'])
+    reaper.start()
+    admission = get_ws_admission(cfg.admission)
+    monitor.start_reporting(logger, cfg.ws['stats_interval'], *[s for s in (reaper, broker, admission) if s is not None])
 
     @app.route("/ws")
     def handle_websocket(environ, start_response):
@@ -195,18 +733,57 @@ def run_wsapp(cfg, logger, sp, storage):
             start_response()
             return cfg.env
 
+        # Past the limit of open connections the new one is shed at once, before any work is done for it
+        if admission is not None and not admission.try_acquire(WS_CLASS):
+            ws.close(TRY_AGAIN_LATER, "try again later")
+            return
+
         # формат {"token": tok, "dest_login": login}
         # пока ошибки - запрашиваем авторизацию
-        ws_chat = ChatProtocol(sp, ws, storage)
-        msg = ws_chat.auth_by_frame()
-        while "error" in msg:
-            ws_chat.send_msg(msg)
+        # wsocket accepts its single subprotocol if it is offered, the protocol attribute has the offered ones
+        offered = [p.strip() for p in (ws.protocol or "").split(",")]
+        inbox = SendQueue(cfg.ws['send_queue_limit'], cfg.ws['send_queue_policy'])
+        ws_chat = ChatProtocol(
+            sp, ws, storage, broker, writer, cfg.ws['replay_batch'],
+            cfg.ws['batch_max_messages'], cfg.ws['batch_max_bytes'],
+            get_framing(select_subprotocol(offered)), inbox
+        )
+        monitor.register(inbox)
+        reaper.register(ws_chat)
+        try:
+            # The reaper aborts the connection if it isn't authenticated in time
             msg = ws_chat.auth_by_frame()
+            while "error" in msg:
+                ws_chat.send_msg(msg)
+                msg = ws_chat.auth_by_frame()
 
-        ws_chat.send_msg(msg)
-
-        th = threading.Thread(target=ws_chat.serve_new_messages, args=())
-        th.start()
-        ws_chat.communicate()
+            ws_chat.send_msg(msg)
 
-    run(app, host="0.0.0.0")
+            th = threading.Thread(target=ws_chat.serve_new_messages, args=())
+            th.start()
+            ws_chat.communicate()
+
+        except WebSocketError:
+            pass
+
+        finally:
+            if admission is not None:
+                admission.release(WS_CLASS)
+            reaper.unregister(ws_chat)
+            monitor.unregister(inbox, ws_chat.evicted)
+            log_reaping(logger, ws_chat)
+            log_eviction(logger, ws_chat)
+            log_compression(logger, ws, ws_chat)
+
+    logger.info(
+        'Starting pychapp websocket server',
+        mode='threaded',
+        write_buffer=writer is not None,
+        deflate=cfg.deflate['enabled'],
+        send_queue_limit=cfg.ws['send_queue_limit'],
+        ping_interval=cfg.ws['ping_interval'],
+        max_connections=cfg.admission['ws_connections'] if admission is not None else None,
+        fanout=cfg.fanout['enabled'],
+        addr=f"{cfg.ws['host']}:{cfg.ws['port']}"
+    )
+    run(app, host=cfg.ws['host'], port=cfg.ws['port'])
@@ -0,0 +1,415 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from .ws import ChatProtocol
+from .fanout import get_broker
+from .storage.buffer import get_write_buffer
+from .framing import JSONFraming, get_framing, select_subprotocol
+from .deflate import get_deflate_extensions, log_compression
+from .sendqueue import SendQueue, SendQueueMonitor, log_eviction
+from .heartbeat import ConnectionReaper, AUTH_TIMEOUT, HEARTBEAT_TIMEOUT, keepalive_timed_out, log_reaping
+from .admission import WS_CLASS, get_ws_admission
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+from websockets.frames import CloseCode
+
+
+class AsyncChatProtocol(ChatProtocol):
+    """
+    Chat webSocket protocol running on asyncio.
+
+    It speaks the same protocols as ChatProtocol (auth frame, then message and, in version 2, subscription
+    frames), but the reader and the writer are coroutines of a single event loop instead of two OS threads per
+    connection. Blocking storage calls are run in a bounded executor shared by all connections.
+
+    Attributes:
+        loop: The event loop serving the connection.
+        executor: The executor for blocking storage calls.
+        ready: The event set when items are put into the inbox, it wakes up the writer.
+    """
+
+    def __init__(self, sp, ws, storage, broker, executor, writer=None, replay_batch=100,
+                 batch_size=100, batch_bytes=2 ** 15, framing=JSONFraming, inbox=None):
+        """
+        Initialize the AsyncChatProtocol.
+
+        Args:
+            sp: The security provider for encryption and decryption.
+            ws: The websockets connection.
+            storage: The storage provider (mongodb).
+            broker: The ChatBroker shared by all connections of the process.
+            executor: The executor for blocking storage calls.
+            writer: The MessageWriteBuffer shared by all connections of the process (optional).
+            replay_batch: The number of messages replayed per storage request on resume (optional).
+            batch_size: The maximum number of messages in a batch frame (optional).
+            batch_bytes: The maximum size of the messages of a batch frame (optional).
+            framing: The framing of the frames (optional).
+            inbox: The SendQueue of the connection (optional).
+        """
+
+        super().__init__(sp, ws, storage, broker, writer, replay_batch, batch_size, batch_bytes, framing, inbox)
+        self.loop = asyncio.get_running_loop()
+        self.executor = executor
+        self.ready = asyncio.Event()
+
+    def subscriber(self, message):
+        """
+        Broker callback, may be called from any thread.
+
+        Args:
+            message: The published Message object, a frame or a command.
+        """
+
+        super().subscriber(message)
+        self.loop.call_soon_threadsafe(self.ready.set)
+
+    def abort(self):
+        """
+        Abort the connection, so a send waiting for a client that doesn't read fails at once.
+        """
+
+        self.loop.call_soon_threadsafe(self.ws.transport.abort)
+
+    async def run_blocking(self, func, *args):
+        """
+        Run a blocking call in the executor.
+
+        Args:
+            func: The function to call.
+            *args: The arguments of the function.
+
+        Returns:
+            The result of the call.
+        """
+
+        return await self.loop.run_in_executor(self.executor, func, *args)
+
+    async def get_msg(self):
+        """
+        Receive a message from the WebSocket connection.
+
+        Returns:
+            The parsed frame received from the WebSocket.
+        """
+
+        msg = await self.ws.recv()
+        if not msg:
+            return {"error": "empty message"}
+
+        return self.parse_message(msg)
+
+    async def send_msg(self, msg):
+        """
+        Send a frame through the WebSocket connection.
+
+        Args:
+            msg: The frame to send.
+        """
+
+        await self.ws.send(self.dump_message(msg))
+
+    async def auth_by_frame(self):
+        """
+        Authenticate the user by processing an authentication frame.
+
+        Returns:
+            The authentication result, including the status and user login.
+        """
+
+        msg = await self.get_msg()
+        return await self.run_blocking(self.authenticate, msg)
+
+    async def serve_new_messages(self):
+        """
+        Read frames from the WebSocket connection and handle them: store and publish new messages,
+        subscribe to chats and unsubscribe from them.
+        """
+
+        while True:
+            msg = await self.get_msg()
+            if "error" in msg:
+                self.subscriber(msg)
+                continue
+
+            try:
+                await self.run_blocking(self.handle_frame, msg)
+            except KeyError:
+                self.subscriber({"error": "msg or timestamp not specified"})
+            except Exception as e:
+                print(e)
+
+    async def deliver(self, messages):
+        """
+        Send chat messages to the connected user and move their read cursor past them.
+
+        The messages are acknowledged with a single storage operation, however many frames they take.
+
+        Args:
+            messages: The list of Message objects of one chat to deliver, oldest first.
+        """
+
+        frames, last = self.pack(messages)
+        for frame in frames:
+            await self.ws.send(frame)
+
+        if messages:
+            self.delivered[str(messages[-1].chat.cid)] = messages[-1].seq
+        if last is not None:
+            await self.run_blocking(
+                self.storage.set_read_cursor, last.chat, self.author.uid, last
+            )
+
+    async def send_backlog(self, chat, resume_from):
+        """
+        Send the messages of a chat the client missed: the messages numbered after resume_from, replayed
+        in batches, or the unread messages.
+
+        Args:
+            chat: The chat to send the messages of.
+            resume_from: The number of the last message the client has, None to send the unread messages.
+
+        Returns:
+            The set of identifiers of the sent messages.
+        """
+
+        if resume_from is None:
+            messages = await self.run_blocking(
+                self.storage.get_messages, chat, self.author.uid
+            )
+            await self.deliver(messages)
+            return {msg.mid for msg in messages}
+
+        sent, after = set(), resume_from
+        while True:
+            messages = await self.run_blocking(
+                self.storage.get_messages_after, chat, after, self.replay_batch
+            )
+            await self.deliver(messages)
+            sent.update(msg.mid for msg in messages)
+
+            if len(messages) < self.replay_batch:
+                return sent
+            after = messages[-1].seq
+
+    async def subscribe(self, chat, resume_from):
+        """
+        Subscribe the connection to a chat and send the backlog of the chat.
+
+        Args:
+            chat: The chat to subscribe to.
+            resume_from: The number of the last message the client has, None to send the unread messages.
+        """
+
+        # Subscribe before reading the backlog, so messages stored in between aren't lost
+        cid = str(chat.cid)
+        self.broker.subscribe(cid, self.subscriber)
+        self.backlogs[cid] = set()
+        if self.version == 2:
+            await self.send_msg(self.frame("subscribed", chat, {}))
+        self.backlogs[cid] = await self.send_backlog(chat, resume_from)
+
+    async def unsubscribe(self, cid):
+        """
+        Unsubscribe the connection from a chat.
+
+        Args:
+            cid: The identifier of the chat.
+        """
+
+        self.broker.unsubscribe(cid, self.subscriber)
+        self.backlogs.pop(cid, None)
+        await self.send_msg({"type": "unsubscribed", "chat": cid})
+
+    async def resync(self, cid):
+        """
+        Send the messages of a chat dropped from the inbox again, see ChatProtocol.resync.
+
+        Args:
+            cid: The identifier of the chat.
+        """
+
+        chat = self.chats.get(cid)
+        if chat is None or cid not in self.backlogs:
+            return
+
+        if self.version == 2:
+            await self.send_msg(self.frame("resync", chat, {}))
+        self.backlogs[cid] |= await self.send_backlog(chat, self.delivered.get(cid))
+
+    async def dispatch(self, item):
+        """
+        Handle an item of the inbox: send a frame, run a subscription command or deliver published messages.
+
+        Args:
+            item: A frame (dictionary), a command tuple or a list of Message objects of a chat.
+        """
+
+        if isinstance(item, dict):
+            await self.send_msg(item)
+        elif isinstance(item, tuple):
+            command, *args = item
+            await getattr(self, command)(*args)
+        else:
+            await self.deliver(item)
+
+    async def communicate(self):
+        """
+        Subscribe a version 1 connection to its chat, then send frames, run subscription commands
+        and forward messages published by the broker.
+        """
+
+        if self.version == 1:
+            await self.subscribe(self.chat, self.resume_from)
+
+        while True:
+            # Clear the event before taking items, so items put in between wake up the next wait
+            self.ready.clear()
+            items = self.inbox.get(self.batch_size, block=False)
+            if not items:
+                await self.ready.wait()
+                continue
+
+            for cid in self.inbox.take_gaps():
+                await self.resync(cid)
+
+            for item in self.published(items):
+                if item is None:
+                    return
+
+                try:
+                    await self.dispatch(item)
+                except ConnectionClosed:
+                    raise
+                except Exception as e:
+                    print(e)
+
+    async def handle(self, auth_timeout=None):
+        """
+        Serve the connection: authenticate it, then run the reader and the writer until one of them stops.
+
+        Args:
+            auth_timeout: The seconds the client may take to authenticate, None for no limit (optional).
+        """
+
+        try:
+            async with asyncio.timeout(auth_timeout):
+                msg = await self.auth_by_frame()
+                while "error" in msg:
+                    await self.send_msg(msg)
+                    msg = await self.auth_by_frame()
+        except TimeoutError:
+            self.reaped = AUTH_TIMEOUT
+            await self.ws.close(CloseCode.POLICY_VIOLATION, "authentication timeout")
+            return
+
+        await self.send_msg(msg)
+
+        tasks = [
+            asyncio.create_task(self.serve_new_messages()),
+            asyncio.create_task(self.communicate()),
+        ]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for cid in list(self.backlogs):
+                self.broker.unsubscribe(cid, self.subscriber)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def serve_wsapp(cfg, logger, sp, storage):
+    """
+    Serve the asyncio WebSocket application until cancelled.
+
+    Args:
+        cfg: The configuration object containing application settings.
+        logger: The application logger.
+        sp: The security provider for WebSocket communication.
+        storage: The PychStorage instance for data storage.
+    """
+
+    broker = get_broker(cfg, storage)
+    executor = ThreadPoolExecutor(
+        max_workers=cfg.ws['executor_workers'],
+        thread_name_prefix="pych-ws-storage"
+    )
+    writer = get_write_buffer(cfg, storage)
+    monitor = SendQueueMonitor()
+    # Heartbeats are the keepalive of websockets, the reaper only counts the reaped connections
+    reaper = ConnectionReaper(cfg.ws['ping_interval'], cfg.ws['ping_timeout'], cfg.ws['auth_timeout'])
+    admission = get_ws_admission(cfg.admission)
+    monitor.start_reporting(logger, cfg.ws['stats_interval'], *[s for s in (reaper, broker, admission) if s is not None])
+
+    async def handle_websocket(ws):
+        if ws.request.path != "/ws":
+            await ws.close(code=1008, reason="not found")
+            return
+
+        # Past the limit of open connections the new one is shed at once, before any work is done for it
+        if admission is not None and not admission.try_acquire(WS_CLASS):
+            await ws.close(CloseCode.TRY_AGAIN_LATER, "try again later")
+            return
+
+        # формат {"token": tok, "dest_login": login}
+        inbox = SendQueue(cfg.ws['send_queue_limit'], cfg.ws['send_queue_policy'])
+        ws_chat = AsyncChatProtocol(
+            sp, ws, storage, broker, executor, writer, cfg.ws['replay_batch'],
+            cfg.ws['batch_max_messages'], cfg.ws['batch_max_bytes'],
+            get_framing(ws.subprotocol), inbox
+        )
+        monitor.register(inbox)
+        reaper.register(ws_chat)
+        try:
+            await ws_chat.handle(cfg.ws['auth_timeout'] or None)
+        except ConnectionClosed:
+            pass
+        finally:
+            if admission is not None:
+                admission.release(WS_CLASS)
+            if ws_chat.reaped is None and keepalive_timed_out(ws):
+                ws_chat.reaped = HEARTBEAT_TIMEOUT
+            reaper.unregister(ws_chat)
+            monitor.unregister(inbox, ws_chat.evicted)
+            log_reaping(logger, ws_chat)
+            log_eviction(logger, ws_chat)
+            log_compression(logger, ws, ws_chat)
+
+    logger.info(
+        'Starting pychapp websocket server',
+        mode='asyncio',
+        write_buffer=writer is not None,
+        deflate=cfg.deflate['enabled'],
+        send_queue_limit=cfg.ws['send_queue_limit'],
+        ping_interval=cfg.ws['ping_interval'],
+        max_connections=cfg.admission['ws_connections'] if admission is not None else None,
+        fanout=cfg.fanout['enabled'],
+        addr=f"{cfg.ws['host']}:{cfg.ws['port']}"
+    )
+
+    # Compression keeps a zlib context per socket, it is configured by cfg.deflate
+    async with serve(
+            handle_websocket, cfg.ws['host'], cfg.ws['port'],
+            compression=None, extensions=get_deflate_extensions(cfg.deflate), max_size=cfg.ws['max_size'],
+            select_subprotocol=lambda _, offered: select_subprotocol(offered),
+            ping_interval=cfg.ws['ping_interval'] or None, ping_timeout=cfg.ws['ping_timeout'] or None,
+    ) as server:
+        try:
+            await server.serve_forever()
+        finally:
+            if writer is not None:
+                writer.close()
+            executor.shutdown(wait=False)
+
+
+def run_async_wsapp(cfg, logger, sp, storage):
+    """
+    Run the asyncio WebSocket application for pychapp.
+
+    Args:
+        cfg: The configuration object containing application settings.
+        logger: The application logger.
+        sp: The security provider for WebSocket communication.
+        storage: The PychStorage instance for data storage.
+    """
+
+    asyncio.run(serve_wsapp(cfg, logger, sp, storage))
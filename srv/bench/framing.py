@@ -0,0 +1,93 @@
+"""
+Microbenchmark of the WebSocket framings: bytes on the wire and CPU per message, JSON against msgpack.
+
+A message travels from the author to the server ("up": the client encodes the frame, the server parses it) and from
+the server to a reader ("down": the server encodes the stored message, the client parses it). JSON frames carry
+base64 ciphertexts, msgpack frames carry raw ones, the server stores base64 in both cases.
+
+Run from the srv directory: python3 -m bench.framing
+"""
+
+import os
+import json
+import time
+import base64
+import timeit
+import msgpack
+from app.framing import JSONFraming, MsgpackFraming
+
+# Ciphertext sizes: a short chat message, a paragraph, a pasted snippet
+SIZES = (48, 512, 4096)
+BATCH = 100
+NUMBER = 20000
+
+
+def json_up(ciphertext):
+    return json.dumps({"msg": base64.b64encode(ciphertext).decode(), "timestamp": time.time()})
+
+
+def msgpack_up(ciphertext):
+    return msgpack.packb({"msg": ciphertext, "timestamp": time.time()}, use_bin_type=True)
+
+
+def json_read(frame):
+    return base64.b64decode(json.loads(frame)["msg"])
+
+
+def msgpack_read(frame):
+    return msgpack.unpackb(frame, raw=False)["msg"]
+
+
+def json_read_batch(frame):
+    return [base64.b64decode(item["msg"]) for item in json.loads(frame)["messages"]]
+
+
+def msgpack_read_batch(frame):
+    return [item["msg"] for item in msgpack.unpackb(frame, raw=False)["messages"]]
+
+
+def stored(ciphertext):
+    return {
+        "mid": "6630f1c2a4b5c6d7e8f90123",
+        "msg": base64.b64encode(ciphertext).decode(),
+        "author_id": "6630f1c2a4b5c6d7e8f90456",
+        "timestamp": 1714483650.123456,
+        "seq": 123456,
+    }
+
+
+def report(name, size, seconds, number=NUMBER):
+    print(f"{name:<28} {size:>8} B {seconds / number * 1e6:>10.2f} us/msg")
+
+
+def main():
+    framings = (
+        ("json", JSONFraming, json_up, json_read, json_read_batch),
+        ("msgpack", MsgpackFraming, msgpack_up, msgpack_read, msgpack_read_batch),
+    )
+
+    for size in SIZES:
+        ciphertext = os.urandom(size)
+        fields = stored(ciphertext)
+        print(f"ciphertext {size} B")
+
+        for name, framing, up, read, read_batch in framings:
+            frame = up(ciphertext)
+            report(f"  {name} up", len(frame), timeit.timeit(
+                lambda: framing.loads(up(ciphertext)), number=NUMBER))
+
+            frame = framing.dumps(framing.message(fields))
+            report(f"  {name} down", len(frame), timeit.timeit(
+                lambda: read(framing.dumps(framing.message(fields))), number=NUMBER))
+
+            items = [framing.dumps(framing.message(fields))] * BATCH
+            frame = framing.dumps_batch({"type": "batch", "chat": "6630f1c2a4b5c6d7e8f90789"}, items)
+            report(f"  {name} down, batch/{BATCH}", len(frame) // BATCH, timeit.timeit(
+                lambda: read_batch(framing.dumps_batch(
+                    {}, [framing.dumps(framing.message(fields)) for _ in range(BATCH)]
+                )),
+                number=NUMBER // BATCH))
+
+
+if __name__ == "__main__":
+    main()
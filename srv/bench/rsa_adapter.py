@@ -0,0 +1,60 @@
+"""
+Microbenchmark of RSAAdapter operations with and without parsed key reuse.
+
+"uncached" repeats what the adapter did before the keys cache: it parses the PEM (and runs the PKCS8 KDF for the
+private key) on every operation. "cached" creates a new adapter per operation, as Chat and ListResource do, so it
+measures the process-wide cache. "adapter" reuses one adapter.
+
+Run from the srv directory: python3 -m bench.rsa_adapter
+"""
+
+import base64
+import timeit
+from cryptography.hazmat.primitives import serialization
+from app.storage.provider import RSAAdapter, KEYS_CACHE, OAEP_PADDING
+
+SECRET = "bench-secret"
+MESSAGE = "0123456789abcdef0123456789abcdef"
+NUMBER = 200
+
+
+def uncached_encrypt(pub_pem):
+    pub_k = serialization.load_pem_public_key(pub_pem)
+    return base64.b64encode(pub_k.encrypt(MESSAGE.encode(), OAEP_PADDING))
+
+
+def uncached_decrypt(p_pem, encrypted):
+    p_k = serialization.load_pem_private_key(p_pem, password=SECRET.encode())
+    return p_k.decrypt(base64.b64decode(encrypted), OAEP_PADDING)
+
+
+def report(name, seconds):
+    print(f"{name:<24} {seconds / NUMBER * 1e6:>10.1f} us/op")
+
+
+def main():
+    pub_pem, p_pem = RSAAdapter(secret=SECRET).gen_key_pair()
+    encrypted = RSAAdapter(pub_pem=pub_pem).encrypt(MESSAGE)
+    adapter = RSAAdapter(secret=SECRET, pub_pem=pub_pem, p_pem=p_pem)
+
+    KEYS_CACHE.clear()
+    report("encrypt uncached", timeit.timeit(
+        lambda: uncached_encrypt(pub_pem), number=NUMBER))
+    report("encrypt cached", timeit.timeit(
+        lambda: RSAAdapter(pub_pem=pub_pem).encrypt(MESSAGE), number=NUMBER))
+    report("encrypt adapter", timeit.timeit(
+        lambda: adapter.encrypt(MESSAGE), number=NUMBER))
+
+    # The KDF makes uncached decryption slow, so it runs fewer times
+    number = NUMBER // 10
+    seconds = timeit.timeit(lambda: uncached_decrypt(p_pem, encrypted), number=number)
+    report("decrypt uncached", seconds * NUMBER / number)
+    report("decrypt cached", timeit.timeit(
+        lambda: RSAAdapter(secret=SECRET, pub_pem=pub_pem, p_pem=p_pem).decrypt(encrypted),
+        number=NUMBER))
+    report("decrypt_many adapter", timeit.timeit(
+        lambda: adapter.decrypt_many([encrypted] * 10), number=NUMBER // 10))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,18 @@
 import structlog as slog
 
-import threading
+import os
+import argparse
+import multiprocessing
 from app.cfg import loader
+from app.timing import StartupTimer
 from app.ws import run_wsapp
+from app.ws_async import run_async_wsapp
 from app.service import get_service
+from app.server import PychApplication
 from wsgiref.simple_server import make_server
 from app.storage.provider import FernetAdapter, RSAAdapter
 from app.storage.mongo import PychStorage
+from app.storage.keypool import KeyPool
 
 slog.configure(
     processors=[
@@ -16,26 +22,213 @@ slog.configure(
     ]
 )
 
-if __name__ == "__main__":
-    try:
-        # Get all components for service
-        cfg = loader.get_configuration()
-        logger = slog.get_logger()
-        sp, rp = FernetAdapter(cfg.secret), RSAAdapter(secret=cfg.secret)
-        storage = PychStorage(cfg, rp)
 
-        x = threading.Thread(target=run_wsapp, args=(cfg, logger, sp, storage))
-        x.start()
+def get_key_pool(cfg, timer):
+    """
+    Start the pool of key pairs for registration, once per server: a pool started before gunicorn forks
+    its workers is shared by all of them.
+
+    Args:
+        cfg: The configuration object containing application settings.
+        timer: The StartupTimer of the process.
+
+    Returns:
+        The KeyPool, or None if the pool is disabled (keypool.size is 0).
+    """
+
+    if cfg.keypool['size'] <= 0:
+        return None
+
+    with timer.phase('key_pool'):
+        return KeyPool(RSAAdapter(secret=cfg.secret), cfg.keypool['size'], cfg.keypool['workers'])
+
+
+def get_components(cfg, timer=None, key_pool=None):
+    """
+    Build the components shared by the REST and the WS apps.
+
+    Args:
+        cfg: The configuration object containing application settings.
+        timer: A StartupTimer measuring the startup phases (optional).
+        key_pool: The KeyPool generating key pairs for registration (optional).
+
+    Returns:
+        sp, storage: the security provider and the PychStorage instance.
+    """
+
+    timer = timer or StartupTimer()
+
+    # The server adapter is a key pair factory, it generates no keys of its own
+    sp, rp = FernetAdapter(cfg.secret), RSAAdapter(secret=cfg.secret)
+    storage = PychStorage(cfg, key_pool if key_pool is not None else rp, timer)
+
+    logger = slog.get_logger()
+    migrated = {k: v for k, v in storage.migrations.items() if v}
+    if migrated:
+        logger.info('Migrated documents', **migrated)
+    if storage.created_indexes:
+        logger.info('Created indexes', indexes=storage.created_indexes)
+    return sp, storage
+
+
+def run_index_report(cfg, drop_unmanaged):
+    """
+    Log the index report of the database, optionally dropping unmanaged indexes.
+
+    Args:
+        cfg: The configuration object containing application settings.
+        drop_unmanaged: Drop the indexes that aren't in the registry.
+    """
+
+    logger = slog.get_logger()
+    _, storage = get_components(cfg)
+
+    if drop_unmanaged:
+        logger.info('Dropped indexes', indexes=storage.drop_unmanaged_indexes())
+
+    for collection, report in storage.index_report().items():
+        logger.info('Index report', collection=collection, **report)
+
+
+def run_ws(cfg, timer):
+    """
+    Run the WebSocket app in the server mode selected by ws.mode.
+
+    Args:
+        cfg: The configuration object containing application settings.
+        timer: The StartupTimer of the process.
+    """
+
+    logger = slog.get_logger()
+    sp, storage = get_components(cfg, timer)
+    timer.report(logger, role='ws', pid=os.getpid())
+
+    ws_runner = run_async_wsapp if cfg.ws['mode'] == 'asyncio' else run_wsapp
+    ws_runner(cfg, logger, sp, storage)
+
+
+def build_rest(cfg, logger, timer, key_pool=None):
+    """
+    Build the REST app and log the startup timing.
+
+    Args:
+        cfg: The configuration object containing application settings.
+        logger: The application logger.
+        timer: The StartupTimer of the process.
+        key_pool: The KeyPool shared by the REST workers (optional).
 
+    Returns:
+        The Falcon application.
+    """
+
+    sp, storage = get_components(cfg, timer, key_pool)
+    with timer.phase('route_registration'):
         service = get_service(cfg, logger, sp, storage)
 
+    timer.report(logger, role='rest', pid=os.getpid())
+    return service
+
+
+def run_rest(cfg, timer):
+    """
+    Run the REST app with the server selected by rest.server.
+
+    Args:
+        cfg: The configuration object containing application settings.
+        timer: The StartupTimer of the process.
+    """
+
+    logger = slog.get_logger()
+    logger.info(
+        'Starting pychapp',
+        env=cfg.env,
+        server=cfg.rest['server'],
+        addr=f"{cfg.rest['host']}:{cfg.rest['port']}"
+    )
+
+    # The key pool is started before the fork, so all the workers take key pairs from the same pool
+    key_pool = get_key_pool(cfg, timer)
+    try:
+        if cfg.rest['server'] == 'gunicorn':
+            # Every worker builds its own app, so mongo connections are opened after the fork
+            def factory():
+                worker_timer = StartupTimer()
+                worker_timer.phases.update(timer.phases)
+                return build_rest(cfg, logger, worker_timer, key_pool)
+
+            PychApplication(cfg.rest, factory).run()
+            return
+
+        service = build_rest(cfg, logger, timer, key_pool)
         with make_server(cfg.rest['host'], cfg.rest['port'], service) as httpd:
-            logger.info(
-                'Starting pychapp',
-                env=cfg.env,
-                addr=f"{cfg.rest['host']}:{cfg.rest['port']}"
-            )
             httpd.serve_forever()
+    finally:
+        if key_pool is not None:
+            key_pool.close()
+
+
+def run_all(cfg, timer):
+    """
+    Run the REST app, with the WebSocket app in a child process.
+
+    Args:
+        cfg: The configuration object containing application settings.
+        timer: The StartupTimer of the process.
+    """
+
+    ws_process = multiprocessing.Process(
+        target=run_ws, args=(cfg, timer), name="pych-ws"
+    )
+    ws_process.start()
+    try:
+        run_rest(cfg, timer)
+    finally:
+        ws_process.terminate()
+        ws_process.join()
+
+
+def main(argv=None):
+    """
+    Parse the command line and run the selected role.
+
+    Args:
+        argv: The command line arguments, sys.argv if omitted (optional).
+    """
+
+    parser = argparse.ArgumentParser(description="pychapp server")
+    parser.add_argument(
+        "role", nargs="?", default="all",
+        choices=["all", "rest", "ws", "indexes"],
+        help="run both apps (ws in a child process), only one of them, "
+             "or report missing/unused indexes"
+    )
+    parser.add_argument(
+        "--drop-unmanaged", action="store_true",
+        help="with the indexes role, drop indexes missing in the registry"
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        # Get all components for service
+        timer = StartupTimer()
+        with timer.phase('config_load'):
+            cfg = loader.get_configuration()
+
+        if args.role == "indexes":
+            run_index_report(cfg, args.drop_unmanaged)
+
+        elif args.role == "ws":
+            run_ws(cfg, timer)
+
+        elif args.role == "rest":
+            run_rest(cfg, timer)
+
+        else:
+            run_all(cfg, timer)
 
     except Exception as tle:
         print(f"Got top level exception: {tle}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import falcon
+import falcon.testing
+from srv.app.admission import AdmissionControl, get_ws_admission, WS_CLASS
+from srv.app.resources.middleware import AdmissionMiddleware, TokenMiddleware
+
+
+class FakeSP:
+
+    def __init__(self):
+        self.decrypted = []
+
+    def decrypt(self, token):
+        self.decrypted.append(token)
+        return token.encode()
+
+
+class ChatsResource:
+
+    route_class = "chat"
+
+    def on_get(self, req, resp):
+        resp.media = {"user_id": req.context['auth']['user_id'].decode()}
+
+
+class TestAdmissionControl:
+
+    def test_route_classes_have_separate_limits(self):
+        admission = AdmissionControl({"chat": 2, "status": 0})
+
+        assert admission.try_acquire("chat")
+        assert admission.try_acquire("chat")
+        assert not admission.try_acquire("chat")
+
+        # A saturated class doesn't shed the others
+        assert all(admission.try_acquire("status") for _ in range(100))
+
+        admission.release("chat")
+        assert admission.try_acquire("chat")
+        assert admission.stats()["chat_active"] == 2
+        assert admission.stats()["chat_shed"] == 1
+
+    def test_default_limit(self):
+        admission = AdmissionControl({"default": 1})
+
+        assert admission.try_acquire("sync")
+        assert not admission.try_acquire("sync")
+        assert admission.try_acquire("search")
+
+    def test_ws_admission(self):
+        assert get_ws_admission({"enabled": False, "ws_connections": 1}) is None
+
+        admission = get_ws_admission({"enabled": True, "ws_connections": 1})
+        assert admission.try_acquire(WS_CLASS)
+        assert not admission.try_acquire(WS_CLASS)
+
+
+class TestAdmissionMiddleware:
+
+    def get_client(self, admission, sp):
+        app = falcon.App(middleware=[AdmissionMiddleware(admission, 2), TokenMiddleware(sp)])
+        app.add_route("/chats", ChatsResource())
+        return falcon.testing.TestClient(app)
+
+    def test_shed_request_is_not_decrypted(self):
+        admission, sp = AdmissionControl({"chat": 1}), FakeSP()
+        client = self.get_client(admission, sp)
+        assert admission.try_acquire("chat")
+
+        result = client.simulate_get("/chats", headers={"Auth": "alice"})
+        assert result.status_code == 503
+        assert result.headers["Retry-After"] == "2"
+        assert sp.decrypted == []
+
+    def test_admitted_request_is_decrypted_and_released(self):
+        admission, sp = AdmissionControl({"chat": 1}), FakeSP()
+        client = self.get_client(admission, sp)
+
+        for _ in range(2):
+            assert client.simulate_get("/chats", headers={"Auth": "alice"}).json == {"user_id": "alice"}
+        assert sp.decrypted == ["alice", "alice"]
+        assert admission.stats()["chat_active"] == 0
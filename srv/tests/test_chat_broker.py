@@ -0,0 +1,50 @@
+from srv.app.broker import ChatBroker
+
+
+class TestChatBroker:
+
+    def test_publish_delivers_to_chat_subscribers(self):
+        broker = ChatBroker()
+        first, second, other = [], [], []
+
+        broker.subscribe("chat", first.append)
+        broker.subscribe("chat", second.append)
+        broker.subscribe("other", other.append)
+
+        assert broker.publish("chat", "hello") == 2
+        assert first == ["hello"]
+        assert second == ["hello"]
+        assert other == []
+
+    def test_unsubscribe_stops_delivery(self):
+        broker = ChatBroker()
+        received = []
+
+        broker.subscribe("chat", received.append)
+        broker.unsubscribe("chat", received.append)
+
+        assert broker.publish("chat", "hello") == 0
+        assert received == []
+        assert broker.subscriber_count("chat") == 0
+
+    def test_failing_subscriber_does_not_break_delivery(self):
+        broker = ChatBroker()
+        received = []
+
+        def fail(message):
+            raise RuntimeError("subscriber failed")
+
+        broker.subscribe("chat", fail)
+        broker.subscribe("chat", received.append)
+
+        assert broker.publish("chat", "hello") == 1
+        assert received == ["hello"]
+
+    def test_chat_ids_are_normalized(self):
+        broker = ChatBroker()
+        received = []
+
+        broker.subscribe(42, received.append)
+        broker.publish("42", "hello")
+
+        assert received == ["hello"]
@@ -37,3 +37,12 @@ class TestConfig:
 
         assert config.rest['host'] == '127.1'
         assert config.rest['port'] == 9090
+
+    @patch("builtins.open", new_callable=mock_open,
+           read_data="pychapp:\n  ws:\n    mode: 'asyncio'\n")
+    def test_init_merges_nested_config_with_defaults(self, mock_file):
+        config = Config("path/to/config")
+
+        assert config.ws['mode'] == 'asyncio'
+        assert config.ws['port'] == 8080
+        assert config.ws['executor_workers'] == 32
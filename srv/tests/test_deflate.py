@@ -0,0 +1,90 @@
+import zlib
+import time
+import threading
+from websockets.frames import Frame, Opcode
+from srv.app.deflate import ThresholdPerMessageDeflate, DeflateWebSocket, CompressionStats, CountingCompressor
+
+ENVELOPE = '{"mid": "1", "msg": "c2hvcnQ=", "author_id": "6630f1c2a4b5c6d7e8f90456", "timestamp": 1.5, "seq": 1}'
+
+
+def make_websocket(**settings):
+    cls = type("TestDeflateWebSocket", (DeflateWebSocket,), settings)
+    written = []
+    ws = cls({}, None, written.append, None, True)
+    return ws, written
+
+
+class TestThresholdPerMessageDeflate:
+
+    def test_small_messages_are_not_compressed(self):
+        extension = ThresholdPerMessageDeflate(256, False, False, 15, 15)
+
+        small = extension.encode(Frame(Opcode.TEXT, b"x" * 100))
+        large = extension.encode(Frame(Opcode.TEXT, ENVELOPE.encode() * 10))
+
+        assert not small.rsv1 and small.data == b"x" * 100
+        assert large.rsv1 and len(large.data) < len(ENVELOPE) * 10
+        assert extension.stats.sent == 100 + len(ENVELOPE) * 10
+        assert extension.stats.sent_wire == 100 + len(large.data)
+
+    def test_received_frames_are_counted(self):
+        encoder = ThresholdPerMessageDeflate(0, False, False, 15, 15)
+        decoder = ThresholdPerMessageDeflate(0, False, False, 15, 15)
+
+        frame = encoder.encode(Frame(Opcode.TEXT, ENVELOPE.encode()))
+        assert decoder.decode(frame).data == ENVELOPE.encode()
+        assert decoder.stats.received == len(ENVELOPE)
+        assert decoder.stats.received_wire == len(frame.data)
+
+
+class TestDeflateWebSocket:
+
+    def test_context_takeover_shrinks_repeated_messages(self):
+        kept, kept_written = make_websocket(context_takeover=True)
+        fresh, fresh_written = make_websocket(context_takeover=False)
+
+        for ws in (kept, fresh):
+            for _ in range(10):
+                ws.send(ENVELOPE)
+
+        assert kept.stats.sent == fresh.stats.sent == len(ENVELOPE) * 10
+        assert kept.stats.sent_wire < fresh.stats.sent_wire < kept.stats.sent
+
+        # Every message can be inflated by a client keeping its context
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        for frame in kept_written:
+            payload = frame[2:]
+            assert decompressor.decompress(payload + b"\x00\x00\xff\xff") == ENVELOPE.encode()
+
+    def test_concurrent_sends(self):
+        ws, written = make_websocket(context_takeover=True)
+
+        def write(data):
+            # Yield to the other sender in the middle of a send
+            time.sleep(0)
+            written.append(data)
+
+        ws.write = write
+        threads = [threading.Thread(target=lambda: [ws.send(ENVELOPE) for _ in range(200)]) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert not isinstance(ws.compressor, CountingCompressor)
+        assert ws.stats.sent == len(ENVELOPE) * 400
+        assert ws.stats.sent_wire == sum(len(frame) - 2 for frame in written)
+
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        for frame in written:
+            assert decompressor.decompress(frame[2:] + b"\x00\x00\xff\xff") == ENVELOPE.encode()
+
+    def test_min_size(self):
+        ws, written = make_websocket(min_size=len(ENVELOPE) + 1)
+        ws.send(ENVELOPE)
+
+        assert written[0][2:] == ENVELOPE.encode()
+        assert ws.stats.report()["sent_ratio"] == 1.0
+
+    def test_report_without_traffic(self):
+        assert CompressionStats().report()["sent_ratio"] is None
@@ -0,0 +1,139 @@
+import os
+import queue
+import pytest
+from bson.objectid import ObjectId
+from pymongo.errors import OperationFailure
+from srv.app.fanout import ChangeStreamBroker
+
+# A MongoDB replica set for the change stream tests, e.g. mongodb://localhost:27017/?replicaSet=rs0
+# (mongod --replSet rs0, then rs.initiate() in mongosh)
+REPLSET = os.environ.get("PYCH_TEST_REPLSET")
+
+
+class FakeStream:
+
+    def __init__(self, changes, resume_token):
+        self.changes = changes
+        self.resume_token = resume_token
+
+    def __iter__(self):
+        return iter(self.changes)
+
+    def close(self):
+        pass
+
+
+class FakeCollection:
+
+    def __init__(self, lost=False, changes=()):
+        self.lost = lost
+        self.changes = list(changes)
+        self.watched = []
+
+    def watch(self, pipeline, resume_after=None):
+        self.watched.append(resume_after)
+        if self.lost and resume_after is not None:
+            raise OperationFailure("resume point may no longer be in the oplog", 286)
+        changes, self.changes = self.changes, []
+        return FakeStream(changes, "token")
+
+
+def insert(cid, seq):
+    return {
+        "operationType": "insert",
+        "fullDocument": {
+            "_id": ObjectId(), "chat_id": cid, "author_id": "author", "msg": f"msg {seq}",
+            "timestamp": seq, "seq": seq,
+        },
+    }
+
+
+class TestChangeStreamBroker:
+
+    def test_messages_are_routed_by_chat(self):
+        broker = ChangeStreamBroker(FakeCollection())
+        cid, other = str(ObjectId()), str(ObjectId())
+        received = []
+        broker.subscribe(cid, received.append)
+
+        broker.route(insert(cid, 1))
+        broker.route(insert(other, 1))
+
+        assert [(str(msg.chat.cid), msg.seq) for msg in received] == [(cid, 1)]
+        assert broker.stats()["fanout_events"] == 2
+        assert broker.stats()["fanout_routed"] == 1
+
+    def test_local_publish_is_skipped(self):
+        broker = ChangeStreamBroker(FakeCollection())
+        received = []
+        broker.subscribe("chat", received.append)
+
+        # Messages stored by the node come back through the stream
+        assert broker.publish("chat", "hello") == 0
+        assert received == []
+
+    def test_malformed_events_are_skipped(self):
+        cid = str(ObjectId())
+        bad = [{"operationType": "insert"}, insert("not an id", 1), insert(None, 1)]
+        broker = ChangeStreamBroker(FakeCollection(changes=bad + [insert(cid, 2)]), retry_delay=0.01)
+        received = queue.Queue()
+        for chat_id in (cid, "not an id", "None"):
+            broker.subscribe(chat_id, received.put)
+
+        broker.start()
+
+        assert received.get(timeout=5).seq == 2
+        assert broker.stats()["fanout_skipped"] == 3
+
+    def test_stream_is_resumed_after_the_last_event(self):
+        collection = FakeCollection()
+        broker = ChangeStreamBroker(collection)
+        broker.open()
+        broker.reopen()
+
+        assert collection.watched == [None, "token"]
+        assert broker.stats()["fanout_resyncs"] == 0
+
+    def test_lost_history_resyncs_subscribed_chats(self):
+        collection = FakeCollection(lost=True)
+        broker = ChangeStreamBroker(collection)
+        broker.resume_token = "old"
+        received = []
+        broker.subscribe("chat", received.append)
+
+        broker.reopen()
+
+        assert collection.watched == ["old", None]
+        assert received == [("resync", "chat")]
+        assert broker.stats()["fanout_resyncs"] == 1
+
+
+@pytest.mark.skipif(REPLSET is None, reason="PYCH_TEST_REPLSET is not set")
+class TestChangeStreamFanout:
+
+    @pytest.fixture
+    def collection(self):
+        import pymongo
+
+        client = pymongo.MongoClient(REPLSET)
+        db = client["pychapp_test_fanout"]
+        yield db["messages"]
+        client.drop_database(db)
+        client.close()
+
+    def test_messages_of_other_nodes_are_delivered(self, collection):
+        # Two nodes tailing the same collection, each with one subscriber
+        nodes = [ChangeStreamBroker(collection, retry_delay=0.1) for _ in range(2)]
+        cid = str(ObjectId())
+        received = [queue.Queue(), queue.Queue()]
+        for node, inbox in zip(nodes, received):
+            node.subscribe(cid, inbox.put)
+            node.start()
+
+        collection.insert_many([insert(cid, seq)["fullDocument"] for seq in (1, 2)])
+        collection.insert_one(insert(str(ObjectId()), 1)["fullDocument"])
+
+        for inbox in received:
+            assert [inbox.get(timeout=10).seq for _ in range(2)] == [1, 2]
+            assert inbox.empty()
+        assert all(node.stats()["fanout_routed"] == 2 for node in nodes)
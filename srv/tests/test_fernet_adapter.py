@@ -29,3 +29,10 @@ def test_encode_decode_bad_secret():
 
     with pytest.raises(cryptography.fernet.InvalidToken):
         sa.decrypt(enc_message)
+
+
+def test_encrypt_many_decrypt_many():
+    test_messages = [b"hello", b"world"]
+    sa = get_adapter(b"Pls68m35-oXRfEo1HAPKPyjI3SPiC-3UP140vn1xisU=")
+
+    assert test_messages == sa.decrypt_many(sa.encrypt_many(test_messages))
@@ -0,0 +1,45 @@
+import json
+import base64
+import msgpack
+import pytest
+from srv.app.framing import JSONFraming, MsgpackFraming, get_framing, select_subprotocol
+
+CIPHERTEXT = b"\x00\xffraw ciphertext"
+STORED = {"mid": "1", "msg": base64.b64encode(CIPHERTEXT).decode(), "author_id": "a", "timestamp": 1.5, "seq": 1}
+
+
+class TestFraming:
+
+    def test_subprotocol_selects_framing(self):
+        assert select_subprotocol(["chat", "pych.msgpack"]) == "pych.msgpack"
+        assert select_subprotocol([]) is None
+        assert get_framing("pych.msgpack") is MsgpackFraming
+        assert get_framing(None) is JSONFraming
+
+    def test_msgpack_ciphertext_is_raw_on_the_wire(self):
+        frame = MsgpackFraming.loads(msgpack.packb({"msg": CIPHERTEXT, "timestamp": 1.5}, use_bin_type=True))
+        assert frame["msg"] == STORED["msg"]
+
+        sent = msgpack.unpackb(MsgpackFraming.dumps(MsgpackFraming.message(STORED)), raw=False)
+        assert sent["msg"] == CIPHERTEXT
+
+    @pytest.mark.parametrize("framing, load", [
+        (JSONFraming, json.loads),
+        (MsgpackFraming, lambda data: msgpack.unpackb(data, raw=False)),
+    ])
+    def test_batch_matches_encoded_frame(self, framing, load):
+        head = {"type": "batch", "chat": "c1"}
+        items = [framing.dumps(framing.message(STORED))] * 3
+
+        batch = load(framing.dumps_batch(head, items))
+        assert batch == load(framing.dumps({"messages": [framing.message(STORED)] * 3, **head}))
+
+    @pytest.mark.parametrize("framing, data", [
+        (JSONFraming, "[1, 2]"),
+        (JSONFraming, "{"),
+        (MsgpackFraming, msgpack.packb([1, 2])),
+        (MsgpackFraming, b"\xc1"),
+    ])
+    def test_malformed_frame(self, framing, data):
+        with pytest.raises(ValueError):
+            framing.loads(data)
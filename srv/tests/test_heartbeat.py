@@ -0,0 +1,81 @@
+from srv.app.heartbeat import HeartbeatWebSocket, ConnectionReaper, AUTH_TIMEOUT, HEARTBEAT_TIMEOUT
+
+
+class FakeWebSocket:
+
+    def __init__(self, last_seen):
+        self.last_seen = last_seen
+
+
+class FakeProtocol:
+
+    def __init__(self, last_seen=0.0, author=None):
+        self.ws = FakeWebSocket(last_seen)
+        self.author = author
+        self.reaped = None
+        self.queued = []
+
+    def subscriber(self, item):
+        self.queued.append(item)
+
+    def reap(self, reason):
+        self.reaped = reason
+
+
+class TestConnectionReaper:
+
+    def test_unauthenticated_connection_is_reaped(self):
+        reaper = ConnectionReaper(20, 20, 10)
+        protocol = FakeProtocol()
+        reaper.register(protocol)
+        connected = reaper.connections[protocol]
+
+        reaper.check(connected + 5)
+        assert protocol.reaped is None
+
+        reaper.check(connected + 11)
+        assert protocol.reaped == AUTH_TIMEOUT
+
+        reaper.unregister(protocol)
+        assert reaper.stats() == {"reaped_auth_timeout": 1, "reaped_heartbeat_timeout": 0}
+
+    def test_silent_connection_is_pinged_once_then_reaped(self):
+        reaper = ConnectionReaper(20, 20, 10)
+        protocol = FakeProtocol(last_seen=100.0, author="user")
+        reaper.register(protocol)
+
+        reaper.check(110.0)
+        assert protocol.queued == []
+
+        reaper.check(121.0)
+        reaper.check(122.0)
+        assert protocol.queued == [("ping",)]
+
+        # The pong resets the silence
+        protocol.ws.last_seen = 122.5
+        reaper.check(150.0)
+        assert protocol.queued == [("ping",), ("ping",)] and protocol.reaped is None
+
+        reaper.check(163.0)
+        assert protocol.reaped == HEARTBEAT_TIMEOUT
+
+    def test_heartbeats_disabled(self):
+        reaper = ConnectionReaper(0, 20, 0)
+        protocol = FakeProtocol(last_seen=0.0, author="user")
+        reaper.register(protocol)
+
+        reaper.check(1000.0)
+        assert protocol.reaped is None and protocol.queued == []
+
+
+class TestHeartbeatWebSocket:
+
+    def test_empty_ping_is_answered(self):
+        written = []
+        ws = HeartbeatWebSocket({}, lambda size: b"", written.append, None, False)
+
+        ws.handle_ping(bytearray())
+        ws.handle_ping(bytearray(b"hi"))
+
+        assert written == [b"\x8a\x00", b"\x8a\x02hi"]
+        assert ws.sock is None
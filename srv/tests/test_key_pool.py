@@ -0,0 +1,96 @@
+import os
+import time
+from srv.app.storage.keypool import KeyPool
+
+
+class FakeRSAAdapter:
+
+    secret = "super_secret"
+
+    def gen_key_pair(self):
+        return b"inline_pub", b"inline_p"
+
+
+def wait_for_depth(pool, depth, timeout=60):
+    deadline = time.monotonic() + timeout
+    while pool.stats()["depth"] < depth:
+        assert time.monotonic() < deadline, "pool wasn't refilled in time"
+        time.sleep(0.05)
+
+
+class TestKeyPool:
+
+    def test_empty_pool_generates_inline(self):
+        pool = KeyPool(FakeRSAAdapter(), size=0, workers=1)
+        try:
+            assert pool.gen_key_pair() == (b"inline_pub", b"inline_p")
+            assert pool.stats()["inline"] == 1
+        finally:
+            pool.close()
+
+    def test_pool_is_filled_and_refilled_in_background(self):
+        pool = KeyPool(FakeRSAAdapter(), size=2, workers=1)
+        try:
+            wait_for_depth(pool, 2)
+
+            pub_pem, p_pem = pool.gen_key_pair()
+            assert pub_pem.startswith(b"-----BEGIN PUBLIC KEY-----")
+            assert b"ENCRYPTED PRIVATE KEY" in p_pem
+
+            wait_for_depth(pool, 2)
+            stats = pool.stats()
+            assert stats["generated"] == 3
+            assert stats["inline"] == 0
+            assert stats["refill_rate"] > 0
+        finally:
+            pool.close()
+
+    def test_pool_is_shared_with_forked_workers(self):
+        pool = KeyPool(FakeRSAAdapter(), size=2, workers=1)
+        try:
+            wait_for_depth(pool, 2)
+
+            # gunicorn forks its workers after the pool is started
+            pid = os.fork()
+            if pid == 0:
+                pub_pem, _ = pool.gen_key_pair()
+                os._exit(0 if pub_pem.startswith(b"-----BEGIN PUBLIC KEY-----") else 1)
+            _, status = os.waitpid(pid, 0)
+            assert os.waitstatus_to_exitcode(status) == 0
+
+            wait_for_depth(pool, 2)
+            stats = pool.stats()
+            assert stats["generated"] == 3
+            assert stats["inline"] == 0
+        finally:
+            pool.close()
+
+    def test_pairs_waiting_for_room_are_not_pending(self):
+        pool = KeyPool(FakeRSAAdapter(), size=1, workers=1)
+        try:
+            wait_for_depth(pool, 1)
+
+            # The worker generates one more pair and waits for room in the full pool
+            deadline = time.monotonic() + 60
+            while pool.stats()["pending"] != 0:
+                assert time.monotonic() < deadline, "the waiting pair is still pending"
+                time.sleep(0.05)
+            for _ in range(10):
+                time.sleep(0.05)
+                assert pool.stats()["pending"] == 0
+        finally:
+            pool.close()
+
+    def test_forked_workers_do_not_stop_the_pool(self):
+        pool = KeyPool(FakeRSAAdapter(), size=1, workers=1)
+        try:
+            pid = os.fork()
+            if pid == 0:
+                pool.close()
+                os._exit(0)
+            os.waitpid(pid, 0)
+
+            assert all(process.is_alive() for process in pool.processes)
+        finally:
+            pool.close()
+        assert not any(process.is_alive() for process in pool.processes)
@@ -0,0 +1,61 @@
+import pytest
+from srv.app.storage.cache import LRUCache
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache:
+
+    def test_init_with_bad_size_raises_exception(self):
+        with pytest.raises(ValueError):
+            LRUCache(0)
+
+    def test_get_counts_hits_and_misses(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["size"] == 1
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+
+    def test_entries_expire_after_ttl(self):
+        clock = FakeClock()
+        cache = LRUCache(2, ttl=10, clock=clock)
+        cache.set("a", 1)
+
+        clock.now = 9
+        assert cache.get("a") == 1
+
+        clock.now = 10
+        assert cache.get("a") is None
+        assert len(cache) == 0
+
+    def test_invalidate_removes_entry(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.invalidate("a")
+        cache.invalidate("missing")
+
+        assert cache.get("a", "default") == "default"
@@ -0,0 +1,26 @@
+from srv.app.storage.model import Chat, Message
+
+
+class TestMessage:
+
+    def test_from_mongo_keeps_id_and_number(self):
+        chat = Chat(b"aes", b"", "alice@h", "bob@h", plain=True, cid="c1")
+        doc = {
+            "_id": "m1", "chat_id": "c1", "author_id": "u1",
+            "msg": "hi", "timestamp": 1.5, "seq": 7,
+        }
+
+        message = Message.from_mongo(chat, doc)
+
+        assert message.mid == "m1"
+        assert message.chat is chat
+        assert message.serialize() == {
+            "msg": "hi", "author_id": "u1", "timestamp": 1.5, "seq": 7,
+        }
+
+    def test_to_mongo_stores_number(self):
+        chat = Chat(b"aes", b"", "alice@h", "bob@h", plain=True, cid="c1")
+        message = Message(chat, "u1", "hi", 1.5, seq=3)
+
+        assert message.to_mongo()["seq"] == 3
+        assert message.to_mongo()["chat_id"] == "c1"
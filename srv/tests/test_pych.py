@@ -0,0 +1,152 @@
+import os
+import importlib
+from types import SimpleNamespace
+import pytest
+from srv.app.server import PychApplication
+
+REST = {"host": "127.0.0.1", "port": 9090, "workers": 3, "threads": 4, "worker_class": "gthread",
+        "keepalive": 5, "timeout": 30}
+
+
+class FakeStorage:
+
+    def __init__(self, calls):
+        self.calls = calls
+
+    def drop_unmanaged_indexes(self):
+        self.calls.append(("drop_unmanaged_indexes",))
+        return []
+
+    def index_report(self):
+        self.calls.append(("index_report",))
+        return {"users": {"missing": [], "unused": []}}
+
+
+class FakeKeyPool:
+
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def script(monkeypatch):
+    """
+    The pych script, it is run from srv, so it is imported with srv on the path.
+    """
+
+    monkeypatch.syspath_prepend(os.path.join(os.path.dirname(__file__), ".."))
+    return importlib.import_module("pych")
+
+
+@pytest.fixture
+def pych(script, monkeypatch):
+    """
+    The pych script with the apps, the ws process and the storage replaced by recorders of the calls.
+    """
+
+    module = script
+    calls, cfg = [], object()
+
+    def recorder(name):
+        return lambda *args: calls.append((name,) + args[:1])
+
+    class FakeProcess:
+
+        def __init__(self, target, args, name):
+            calls.append(("process", target))
+
+        def start(self):
+            calls.append(("start",))
+
+        def terminate(self):
+            calls.append(("terminate",))
+
+        def join(self):
+            calls.append(("join",))
+
+    monkeypatch.setattr(module.loader, "get_configuration", lambda: cfg)
+    monkeypatch.setattr(module, "get_components", lambda cfg: (None, FakeStorage(calls)))
+    monkeypatch.setattr(module.multiprocessing, "Process", FakeProcess)
+    for name in ("run_rest", "run_ws", "PychApplication", "make_server"):
+        monkeypatch.setattr(module, name, recorder(name))
+    return module, calls, cfg
+
+
+class TestPychApplication:
+
+    def test_rest_section_is_applied_to_gunicorn(self):
+        application = PychApplication(REST, lambda: "app")
+
+        settings = application.cfg.settings
+        assert settings["bind"].get() == ["127.0.0.1:9090"]
+        assert (settings["workers"].get(), settings["threads"].get()) == (3, 4)
+        assert (settings["keepalive"].get(), settings["timeout"].get()) == (5, 30)
+        assert settings["worker_class"].get() == "gthread"
+        assert application.load() == "app"
+
+
+class TestRoles:
+
+    @pytest.mark.parametrize("role, runner", [("rest", "run_rest"), ("ws", "run_ws")])
+    def test_single_app_is_run(self, pych, role, runner):
+        module, calls, cfg = pych
+        module.main([role])
+
+        assert calls == [(runner, cfg)]
+
+    def test_all_runs_ws_in_a_child_process(self, pych):
+        module, calls, cfg = pych
+        module.main([])
+
+        assert calls == [("process", module.run_ws), ("start",), ("run_rest", cfg), ("terminate",), ("join",)]
+
+    @pytest.mark.parametrize("argv, dropped", [(["indexes"], False), (["indexes", "--drop-unmanaged"], True)])
+    def test_indexes_exits_without_starting_servers(self, pych, argv, dropped):
+        module, calls, _ = pych
+        module.main(argv)
+
+        expected = [("drop_unmanaged_indexes",)] if dropped else []
+        assert calls == expected + [("index_report",)]
+
+
+class TestRest:
+
+    @pytest.fixture
+    def key_pool(self, script, monkeypatch):
+        key_pool = FakeKeyPool()
+        monkeypatch.setattr(script, "get_key_pool", lambda cfg, timer: key_pool)
+        monkeypatch.setattr(script, "build_rest", lambda *args: None)
+        return key_pool
+
+    def test_key_pool_is_closed_when_gunicorn_exits(self, script, key_pool, monkeypatch):
+        class StoppedApplication:
+
+            def __init__(self, rest, factory):
+                pass
+
+            def run(self):
+                raise SystemExit(0)
+
+        monkeypatch.setattr(script, "PychApplication", StoppedApplication)
+        with pytest.raises(SystemExit):
+            script.run_rest(SimpleNamespace(env="test", rest={**REST, "server": "gunicorn"}), script.StartupTimer())
+        assert key_pool.closed
+
+    def test_key_pool_is_closed_when_wsgiref_exits(self, script, key_pool, monkeypatch):
+        class StoppedServer:
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def serve_forever(self):
+                raise KeyboardInterrupt()
+
+        monkeypatch.setattr(script, "make_server", lambda host, port, service: StoppedServer())
+        with pytest.raises(KeyboardInterrupt):
+            script.run_rest(SimpleNamespace(env="test", rest={**REST, "server": "wsgiref"}), script.StartupTimer())
+        assert key_pool.closed
@@ -41,3 +41,35 @@ class TestRSAAdapter:
         decrypted_message = adapter.decrypt(encrypted_message)
 
         assert message == decrypted_message.decode()
+
+    def test_encrypt_many_decrypt_many(self):
+        adapter = RSAAdapter(secret="mysecret")
+        messages = ["first", "second"]
+
+        encrypted = adapter.encrypt_many(messages)
+        decrypted = adapter.decrypt_many(encrypted)
+
+        assert [m.decode() for m in decrypted] == messages
+
+    def test_adapters_share_parsed_keys(self):
+        pub_pem, p_pem = RSAAdapter(secret="mysecret").get_pair()
+
+        first = RSAAdapter(secret="mysecret", pub_pem=pub_pem, p_pem=p_pem)
+        second = RSAAdapter(secret="mysecret", pub_pem=pub_pem, p_pem=p_pem)
+
+        assert first.get_public_key() is second.get_public_key()
+        assert first.get_private_key() is second.get_private_key()
+
+    def test_cached_private_key_requires_same_secret(self):
+        pub_pem, p_pem = RSAAdapter(secret="mysecret").get_pair()
+        RSAAdapter(secret="mysecret", p_pem=p_pem).get_private_key()
+
+        with pytest.raises(ValueError):
+            RSAAdapter(secret="othersecret", p_pem=p_pem).get_private_key()
+
+    def test_init_with_secret_generates_keys_lazily(self):
+        adapter = RSAAdapter(secret="super_secret")
+
+        assert adapter.keys is None
+        assert adapter.get_pair() == (adapter.pub_pem, adapter.p_pem)
+        assert adapter.keys is not None
@@ -0,0 +1,58 @@
+import pytest
+from srv.app.sendqueue import SendQueue, SendQueueMonitor, SendQueueOverflow, DISCONNECT
+
+
+class TestSendQueue:
+
+    def test_drop_oldest_marks_gaps(self):
+        queue = SendQueue(3)
+        queue.put(("subscribe", "c1"))
+        for i in range(4):
+            queue.put(f"m{i}", "c1")
+        queue.put("n0", "c2")
+
+        # Commands are never dropped, the oldest messages are
+        assert queue.get(10) == [("subscribe", "c1"), "m3", "n0"]
+        assert queue.take_gaps() == {"c1"}
+        assert queue.take_gaps() == set()
+        assert queue.dropped == 3 and queue.max_depth == 3
+
+    def test_disconnect_policy(self):
+        queue = SendQueue(2, DISCONNECT)
+        queue.put("m0", "c1")
+        queue.put("m1", "c1")
+
+        with pytest.raises(SendQueueOverflow):
+            queue.put("m2", "c1")
+
+    def test_overflow_without_messages(self):
+        queue = SendQueue(2)
+        queue.put({"type": "resync"})
+        queue.put(("subscribe", "c2"))
+
+        with pytest.raises(SendQueueOverflow):
+            queue.put(("unsubscribe", "c1"))
+
+    def test_close_stops_the_writer(self):
+        queue = SendQueue(10)
+        queue.put("m0", "c1")
+        queue.close()
+        queue.put("m1", "c1")
+
+        assert queue.get(10) == [None]
+        assert queue.get(10, block=False) == []
+
+
+class TestSendQueueMonitor:
+
+    def test_stats(self):
+        monitor = SendQueueMonitor()
+        slow, closed = SendQueue(2), SendQueue(2)
+        monitor.register(slow)
+        monitor.register(closed)
+        for i in range(5):
+            slow.put(f"m{i}", "c1")
+        closed.put("m0", "c1")
+        monitor.unregister(closed, evicted=True)
+
+        assert monitor.stats() == {"connections": 1, "queued": 2, "max_depth": 2, "dropped": 3, "evicted": 1}
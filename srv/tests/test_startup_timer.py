@@ -0,0 +1,55 @@
+from srv.app.timing import StartupTimer
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeLogger:
+
+    def __init__(self):
+        self.entries = []
+
+    def info(self, event, **kwargs):
+        self.entries.append((event, kwargs))
+
+
+class TestStartupTimer:
+
+    def test_phases_are_reported_in_milliseconds(self):
+        clock, logger = FakeClock(), FakeLogger()
+        timer = StartupTimer(clock=clock)
+
+        with timer.phase("config_load"):
+            clock.now = 0.25
+        with timer.phase("mongo_connect"):
+            clock.now = 1.0
+
+        timer.report(logger, role="rest")
+
+        event, fields = logger.entries[0]
+        assert event == "Startup timing"
+        assert fields == {
+            "total_ms": 1000.0,
+            "config_load_ms": 250.0,
+            "mongo_connect_ms": 750.0,
+            "role": "rest",
+        }
+
+    def test_failed_phase_is_measured(self):
+        clock = FakeClock()
+        timer = StartupTimer(clock=clock)
+
+        try:
+            with timer.phase("mongo_connect"):
+                clock.now = 2.0
+                raise ConnectionError()
+        except ConnectionError:
+            pass
+
+        assert timer.phases == {"mongo_connect": 2000.0}
@@ -0,0 +1,309 @@
+import json
+import time
+import threading
+import pytest
+from datetime import datetime, timedelta, timezone
+from bson.objectid import ObjectId
+from srv.app.storage.model import User, Chat, Message
+from srv.app.storage.provider import KEYS_CACHE, load_public_key, public_key_fingerprint
+from srv.app.storage.mongo import PychStorage, EntityNotFoundException, InvalidCursorException, MIGRATIONS
+
+mongomock = pytest.importorskip("mongomock")
+
+
+class Cfg:
+    mongo = {"con_link": "mongodb://pych.test:27017/", "db": "pychapp"}
+    cache = {"users_size": 16, "users_ttl": 60}
+
+
+@pytest.fixture
+def mongo():
+    with mongomock.patch(servers=(("pych.test", 27017),)):
+        yield
+
+
+def get_storage():
+    return PychStorage(Cfg, None)
+
+
+def add_chat(storage, dst="bob@h"):
+    chat = Chat(b"aes", None, "alice@h", dst, plain=True)
+    chat.cid = storage.db["chats"].insert_one({**chat.to_mongo(), "seq": 0}).inserted_id
+    return chat
+
+
+def allow_legacy_messages(storage):
+    # mongomock ignores partial filters, so messages without a number collide in the unique index of numbers
+    storage.db["messages"].drop_index("chat_id_1_seq_1")
+
+
+def add_messages(storage, chat, seqs, author="alice"):
+    """
+    Store messages numbered by seqs with ids in list order, None for a legacy message without a number.
+    """
+
+    messages = []
+    for i, seq in enumerate(seqs):
+        doc = {"_id": ObjectId(), "chat_id": str(chat.cid), "author_id": author, "msg": f"m{i}", "timestamp": i}
+        if seq is not None:
+            doc["seq"] = seq
+        storage.db["messages"].insert_one(doc)
+        messages.append(Message.from_mongo(chat, doc))
+    return messages
+
+
+def send(storage, chat, *texts, author="bob"):
+    for text in texts:
+        storage.add_message(Message(chat, author, text, 0))
+
+
+def synced(changes):
+    return {str(u["chat"].cid): [m.msg for m in u["messages"]] for u in changes["updates"]}
+
+
+class TestMigrations:
+
+    def test_migrations_are_applied_once(self, mongo):
+        storage = get_storage()
+
+        assert list(storage.migrations) == MIGRATIONS
+        schema = storage.db["meta"].find_one({"_id": "schema"})
+        assert schema["version"] == len(MIGRATIONS)
+        assert "locked_until" not in schema
+
+        assert get_storage().migrations == {}
+
+    def test_expired_lock_is_taken_over(self, mongo):
+        storage = get_storage()
+        storage.db["meta"].update_one({"_id": "schema"}, {"$set": {
+            "version": 1, "locked_until": datetime.now(timezone.utc) - timedelta(seconds=1),
+        }})
+
+        assert list(get_storage().migrations) == MIGRATIONS[1:]
+
+    def test_locked_migrations_are_waited_for(self, mongo):
+        storage = get_storage()
+        meta = storage.db["meta"]
+        meta.update_one({"_id": "schema"}, {"$set": {
+            "version": 0, "locked_until": datetime.now(timezone.utc) + timedelta(seconds=60),
+        }})
+
+        started = []
+        thread = threading.Thread(target=lambda: started.append(get_storage()))
+        thread.start()
+        time.sleep(0.3)
+        assert not started
+
+        # The process holding the lock applies the migrations
+        meta.update_one({"_id": "schema"}, {"$set": {"version": len(MIGRATIONS)}, "$unset": {"locked_until": ""}})
+        thread.join(timeout=5)
+        assert started[0].migrations == {}
+
+
+class TestUsersCache:
+
+    PUB_PEM = (
+        b"-----BEGIN PUBLIC KEY-----\n"
+        b"MCowBQYDK2VwAyEAGb9ECWmEzf6FQbrBZ9w7lshQhqowtrbLDFw4rXAxZuE=\n"
+        b"-----END PUBLIC KEY-----\n"
+    )
+
+    def add_user(self, storage):
+        user = User("alice", "h", "pw", self.PUB_PEM)
+        user.set_srv_certificates(self.PUB_PEM, b"p")
+        return storage.db["users"].insert_one(user.to_mongo()).inserted_id
+
+    def test_invalidated_user_and_keys_are_dropped(self, mongo):
+        storage = get_storage()
+        uid = self.add_user(storage)
+        user = storage.get_user_by_uid(str(uid), cached=True)
+        load_public_key(user.u_pub_k)
+
+        storage.invalidate_user(uid)
+        assert storage.users_cache.get(str(uid)) is None
+        assert KEYS_CACHE.get(public_key_fingerprint(self.PUB_PEM)) is None
+        assert storage.get_user_by_uid(str(uid), cached=True) is not user
+
+
+class TestReadCursors:
+
+    def test_unread_messages_follow_numbers(self, mongo):
+        storage = get_storage()
+        chat = add_chat(storage)
+        # A slow writer stored message 1 with a newer id than message 2
+        second, first, third = add_messages(storage, chat, [2, 1, 3])
+
+        storage.set_read_cursor(chat, "bob", second)
+        storage.set_read_cursor(chat, "bob", first)
+
+        assert storage.get_read_cursor(chat, "bob")["seq"] == 2
+        assert [m.seq for m in storage.get_messages(chat, "bob")] == [3]
+        assert storage.count_unread(chat, "bob") == 1
+
+    def test_legacy_messages_are_compared_by_id(self, mongo):
+        storage = get_storage()
+        allow_legacy_messages(storage)
+        chat = add_chat(storage)
+        old, read = add_messages(storage, chat, [None, 1])
+        new_legacy, new = add_messages(storage, chat, [None, 2])
+
+        storage.set_read_cursor(chat, "bob", read)
+
+        assert [m.mid for m in storage.get_messages(chat, "bob")] == [new_legacy.mid, new.mid]
+
+    def test_cursor_without_number_is_compared_by_id(self, mongo):
+        storage = get_storage()
+        chat = add_chat(storage)
+        read, unread = add_messages(storage, chat, [1, 2])
+        storage.db["read_cursors"].insert_one({"chat_id": str(chat.cid), "user_id": "bob", "mid": read.mid})
+
+        assert [m.seq for m in storage.get_messages(chat, "bob")] == [2]
+
+
+class TestHistory:
+
+    def test_pages_follow_numbers(self, mongo):
+        storage = get_storage()
+        allow_legacy_messages(storage)
+        chat = add_chat(storage)
+        add_messages(storage, chat, [None, None, 2, 1, 4, 3, 5])
+
+        pages, cursor = [], None
+        while True:
+            messages, cursor = storage.get_history(chat, cursor=cursor, limit=2)
+            pages.append([m.seq for m in messages])
+            if cursor is None:
+                break
+
+        assert pages == [[5, 4], [3, 2], [1, None], [None]]
+
+    def test_before_cursor_round_trips(self, mongo):
+        storage = get_storage()
+        chat = add_chat(storage)
+        send(storage, chat, "a", "b", "c", "d", "e")
+        chat = storage.get_chat_by_cid(str(chat.cid), "bob@h")
+
+        pages, before = [], None
+        while True:
+            messages, cursor = storage.get_history(chat, cursor=before, limit=2)
+            pages.append([m.msg for m in messages])
+            if cursor is None:
+                break
+            # The client passes the cursor of the response back as the before parameter
+            before = json.loads(json.dumps({"cursor": cursor}))["cursor"]
+
+        assert pages == [["e", "d"], ["c", "b"], ["a"]]
+
+    def test_malformed_cursor_is_refused(self, mongo):
+        storage = get_storage()
+        chat = add_chat(storage)
+
+        for cursor in ("not a cursor", PychStorage.history_cursor(Message(chat, "bob", "a", 0, mid="x", seq=1))):
+            with pytest.raises(InvalidCursorException):
+                storage.get_history(chat, cursor=cursor)
+
+    def test_history_is_refused_to_non_members(self, mongo):
+        storage = get_storage()
+        chat = add_chat(storage)
+
+        assert storage.get_chat_by_cid(str(chat.cid), "alice@h").cid == chat.cid
+        for cid, login in ((chat.cid, "mallory@h"), (ObjectId(), "alice@h"), ("not an id", "alice@h")):
+            with pytest.raises(EntityNotFoundException):
+                storage.get_chat_by_cid(str(cid), login)
+
+
+class TestSync:
+
+    @pytest.fixture
+    def alice(self):
+        return User("alice", "h", None, None, uid="alice")
+
+    def test_changes_since_the_previous_sync(self, mongo, alice):
+        storage = get_storage()
+        first, second = add_chat(storage), add_chat(storage, "carol@h")
+        send(storage, first, "a", "b")
+
+        changes = storage.get_changes(alice)
+        assert {c.cid for c in changes["chats"]} == {first.cid, second.cid}
+        assert synced(changes) == {str(first.cid): ["a", "b"]}
+
+        send(storage, second, "c")
+        changes = storage.get_changes(alice, changes["token"])
+        assert changes["chats"] == []
+        assert synced(changes) == {str(second.cid): ["c"]}
+
+        assert synced(storage.get_changes(alice, changes["token"])) == {}
+
+    def test_token_can_be_used_again(self, mongo, alice):
+        storage = get_storage()
+        chat = add_chat(storage)
+        token = storage.get_changes(alice)["token"]
+        send(storage, chat, "a")
+
+        assert synced(storage.get_changes(alice, token)) == {str(chat.cid): ["a"]}
+        assert synced(storage.get_changes(alice, token)) == {str(chat.cid): ["a"]}
+
+    def test_newest_messages_are_returned(self, mongo, alice):
+        storage = get_storage()
+        chat = add_chat(storage)
+        token = storage.get_changes(alice)["token"]
+        send(storage, chat, "a", "b", "c", "d")
+
+        update = storage.get_changes(alice, token, limit=2)["updates"][0]
+        assert [m.msg for m in update["messages"]] == ["c", "d"]
+        older, cursor = storage.get_history(chat, update["cursor"])
+        assert [m.msg for m in older] == ["b", "a"]
+
+    def test_number_being_written_is_waited_for(self, mongo, alice):
+        storage = get_storage()
+        chat, other = add_chat(storage), add_chat(storage, "carol@h")
+        token = storage.get_changes(alice)["token"]
+        # Numbers 1 of both chats are reserved, their messages aren't stored yet
+        storage.reserve_seqs(chat.cid, 1)
+        storage.reserve_seqs(other.cid, 1)
+        send(storage, chat, "b")
+
+        changes = storage.get_changes(alice, token)
+        assert synced(changes) == {str(chat.cid): ["b"]}
+
+        storage.db["messages"].insert_one(Message(chat, "bob", "a", 0, seq=1).to_mongo())
+        changes = storage.get_changes(alice, changes["token"])
+        assert synced(changes) == {str(chat.cid): ["a", "b"]}
+
+        # The insert of the other chat failed, the number is skipped once a later message is synced
+        send(storage, other, "c")
+        changes = storage.get_changes(alice, changes["token"])
+        assert synced(changes) == {str(other.cid): ["c"]}
+        assert synced(storage.get_changes(alice, changes["token"])) == {}
+
+    def test_unread_messages_are_counted(self, mongo, alice):
+        storage = get_storage()
+        first, second = add_chat(storage), add_chat(storage, "carol@h")
+        send(storage, first, "a", "b", "c")
+        send(storage, first, "mine", author="alice")
+        send(storage, second, "d")
+        read = storage.get_messages(first, "alice")[0]
+        storage.set_read_cursor(first, "alice", read)
+
+        changes = storage.get_changes(alice, max_unread=1)
+        assert {str(u["chat"].cid): u["unread"] for u in changes["updates"]} == {
+            str(first.cid): 1, str(second.cid): 1,
+        }
+        assert storage.count_unread_by_chat([str(first.cid)], "alice") == {str(first.cid): 2}
+
+    def test_malformed_token_is_refused(self, mongo, alice):
+        storage = get_storage()
+
+        with pytest.raises(InvalidCursorException):
+            storage.get_changes(alice, "not a token")
+
+    def test_expired_token_syncs_everything(self, mongo, alice):
+        storage = get_storage()
+        chat = add_chat(storage)
+        send(storage, chat, "a")
+        token = storage.get_changes(alice)["token"]
+        storage.db["sync_states"].delete_many({})
+
+        changes = storage.get_changes(alice, token)
+        assert [c.cid for c in changes["chats"]] == [chat.cid]
+        assert synced(changes) == {str(chat.cid): ["a"]}
@@ -0,0 +1,38 @@
+import re
+import pytest
+from srv.app.storage import search
+
+
+class TestUserSearch:
+
+    def test_user_ngrams_are_prefixed_by_field(self):
+        assert search.get_user_ngrams("alice", "pc") == [
+            "n:ali", "n:ice", "n:lic"
+        ]
+        assert search.get_ngrams("al") == set()
+
+    def test_prefix_query_is_anchored_and_escaped(self):
+        query = search.prefix_query("a.*(")
+
+        assert query == {"$regex": "^a\\.\\*\\("}
+        assert re.match(query["$regex"], "a.*(b")
+        assert not re.match(query["$regex"], "abc")
+
+    def test_after_query_follows_sort_order(self):
+        assert search.after_query(("_id",), [1]) == {"_id": {"$gt": 1}}
+        assert search.after_query(("name", "hostname"), ["bob", "h1"]) == {
+            "$or": [
+                {"name": {"$gt": "bob"}},
+                {"name": "bob", "hostname": {"$gt": "h1"}},
+            ]
+        }
+
+    def test_cursor_roundtrip(self):
+        cursor = search.encode_cursor(["bob", "h1"])
+
+        assert search.decode_cursor(cursor, 2) == ["bob", "h1"]
+
+    @pytest.mark.parametrize("cursor", ["garbage", search.encode_cursor(["bob"]), "e30="])
+    def test_malformed_cursor_raises_exception(self, cursor):
+        with pytest.raises(ValueError):
+            search.decode_cursor(cursor, 2)
@@ -0,0 +1,42 @@
+from srv.app.storage.model import UserView
+
+
+DOC = {
+    "_id": "65a000000000000000000000",
+    "name": "alice",
+    "hostname": "host",
+    "password": "hash",
+    "u_pub_pem": "u_pub",
+    "s_pub_pem": b"s_pub",
+    "s_p_pem": b"s_p",
+}
+
+
+class TestUserView:
+
+    def test_full_view_fetches_whole_document(self):
+        assert UserView.FULL.projection() is None
+
+        user = UserView.FULL.load(DOC)
+        assert user.uid == DOC["_id"]
+        assert user.password == "hash"
+        assert user.u_pub_k == "u_pub"
+        assert user.s_p_k == b"s_p"
+
+    def test_login_view_skips_keys_and_password(self):
+        projection = UserView.LOGIN.projection()
+        assert projection == {"name": 1, "hostname": 1}
+
+        doc = {"_id": DOC["_id"], "name": "alice", "hostname": "host"}
+        user = UserView.LOGIN.load(doc)
+        assert str(user) == "alice@host"
+        assert user.password is None
+        assert user.s_pub_k is None
+
+    def test_auth_view_has_password_and_server_public_key(self):
+        projection = UserView.AUTH.projection()
+
+        assert "password" in projection
+        assert "s_pub_pem" in projection
+        assert "s_p_pem" not in projection
+        assert "u_pub_pem" not in projection
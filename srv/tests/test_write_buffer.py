@@ -0,0 +1,77 @@
+import threading
+import pytest
+from pymongo.errors import BulkWriteError
+from srv.app.storage.buffer import MessageWriteBuffer
+
+
+class FakeMessage:
+
+    def __init__(self, text):
+        self.msg = text
+        self.mid = None
+
+
+class FakeStorage:
+
+    def __init__(self, fail_from=None):
+        self.batches = []
+        self.fail_from = fail_from
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def add_messages(self, messages):
+        self.gate.wait()
+        self.batches.append([m.msg for m in messages])
+        for i, message in enumerate(messages):
+            message.mid = i
+
+        if self.fail_from is not None:
+            raise BulkWriteError({"nInserted": self.fail_from, "writeErrors": []})
+
+
+class TestMessageWriteBuffer:
+
+    def test_full_batch_is_written_at_once(self):
+        storage = FakeStorage()
+        buffer = MessageWriteBuffer(storage, batch_size=3, flush_interval=60, max_in_flight=10)
+
+        futures = [buffer.submit(FakeMessage(f"m{i}")) for i in range(3)]
+
+        assert [f.result(timeout=5).msg for f in futures] == ["m0", "m1", "m2"]
+        assert storage.batches == [["m0", "m1", "m2"]]
+        buffer.close()
+
+    def test_partial_batch_is_flushed_after_interval(self):
+        storage = FakeStorage()
+        buffer = MessageWriteBuffer(storage, batch_size=100, flush_interval=0.01, max_in_flight=10)
+
+        future = buffer.submit(FakeMessage("m0"))
+
+        assert future.result(timeout=5).mid == 0
+        assert buffer.stats()["written"] == 1
+        buffer.close()
+
+    def test_messages_after_failed_one_are_failed(self):
+        storage = FakeStorage(fail_from=1)
+        storage.gate.clear()
+        buffer = MessageWriteBuffer(storage, batch_size=2, flush_interval=60, max_in_flight=10)
+
+        futures = [buffer.submit(FakeMessage(f"m{i}")) for i in range(2)]
+        storage.gate.set()
+
+        assert futures[0].result(timeout=5).msg == "m0"
+        with pytest.raises(BulkWriteError):
+            futures[1].result(timeout=5)
+        assert buffer.stats()["failed"] == 1
+        buffer.close()
+
+    def test_close_writes_pending_messages(self):
+        storage = FakeStorage()
+        buffer = MessageWriteBuffer(storage, batch_size=100, flush_interval=60, max_in_flight=10)
+
+        future = buffer.submit(FakeMessage("m0"))
+        buffer.close(timeout=5)
+
+        assert future.done()
+        with pytest.raises(RuntimeError):
+            buffer.submit(FakeMessage("m1"))
@@ -0,0 +1,195 @@
+import json
+import asyncio
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from websockets.exceptions import ConnectionClosed
+from srv.app.ws_async import AsyncChatProtocol
+from srv.app.broker import ChatBroker
+from srv.app.heartbeat import AUTH_TIMEOUT
+from srv.app.storage.model import User, Chat, Message
+
+
+class FakeConnection:
+    """
+    websockets connection of a scripted client: frames put into incoming are received, sent frames are put
+    into sent.
+    """
+
+    def __init__(self):
+        self.incoming = asyncio.Queue()
+        self.sent = asyncio.Queue()
+        self.closed = None
+
+    async def recv(self):
+        frame = await self.incoming.get()
+        if frame is None:
+            raise ConnectionClosed(None, None)
+        return frame
+
+    async def send(self, frame):
+        await self.sent.put(frame)
+
+    async def close(self, code, reason):
+        self.closed = (code, reason)
+
+
+class FakeSP:
+
+    def decrypt(self, token):
+        return token.encode()
+
+
+class FakeStorage:
+
+    def __init__(self):
+        self.users = {uid: User(uid, "h", None, None, uid=uid) for uid in ("alice", "bob")}
+        self.chat = Chat(b"aes", None, "alice@h", "bob@h", cid="c1", plain=True)
+        self.messages = []
+        self.seqs = itertools.count(1)
+        self.replays = []
+        self.cursors = {}
+
+    def get_user_by_uid(self, uid, **kwargs):
+        return self.users[uid]
+
+    def get_users_by_filter(self, name='', hostname='', **kwargs):
+        return [u for u in self.users.values() if (u.name, u.hostname) == (name, hostname)]
+
+    def get_chat(self, src_user, dst_user):
+        return self.chat
+
+    def add_message(self, message):
+        message.seq = next(self.seqs)
+        message.mid = f"m{message.seq}"
+        self.messages.append(message)
+
+    def get_messages(self, chat, reader_id):
+        return [m for m in self.messages if m.seq > self.cursors.get(reader_id, 0) and m.author_id != reader_id]
+
+    def get_messages_after(self, chat, seq, limit):
+        self.replays.append(seq)
+        return [m for m in self.messages if m.seq > seq][:limit]
+
+    def set_read_cursor(self, chat, user_id, message):
+        self.cursors[user_id] = max(self.cursors.get(user_id, 0), message.seq)
+
+
+class Connection:
+    """
+    A connection served by AsyncChatProtocol.handle in a task of the running loop.
+    """
+
+    def __init__(self, storage, broker, executor, auth_timeout=None, replay_batch=100):
+        self.ws = FakeConnection()
+        self.protocol = AsyncChatProtocol(FakeSP(), self.ws, storage, broker, executor, replay_batch=replay_batch)
+        self.task = asyncio.create_task(self.protocol.handle(auth_timeout))
+
+    def send(self, **frame):
+        self.ws.incoming.put_nowait(json.dumps(frame))
+
+    async def receive(self):
+        return json.loads(await asyncio.wait_for(self.ws.sent.get(), 5))
+
+    async def close(self):
+        self.ws.incoming.put_nowait(None)
+        await asyncio.wait_for(self.task, 5)
+
+
+def run(scenario):
+    """
+    Run a scenario coroutine with a storage, a broker and an executor, as serve_wsapp does.
+    """
+
+    storage, broker = FakeStorage(), ChatBroker()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        asyncio.run(asyncio.wait_for(scenario(storage, broker, executor), 10))
+    return storage, broker
+
+
+def add_messages(storage, count):
+    for i in range(count):
+        storage.add_message(Message(storage.chat, "alice", f"m{i}", i))
+
+
+class TestAsyncChatProtocol:
+
+    def test_client_authenticates_after_an_error(self):
+        async def scenario(storage, broker, executor):
+            connection = Connection(storage, broker, executor)
+            connection.send(token="nobody", dest_login="bob@h")
+            assert await connection.receive() == {"error": "incorrect auth frame"}
+
+            connection.send(token="alice", dest_login="bob@h")
+            assert await connection.receive() == {"status": "ok", "login": "alice@h"}
+            await connection.close()
+
+        _, broker = run(scenario)
+        assert broker.stats()["subscribed_chats"] == 0
+
+    def test_silent_client_is_closed_after_the_auth_timeout(self):
+        async def scenario(storage, broker, executor):
+            connection = Connection(storage, broker, executor, auth_timeout=0.05)
+            await asyncio.wait_for(connection.task, 5)
+
+            assert connection.ws.closed == (1008, "authentication timeout")
+            assert connection.protocol.reaped == AUTH_TIMEOUT
+            assert connection.ws.sent.empty()
+
+        run(scenario)
+
+    def test_messages_are_delivered_and_acknowledged(self):
+        async def scenario(storage, broker, executor):
+            alice, bob = Connection(storage, broker, executor), Connection(storage, broker, executor)
+            alice.send(token="alice", dest_login="bob@h", acks=True)
+            bob.send(token="bob", dest_login="alice@h")
+            await alice.receive()
+            await bob.receive()
+            # Both connections are subscribed once the broker has their callbacks
+            while broker.subscriber_count("c1") < 2:
+                await asyncio.sleep(0.01)
+
+            alice.send(msg="hello", timestamp=1, id="x")
+            assert await alice.receive() == {"status": "ack", "id": "x", "timestamp": 1, "mid": "m1", "seq": 1}
+            frame = await bob.receive()
+            assert (frame["msg"], frame["seq"], frame["author_id"]) == ("hello", 1, "alice")
+            # The read cursor is moved after the frame is sent
+            while "bob" not in storage.cursors:
+                await asyncio.sleep(0.01)
+
+            await alice.close()
+            await bob.close()
+            # Own messages aren't delivered back
+            assert alice.ws.sent.empty()
+
+        storage, _ = run(scenario)
+        assert storage.cursors == {"bob": 1}
+
+    def test_resume_replays_the_missed_messages_in_batches(self):
+        async def scenario(storage, broker, executor):
+            add_messages(storage, 5)
+            connection = Connection(storage, broker, executor, replay_batch=2)
+            connection.send(token="bob", dest_login="alice@h", resume_from=2)
+            assert (await connection.receive())["status"] == "ok"
+
+            assert [(await connection.receive())["seq"] for _ in range(3)] == [3, 4, 5]
+            while storage.cursors.get("bob") != 5:
+                await asyncio.sleep(0.01)
+            await connection.close()
+
+        storage, _ = run(scenario)
+        assert storage.replays == [2, 4]
+        assert storage.cursors == {"bob": 5}
+
+    def test_unread_messages_are_sent_without_resume(self):
+        async def scenario(storage, broker, executor):
+            add_messages(storage, 3)
+            storage.cursors["bob"] = 1
+            connection = Connection(storage, broker, executor)
+            connection.send(token="bob", dest_login="alice@h")
+            await connection.receive()
+
+            assert [(await connection.receive())["seq"] for _ in range(2)] == [2, 3]
+            await connection.close()
+
+        storage, _ = run(scenario)
+        assert storage.replays == []
@@ -0,0 +1,236 @@
+import os
+import base64
+import queue
+import threading
+import pytest
+from wsocket import WebSocketError
+from srv.app.ws import ChatProtocol
+from srv.app.broker import ChatBroker
+from srv.app.framing import JSONFraming, MsgpackFraming
+from srv.app.storage.model import User, Chat, Message
+
+
+class FakeWebSocket:
+    """
+    Connection of a scripted client: frames put into incoming are received, sent frames are put into sent.
+    """
+
+    def __init__(self):
+        self.incoming = queue.Queue()
+        self.sent = queue.Queue()
+
+    def receive(self):
+        frame = self.incoming.get()
+        if frame is None:
+            raise WebSocketError("connection closed")
+        return frame
+
+    def send(self, frame):
+        self.sent.put(frame)
+
+    def abort(self):
+        self.incoming.put(None)
+
+
+class FakeSP:
+
+    def decrypt(self, token):
+        return token.encode()
+
+
+class FakeStorage:
+
+    def __init__(self):
+        self.users = {uid: User(uid, "h", None, None, uid=uid) for uid in ("alice", "bob")}
+        self.chats = {cid: Chat(b"aes", None, "alice@h", "bob@h", cid=cid, plain=True) for cid in ("c1", "c2")}
+        self.cursors = {}
+        self.messages = []
+        self.replays = []
+        # Set by a test to publish messages while the backlog is read
+        self.backlog_read = None
+
+    def get_user_by_uid(self, uid, **kwargs):
+        return self.users[uid]
+
+    def get_chat_by_cid(self, cid, login):
+        return self.chats[cid]
+
+    def get_messages(self, chat, reader_id):
+        if self.backlog_read is not None:
+            self.backlog_read.wait(timeout=5)
+        return []
+
+    def get_messages_after(self, chat, seq, limit):
+        self.replays.append(seq)
+        return [m for m in self.messages if m.chat.cid == chat.cid and m.seq > seq][:limit]
+
+    def set_read_cursor(self, chat, user_id, message):
+        self.cursors[str(chat.cid)] = message.seq
+
+
+class Connection:
+    """
+    A version 2 connection of bob, served by the reader and writer threads as the threaded server does.
+    """
+
+    def __init__(self, storage, broker, framing=JSONFraming, replay_batch=100, **auth):
+        self.ws = FakeWebSocket()
+        self.protocol = ChatProtocol(FakeSP(), self.ws, storage, broker, replay_batch=replay_batch, framing=framing)
+        assert self.protocol.authenticate({"token": "bob", "version": 2, **auth})["status"] == "ok"
+
+        self.threads = [
+            threading.Thread(target=self.protocol.serve_new_messages, daemon=True),
+            threading.Thread(target=self.protocol.communicate, daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def send(self, **frame):
+        self.ws.incoming.put(self.protocol.dump_message(frame))
+
+    def receive(self):
+        return self.protocol.parse_message(self.ws.sent.get(timeout=5))
+
+    def close(self):
+        self.ws.incoming.put(None)
+        for thread in self.threads:
+            thread.join(timeout=5)
+
+
+@pytest.fixture
+def storage():
+    return FakeStorage()
+
+
+@pytest.fixture
+def broker():
+    return ChatBroker()
+
+
+@pytest.fixture
+def connect(storage, broker):
+    connections = []
+
+    def connect(framing=JSONFraming, replay_batch=100, **auth):
+        connections.append(Connection(storage, broker, framing, replay_batch, **auth))
+        return connections[-1]
+
+    yield connect
+    for connection in connections:
+        connection.close()
+
+
+def publish(broker, storage, cid, text, seq):
+    broker.publish(cid, Message(storage.chats[cid], "alice", text, 0, mid=f"{cid}-{seq}", seq=seq))
+
+
+class TestMultiplexing:
+
+    def test_subscribed_chats_share_the_connection(self, storage, broker, connect):
+        connection = connect()
+        for cid in ("c1", "c2"):
+            connection.send(type="subscribe", chat=cid)
+            assert connection.receive() == {"type": "subscribed", "chat": cid}
+
+        publish(broker, storage, "c1", "to c1", 1)
+        publish(broker, storage, "c2", "to c2", 1)
+        received = [connection.receive() for _ in range(2)]
+        assert [(f["type"], f["chat"], f["msg"]) for f in received] == [
+            ("message", "c1", "to c1"), ("message", "c2", "to c2"),
+        ]
+
+        connection.send(type="unsubscribe", chat="c2")
+        assert connection.receive() == {"type": "unsubscribed", "chat": "c2"}
+
+        publish(broker, storage, "c2", "gone", 2)
+        publish(broker, storage, "c1", "still", 2)
+        frame = connection.receive()
+        assert (frame["chat"], frame["msg"]) == ("c1", "still")
+
+        connection.close()
+        assert connection.ws.sent.empty()
+        assert storage.cursors == {"c1": 2, "c2": 1}
+        assert broker.stats()["subscribed_chats"] == 0
+
+    def test_messages_of_other_chats_are_refused(self, connect):
+        connection = connect()
+        connection.send(type="message", chat="c1", msg="hi", timestamp=0)
+
+        assert connection.receive() == {"type": "error", "chat": "c1", "error": "not subscribed"}
+
+
+class TestBatches:
+
+    @pytest.mark.parametrize("framing", [JSONFraming, MsgpackFraming])
+    def test_burst_is_delivered_in_one_frame(self, storage, broker, connect, framing):
+        ciphertexts = [os.urandom(16 + seq) for seq in range(1, 6)]
+        storage.backlog_read = threading.Event()
+        connection = connect(framing, batch=True)
+        connection.send(type="subscribe", chat="c1")
+        assert connection.receive() == {"type": "subscribed", "chat": "c1"}
+
+        # The burst is queued while the backlog is read, it is taken from the inbox at once
+        for seq, ciphertext in enumerate(ciphertexts, 1):
+            publish(broker, storage, "c1", base64.b64encode(ciphertext).decode(), seq)
+        storage.backlog_read.set()
+        raw = connection.ws.sent.get(timeout=5)
+        connection.close()
+        assert connection.ws.sent.empty()
+
+        frame = connection.protocol.parse_message(raw)
+        assert (frame["type"], frame["chat"]) == ("batch", "c1")
+        assert [m["seq"] for m in frame["messages"]] == [1, 2, 3, 4, 5]
+        # Raw bytes in msgpack, base64 in JSON
+        stored = [base64.b64encode(ciphertext).decode() for ciphertext in ciphertexts]
+        assert [m["msg"] for m in frame["messages"]] == [framing.message({"msg": msg})["msg"] for msg in stored]
+        assert storage.cursors == {"c1": 5}
+
+
+class TestResume:
+
+    def add_messages(self, storage, cid, count):
+        storage.messages += [
+            Message(storage.chats[cid], "alice", f"m{seq}", 0, mid=f"{cid}-{seq}", seq=seq)
+            for seq in range(1, count + 1)
+        ]
+
+    def test_missed_messages_are_replayed_in_batches(self, storage, connect):
+        self.add_messages(storage, "c1", 5)
+        connection = connect(replay_batch=2)
+        connection.send(type="subscribe", chat="c1", resume_from=1)
+        assert connection.receive() == {"type": "subscribed", "chat": "c1"}
+
+        assert [connection.receive()["seq"] for _ in range(4)] == [2, 3, 4, 5]
+        connection.close()
+        assert connection.ws.sent.empty()
+        # A batch shorter than replay_batch ends the replay
+        assert storage.replays == [1, 3, 5]
+        assert storage.cursors == {"c1": 5}
+
+    def test_offset_past_the_last_message_sends_nothing(self, storage, connect):
+        self.add_messages(storage, "c1", 3)
+        connection = connect()
+        connection.send(type="subscribe", chat="c1", resume_from=10)
+        assert connection.receive() == {"type": "subscribed", "chat": "c1"}
+
+        connection.close()
+        assert connection.ws.sent.empty()
+        assert storage.replays == [10]
+        assert storage.cursors == {}
+
+    @pytest.mark.parametrize("offset", [-1, "1", 1.5, True])
+    def test_malformed_offset_is_refused(self, storage, connect, offset):
+        connection = connect()
+        connection.send(type="subscribe", chat="c1", resume_from=offset)
+        assert connection.receive() == {"type": "error", "chat": "c1", "error": "invalid resume_from"}
+
+        connection.close()
+        assert storage.replays == []
+
+    @pytest.mark.parametrize("offset", [-1, "1", True])
+    def test_malformed_offset_fails_authentication(self, storage, broker, offset):
+        protocol = ChatProtocol(FakeSP(), FakeWebSocket(), storage, broker)
+
+        result = protocol.authenticate({"token": "bob", "dest_login": "alice@h", "resume_from": offset})
+        assert result == {"error": "invalid resume_from"}
+        assert protocol.chats == {}